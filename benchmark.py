@@ -0,0 +1,242 @@
+"""
+Benchmark offline do ETL.
+
+Gera respostas sintéticas a partir do schema.json (opções válidas para RADIO,
+CHECKBOX e escalas, texto livre realista para área de atuação e ferramentas),
+mede cada etapa do transform() e o transform() completo, e acrescenta o
+resultado em um arquivo JSON Lines para comparar entre commits.
+
+Uso:
+    python benchmark.py                          # 1k, 100k e 1M linhas
+    python benchmark.py --tamanhos 1000 100000 --repeticoes 3
+    python benchmark.py --comparar               # só mostra as duas últimas execuções
+"""
+import argparse
+import atexit
+import contextlib
+import io
+import json
+import logging
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+# Caches e modelo de área de atuação num diretório temporário criado aqui,
+# apagado a cada repetição e na saída. ETL_CACHE_DIR é sobrescrito e
+# ETL_MODELO_AREA removido (teria precedência sobre o cache), então um valor
+# exportado para a execução real nunca é lido nem apagado pelo benchmark.
+DIRETORIO_CACHE_BENCHMARK = tempfile.mkdtemp(prefix="etl_bench_")
+atexit.register(shutil.rmtree, DIRETORIO_CACHE_BENCHMARK, ignore_errors=True)
+os.environ["ETL_CACHE_DIR"] = DIRETORIO_CACHE_BENCHMARK
+os.environ.pop("ETL_MODELO_AREA", None)
+
+import etl  # noqa: E402
+
+CAMINHO_RESULTADOS = os.path.join("benchmarks", "resultados.jsonl")
+
+# Textos livres típicos das respostas reais
+AREAS_LIVRES = [
+    'Vigilância Epidemiológica', 'VIEP', 'Vigilancia epidemiologica - VIEP', 'VISA', 'Vigilância Sanitária',
+    'Administrativo', 'setor administrativo', 'Enfermagem', 'Enfermeira', 'Saúde Bucal', 'Odontologia',
+    'Farmácia', 'Assistência farmacêutica', 'TI', 'Informática', 'Nutrição', 'Imunização', 'Sala de vacina',
+    'Saúde da Mulher', 'Saúde da Criança', 'Saúde do Adolescente', 'NUGET', 'Epidemiologia', 'Sanitarista',
+    'Serviços gerais', 'Motorista', 'RH', 'Departamento pessoal', 'Técnico de referência', 'Referência técnica',
+    'Curativos', 'Tuberculose', 'Ouvidoria', 'Diretoria', 'Coordenação', 'Apoio institucional', '',
+]
+FERRAMENTAS_LIVRES = [
+    'Qlik', 'Tabwin e Excel', 'R', 'Python', 'SIM e SINASC', 'dashboard da APS', 'Power BI', 'LibreOffice Calc',
+    'ppt', 'Não faz análise', 'e-SUS', 'Tableau', 'caderno', 'Google Forms',
+]
+TEXTOS_LIVRES = [
+    'Cobertura vacinal, mortalidade infantil e sífilis congênita', 'E-mail e reuniões mensais',
+    'Grupo de WhatsApp com as áreas técnicas', 'Ofícios', 'Painel de arboviroses', 'Painel da APS',
+    'Planejamento das ações de vacinação', 'Busca ativa de faltosos', '', '',
+]
+
+
+def _perguntas(caminho_schema: str = etl.CAMINHO_SCHEMA) -> list[dict]:
+    """
+    Uma entrada por coluna da planilha de respostas, na ordem do formulário.
+    """
+    with open(caminho_schema, encoding="utf-8") as f:
+        schema = json.load(f)
+
+    perguntas = []
+    for item in schema.get("items", []):
+        pergunta = item.get("questionItem", {}).get("question")
+        if pergunta:
+            escolha = pergunta.get("choiceQuestion")
+            escala = pergunta.get("scaleQuestion")
+            if escolha:
+                perguntas.append({
+                    'titulo': item['title'],
+                    'tipo': escolha.get('type'),
+                    'opcoes': [o['value'] for o in escolha['options'] if 'value' in o],
+                    'outro': any(o.get('isOther') for o in escolha['options']),
+                })
+            elif escala:
+                opcoes = [str(i) for i in range(escala.get('low', 0), escala.get('high', 5) + 1)]
+                perguntas.append({'titulo': item['title'], 'tipo': 'RADIO', 'opcoes': opcoes, 'outro': False})
+            else:
+                perguntas.append({'titulo': item['title'], 'tipo': 'TEXT', 'opcoes': [], 'outro': False})
+
+        grade = item.get("questionGroupItem")
+        if grade:
+            opcoes = [o['value'] for o in grade['grid']['columns']['options'] if 'value' in o]
+            for linha in grade.get('questions', []):
+                perguntas.append({
+                    'titulo': f"{item['title']} [{linha['rowQuestion']['title']}]",
+                    'tipo': 'RADIO',
+                    'opcoes': opcoes,
+                    'outro': False,
+                })
+    return perguntas
+
+
+def _combinacoes_checkbox(rng: np.random.Generator, opcoes: list[str], livres: list[str], quantidade: int = 300) -> list[str]:
+    """
+    Conjunto finito de respostas CHECKBOX (as reais se repetem muito).
+    """
+    combinacoes = []
+    for _ in range(quantidade):
+        k = int(rng.integers(1, min(4, len(opcoes)) + 1))
+        escolhidas = [opcoes[i] for i in sorted(rng.choice(len(opcoes), size=k, replace=False))]
+        if livres and rng.random() < 0.25:
+            escolhidas.append(livres[int(rng.integers(len(livres)))])
+        combinacoes.append(', '.join(escolhidas))
+    return combinacoes
+
+
+def gerar_respostas(n: int, seed: int = 42, caminho_schema: str = etl.CAMINHO_SCHEMA) -> pd.DataFrame:
+    """
+    DataFrame bruto com n respostas sintéticas no layout da planilha do Forms.
+    """
+    rng = np.random.default_rng(seed)
+    inicio = np.datetime64('2025-01-01T08:00:00')
+    segundos = np.sort(rng.integers(0, 300 * 24 * 3600, size=n))
+    instantes = pd.to_datetime(inicio + segundos.astype('timedelta64[s]'))
+    dados = {etl.COLUNA_TIMESTAMP: instantes.strftime("%d/%m/%Y %H:%M:%S")}
+
+    for pergunta in _perguntas(caminho_schema):
+        titulo, tipo, opcoes = pergunta['titulo'], pergunta['tipo'], pergunta['opcoes']
+        if titulo.startswith('3 '):
+            valores = opcoes + AREAS_LIVRES
+        elif tipo == 'CHECKBOX':
+            livres = FERRAMENTAS_LIVRES if pergunta['outro'] else []
+            valores = _combinacoes_checkbox(rng, opcoes, livres)
+        elif tipo == 'TEXT':
+            valores = TEXTOS_LIVRES
+        else:
+            valores = opcoes
+        dados[titulo] = np.asarray(valores, dtype=object)[rng.integers(0, len(valores), size=n)]
+
+    return pd.DataFrame(dados)
+
+
+def _medir_transform(df_bruto: pd.DataFrame) -> dict:
+    tempos = {}
+    df = df_bruto.copy()
+    inicio_total = time.perf_counter()
+    for nome, etapa in etl.ETAPAS_TRANSFORM:
+        inicio = time.perf_counter()
+        df = etl.aplicar_etapa(etapa, df)
+        tempos[nome] = round(time.perf_counter() - inicio, 4)
+    tempos['transform_total'] = round(time.perf_counter() - inicio_total, 4)
+    return tempos
+
+
+def executar(tamanhos: list[int], repeticoes: int = 1, seed: int = 42) -> list[dict]:
+    resultados = []
+    for n in tamanhos:
+        print(f"Gerando {n} respostas sintéticas...", file=sys.stderr)
+        df_bruto = gerar_respostas(n, seed)
+
+        medicoes = []
+        for _ in range(repeticoes):
+            # Sem modelo salvo: mede sempre o ajuste completo do agrupamento
+            shutil.rmtree(DIRETORIO_CACHE_BENCHMARK, ignore_errors=True)
+            with contextlib.redirect_stdout(io.StringIO()):
+                medicoes.append(_medir_transform(df_bruto))
+
+        # Melhor tempo de cada etapa entre as repetições
+        melhores = {etapa: min(m[etapa] for m in medicoes) for etapa in medicoes[0]}
+        resultados.append({'linhas': n, 'tempos_s': melhores})
+        print(f"  {n} linhas: transform {melhores['transform_total']:.3f}s", file=sys.stderr)
+    return resultados
+
+
+def _commit_atual() -> str | None:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              check=True, cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def salvar_resultados(resultados: list[dict], caminho: str = CAMINHO_RESULTADOS, repeticoes: int = 1):
+    registro = {
+        'data': datetime.now().isoformat(timespec="seconds"),
+        'commit': _commit_atual(),
+        'python': platform.python_version(),
+        'pandas': pd.__version__,
+        'repeticoes': repeticoes,
+        'resultados': resultados,
+    }
+    os.makedirs(os.path.dirname(caminho) or '.', exist_ok=True)
+    with open(caminho, "a", encoding="utf-8") as f:
+        f.write(json.dumps(registro, ensure_ascii=False) + "\n")
+    return registro
+
+
+def comparar(caminho: str = CAMINHO_RESULTADOS):
+    """
+    Mostra a variação por etapa entre as duas últimas execuções registradas.
+    """
+    if not os.path.exists(caminho):
+        print("Nenhum resultado registrado ainda.")
+        return
+    with open(caminho, encoding="utf-8") as f:
+        registros = [json.loads(linha) for linha in f if linha.strip()]
+    if len(registros) < 2:
+        print("É preciso ao menos duas execuções para comparar.")
+        return
+
+    anterior, atual = registros[-2], registros[-1]
+    print(f"Comparando {anterior['commit']} ({anterior['data']}) -> {atual['commit']} ({atual['data']})")
+    antes = {r['linhas']: r['tempos_s'] for r in anterior['resultados']}
+    for resultado in atual['resultados']:
+        base = antes.get(resultado['linhas'])
+        if base is None:
+            continue
+        print(f"\n{resultado['linhas']} linhas")
+        for etapa, tempo in resultado['tempos_s'].items():
+            if etapa in base and base[etapa] > 0:
+                print(f"  {etapa:<36} {base[etapa]:>9.4f}s -> {tempo:>9.4f}s  ({tempo / base[etapa] - 1:+.0%})")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark offline das etapas do transform().")
+    parser.add_argument("--tamanhos", type=int, nargs="+", default=[1_000, 100_000, 1_000_000])
+    parser.add_argument("--repeticoes", type=int, default=1)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--saida", default=CAMINHO_RESULTADOS)
+    parser.add_argument("--comparar", action="store_true", help="só compara as duas últimas execuções")
+    args = parser.parse_args()
+
+    if not args.comparar:
+        logging.getLogger("ETL").setLevel(logging.WARNING)
+        resultados = executar(args.tamanhos, args.repeticoes, args.seed)
+        salvar_resultados(resultados, args.saida, args.repeticoes)
+    comparar(args.saida)
+
+
+if __name__ == "__main__":
+    main()
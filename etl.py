@@ -1,16 +1,22 @@
-8import json
+import argparse
+import cProfile
+import contextlib
+import hashlib
+import json
 import os
+import pickle
 from typing import Counter
 import pandas as pd
-import gspread
-from google.oauth2.service_account import Credentials
 import logging
 from datetime import datetime
+from functools import lru_cache, partial
+from itertools import combinations
 import numpy as np
+import random
+import tempfile
+import threading
 import time
-
-from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.cluster import KMeans
+import tracemalloc
 import re
 import unicodedata
 
@@ -23,8 +29,101 @@ logging.basicConfig(
 logger = logging.getLogger("ETL")
 
 
+# -------------------------------------------------------------------
+# INSTRUMENTAÇÃO – TEMPO, CPU E MEMÓRIA POR ETAPA
+# -------------------------------------------------------------------
+# ETL_PERFIL=1 registra cada etapa (tempo de parede, CPU, pico de memória,
+# linhas/colunas) e salva um JSON em ETL_PERFIL_DIR; ETL_PERFIL_CPROFILE=1
+# também grava um .pstats por etapa. Desligado, medir() só chama a função.
+PERFIL_ATIVO = os.environ.get("ETL_PERFIL", "0") == "1"
+PERFIL_CPROFILE = os.environ.get("ETL_PERFIL_CPROFILE", "0") == "1"
+DIRETORIO_PERFIL = os.environ.get("ETL_PERFIL_DIR", "perfil")
+
+_registros_perfil: list[dict] = []
+# tracemalloc e process_time são do processo inteiro: com cargas simultâneas
+# (executar_cargas assíncrono) os números de uma etapa incluiriam as outras,
+# então pico de memória e CPU ficam em None
+_etapa_isolada = True
+_inicio_execucao = datetime.now().strftime("%Y%m%d_%H%M%S")
+
+
+def _primeiro_dataframe(valor):
+    if isinstance(valor, pd.DataFrame):
+        return valor
+    if isinstance(valor, (tuple, list)):
+        return next((v for v in valor if isinstance(v, pd.DataFrame)), None)
+    return None
+
+
+def medir(nome: str, funcao, *args, **kwargs):
+    """
+    Executa funcao(*args, **kwargs) registrando as métricas da etapa `nome`.
+    Linhas/colunas de entrada vêm do primeiro DataFrame nos argumentos e as de
+    saída do primeiro DataFrame no retorno.
+    """
+    if not PERFIL_ATIVO:
+        return funcao(*args, **kwargs)
+
+    entrada = _primeiro_dataframe(list(args) + list(kwargs.values()))
+    isolada = _etapa_isolada
+    if isolada:
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+        memoria_inicial, _ = tracemalloc.get_traced_memory()
+        tracemalloc.reset_peak()
+
+    perfil = cProfile.Profile() if PERFIL_CPROFILE else None
+    parede, cpu = time.perf_counter(), time.process_time()
+    if perfil:
+        perfil.enable()
+    try:
+        resultado = funcao(*args, **kwargs)
+    finally:
+        if perfil:
+            perfil.disable()
+        parede, cpu = time.perf_counter() - parede, time.process_time() - cpu
+        if isolada:
+            _, pico = tracemalloc.get_traced_memory()
+
+    saida = _primeiro_dataframe(resultado)
+    registro = {
+        'etapa': nome,
+        'tempo_s': round(parede, 4),
+        'cpu_s': round(cpu, 4) if isolada else None,
+        'pico_memoria_mb': round((pico - memoria_inicial) / 2**20, 2) if isolada else None,
+        'linhas_entrada': len(entrada) if entrada is not None else None,
+        'linhas_saida': len(saida) if saida is not None else None,
+        'colunas_saida': len(saida.columns) if saida is not None else None,
+    }
+    if perfil:
+        os.makedirs(DIRETORIO_PERFIL, exist_ok=True)
+        caminho = os.path.join(DIRETORIO_PERFIL, f"{_inicio_execucao}_{len(_registros_perfil):02d}_{nome}.pstats")
+        perfil.dump_stats(caminho)
+        registro['pstats'] = caminho
+
+    _registros_perfil.append(registro)
+    logger.info(f"PERFIL {json.dumps(registro, ensure_ascii=False)}")
+    return resultado
+
+
+def salvar_perfil(caminho: str | None = None) -> str | None:
+    """
+    Grava as métricas registradas nesta execução em JSON e devolve o caminho.
+    """
+    if not _registros_perfil:
+        return None
+    caminho = caminho or os.path.join(DIRETORIO_PERFIL, f"perfil_{_inicio_execucao}.json")
+    os.makedirs(os.path.dirname(caminho) or '.', exist_ok=True)
+    with open(caminho, "w", encoding="utf-8") as f:
+        json.dump({'execucao': _inicio_execucao, 'etapas': _registros_perfil}, f, ensure_ascii=False, indent=2)
+    logger.info(f"Perfil da execução salvo em {caminho}")
+    return caminho
+
+
 # CARREGA CREDENCIAIS DO GOOGLE SHEETS DAS VARIÁVEIS DE AMBIENTE
 def load_google_credentials():
+    from google.oauth2.service_account import Credentials
+
     json_path = os.environ.get("GOOGLE_CREDENTIALS_JSON")
     if not json_path:
         raise ValueError("Variável GOOGLE_CREDENTIALS_JSON não definida.")
@@ -37,14 +136,100 @@ def load_google_credentials():
     return Credentials.from_service_account_file(json_path, scopes=scopes)
 
 
+# -------------------------------------------------------------------
+# SESSÃO DO GOOGLE SHEETS – CLIENTE E PLANILHAS REAPROVEITADOS
+# -------------------------------------------------------------------
+class SessaoSheets:
+    """
+    Autentica uma única vez e guarda as planilhas e abas já abertas. Extract e
+    load (e várias planilhas/abas no mesmo processo) compartilham o mesmo
+    cliente gspread e, com ele, a mesma sessão HTTP e suas conexões.
+    """
+
+    def __init__(self, credenciais=None):
+        self._credenciais = credenciais
+        self._client = None
+        self._planilhas = {}
+        self._abas = {}
+        self._trava = threading.RLock()
+
+    @property
+    def client(self):
+        import gspread
+
+        with self._trava:
+            if self._client is None:
+                if self._credenciais is None:
+                    self._credenciais = load_google_credentials()
+                self._client = gspread.authorize(self._credenciais)
+                logger.info("Cliente do Google Sheets autenticado.")
+            return self._client
+
+    def planilha(self, sheet_id: str):
+        with self._trava:
+            if sheet_id not in self._planilhas:
+                self._planilhas[sheet_id] = self.client.open_by_key(sheet_id)
+            return self._planilhas[sheet_id]
+
+    def aba(self, sheet_id: str, tab_name: str):
+        """
+        Worksheet da aba, aberta só na primeira vez. Levanta WorksheetNotFound.
+        """
+        with self._trava:
+            chave = (sheet_id, tab_name)
+            if chave not in self._abas:
+                self._abas[chave] = self.planilha(sheet_id).worksheet(tab_name)
+            return self._abas[chave]
+
+    def abas(self, sheet_id: str) -> dict:
+        """
+        Todas as abas da planilha numa única chamada; renova o cache dela.
+        """
+        with self._trava:
+            abas = {ws.title: ws for ws in self.planilha(sheet_id).worksheets()}
+            self._abas = {chave: ws for chave, ws in self._abas.items() if chave[0] != sheet_id}
+            self._abas.update({(sheet_id, titulo): ws for titulo, ws in abas.items()})
+            return abas
+
+    def guardar_aba(self, sheet_id: str, ws):
+        with self._trava:
+            self._abas[(sheet_id, ws.title)] = ws
+
+    def esquecer_aba(self, sheet_id: str, *tab_names: str):
+        """
+        Descarta handles que ficaram desatualizados (aba renomeada, apagada ou
+        com a grade alterada por fora do objeto Worksheet).
+        """
+        with self._trava:
+            for tab_name in tab_names:
+                self._abas.pop((sheet_id, tab_name), None)
+
+    def fechar(self):
+        with self._trava:
+            if self._client is not None:
+                self._client.http_client.session.close()
+            self._client, self._planilhas, self._abas = None, {}, {}
+
+
+_sessao_sheets = None
+
+
+def sessao_sheets() -> SessaoSheets:
+    """
+    Sessão compartilhada pelo processo inteiro.
+    """
+    global _sessao_sheets
+    if _sessao_sheets is None:
+        _sessao_sheets = SessaoSheets()
+    return _sessao_sheets
+
+
 # EXTRACT – LE O GOOGLE SHEETS
-def extract(sheet_id: str, tab_name: str):
+def extract(sheet_id: str, tab_name: str, client: SessaoSheets | None = None):
     logger.info(f"Lendo planilha: {sheet_id} | Aba: {tab_name}")
 
-    creds = load_google_credentials()
-    client = gspread.authorize(creds)
-
-    ws = client.open_by_key(sheet_id).worksheet(tab_name)
+    client = client or sessao_sheets()
+    ws = client.aba(sheet_id, tab_name)
 
     # Mais rápido que get_all_records
     values = ws.get_all_values()
@@ -53,15 +238,343 @@ def extract(sheet_id: str, tab_name: str):
     logger.info(f"Linhas carregadas: {len(df)}")
     return df, client
 
+
+# -------------------------------------------------------------------
+# EXTRACT INCREMENTAL – LE APENAS AS LINHAS NOVAS
+# -------------------------------------------------------------------
+COLUNA_TIMESTAMP = "Carimbo de data/hora"
+DIRETORIO_CACHE = os.environ.get("ETL_CACHE_DIR", ".etl_cache")
+
+
+def _caminho_cache(sheet_id: str, tab_name: str, sufixo: str, diretorio: str = DIRETORIO_CACHE) -> str:
+    nome = re.sub(r'[^\w-]', '_', f"{sheet_id}_{tab_name}")
+    return os.path.join(diretorio, f"{nome}.{sufixo}")
+
+
+def carregar_marca_dagua(sheet_id: str, tab_name: str, diretorio: str = DIRETORIO_CACHE) -> dict | None:
+    """
+    Lê a marca d'água (linhas já processadas + último timestamp) salva localmente.
+    """
+    caminho = _caminho_cache(sheet_id, tab_name, "marca.json", diretorio)
+    if not os.path.exists(caminho):
+        return None
+    with open(caminho, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def salvar_marca_dagua(sheet_id: str, tab_name: str, marca: dict, diretorio: str = DIRETORIO_CACHE):
+    os.makedirs(diretorio, exist_ok=True)
+    caminho = _caminho_cache(sheet_id, tab_name, "marca.json", diretorio)
+    temporario = caminho + ".tmp"
+    with open(temporario, "w", encoding="utf-8") as f:
+        json.dump(marca, f, ensure_ascii=False, indent=2)
+    os.replace(temporario, caminho)
+
+
+def extract_incremental(sheet_id: str, tab_name: str, marca: dict | None, client: SessaoSheets | None = None):
+    """
+    Lê apenas as linhas posteriores à marca d'água.
+
+    O cabeçalho e o intervalo a partir da última linha processada vêm em uma
+    única chamada (batch_get). Se o cabeçalho mudou ou a última linha
+    processada não tem mais o mesmo timestamp (linhas apagadas/reordenadas),
+    faz a leitura completa.
+
+    Retorna (df_novos, client, marca_nova, completo).
+    """
+    client = client or sessao_sheets()
+    if not marca or marca.get("linhas", 0) == 0:
+        df, client = extract(sheet_id, tab_name, client)
+        return df, client, _gerar_marca(df), True
+
+    logger.info(f"Lendo planilha (incremental): {sheet_id} | Aba: {tab_name} | "
+                f"já processadas: {marca['linhas']}")
+
+    import gspread
+
+    ws = client.aba(sheet_id, tab_name)
+
+    # Linha da planilha da última resposta processada (linha 1 = cabeçalho)
+    ultima_linha = marca["linhas"] + 1
+    ultima_coluna = re.sub(r'\d', '', gspread.utils.rowcol_to_a1(1, len(marca["colunas"])))
+    cabecalho_range, valores = ws.batch_get(["1:1", f"A{ultima_linha}:{ultima_coluna}"])
+
+    cabecalho = cabecalho_range[0] if cabecalho_range else []
+    valores = [linha + [''] * (len(cabecalho) - len(linha)) for linha in valores]
+
+    idx_ts = cabecalho.index(COLUNA_TIMESTAMP) if COLUNA_TIMESTAMP in cabecalho else None
+    if (cabecalho != marca["colunas"] or not valores or idx_ts is None
+            or valores[0][idx_ts] != marca["ultimo_timestamp"]):
+        logger.warning("Marca d'água inconsistente com a planilha – refazendo leitura completa.")
+        df, client = extract(sheet_id, tab_name, client)
+        return df, client, _gerar_marca(df), True
+
+    df = pd.DataFrame(valores[1:], columns=cabecalho)
+    marca_nova = _gerar_marca(df, marca)
+
+    logger.info(f"Linhas novas: {len(df)}")
+    return df, client, marca_nova, False
+
+
+def _gerar_marca(df: pd.DataFrame, anterior: dict | None = None) -> dict:
+    linhas = (anterior["linhas"] if anterior else 0) + len(df)
+    if len(df) > 0 and COLUNA_TIMESTAMP in df.columns:
+        ultimo_timestamp = df[COLUNA_TIMESTAMP].iloc[-1]
+    else:
+        ultimo_timestamp = anterior["ultimo_timestamp"] if anterior else None
+    return {
+        "linhas": linhas,
+        "ultimo_timestamp": ultimo_timestamp,
+        "colunas": df.columns.tolist() if len(df.columns) else anterior["colunas"],
+        "atualizado_em": datetime.now().isoformat(timespec="seconds"),
+    }
+
+# -------------------------------------------------------------------
+# EXTRACT – FONTES (SOURCES) PLUGÁVEIS
+# -------------------------------------------------------------------
+# Todas as fontes devolvem o mesmo DataFrame que o Sheets: cabeçalho com os
+# títulos das perguntas, valores em texto e '' nas respostas em branco.
+CAMINHO_SCHEMA = os.path.join(os.path.dirname(os.path.abspath(__file__)), "schema.json")
+TAMANHO_BLOCO_LEITURA = 50_000
+FUSO_FORMULARIO = "America/Bahia"
+
+
+def colunas_do_formulario(caminho_schema: str = CAMINHO_SCHEMA) -> list[tuple[str, str]]:
+    """
+    Lista (questionId, título da coluna) na ordem do formulário, como aparece
+    na planilha de respostas. Perguntas em grade viram "título [linha]".
+    """
+    with open(caminho_schema, encoding="utf-8") as f:
+        schema = json.load(f)
+
+    colunas = []
+    for item in schema.get("items", []):
+        pergunta = item.get("questionItem", {}).get("question")
+        if pergunta:
+            colunas.append((pergunta["questionId"], item["title"]))
+        grade = item.get("questionGroupItem")
+        if grade:
+            for linha in grade.get("questions", []):
+                colunas.append((linha["questionId"], f"{item['title']} [{linha['rowQuestion']['title']}]"))
+    return colunas
+
+
+def _texto_celula(valor) -> str:
+    if valor is None:
+        return ''
+    if isinstance(valor, datetime):
+        return valor.strftime("%d/%m/%Y %H:%M:%S")
+    if isinstance(valor, float) and valor.is_integer():
+        return str(int(valor))
+    return str(valor)
+
+
+def iterar_csv(caminho: str, chunksize: int = TAMANHO_BLOCO_LEITURA, **opcoes):
+    """
+    Lê um CSV exportado do Forms/Sheets em blocos, tudo como texto.
+    """
+    opcoes.setdefault("encoding", "utf-8-sig")
+    yield from pd.read_csv(caminho, dtype=str, keep_default_na=False, chunksize=chunksize, **opcoes)
+
+
+def iterar_xlsx(caminho: str, aba: str | None = None, chunksize: int = TAMANHO_BLOCO_LEITURA):
+    """
+    Lê uma planilha XLSX em modo streaming (openpyxl read-only), em blocos.
+    """
+    from openpyxl import load_workbook
+
+    wb = load_workbook(caminho, read_only=True, data_only=True)
+    try:
+        ws = wb[aba] if aba else wb.worksheets[0]
+        linhas = ws.iter_rows(values_only=True)
+        cabecalho = [_texto_celula(v) for v in next(linhas, ())]
+        while cabecalho and cabecalho[-1] == '':
+            cabecalho.pop()
+
+        bloco, produzidos = [], 0
+        for linha in linhas:
+            valores = [_texto_celula(v) for v in linha[:len(cabecalho)]]
+            if not any(valores):
+                continue
+            bloco.append(valores + [''] * (len(cabecalho) - len(valores)))
+            if len(bloco) >= chunksize:
+                yield pd.DataFrame(bloco, columns=cabecalho)
+                bloco, produzidos = [], produzidos + 1
+        # Bloco vazio só sem nenhuma linha, para o cabeçalho chegar ao destino
+        if bloco or (cabecalho and not produzidos):
+            yield pd.DataFrame(bloco, columns=cabecalho)
+    finally:
+        wb.close()
+
+
+def _respostas_forms(caminho: str):
+    """
+    Percorre as respostas de um export da Forms API: JSON com a chave
+    "responses" ou JSON Lines com uma resposta por linha (lido em streaming).
+    """
+    with open(caminho, encoding="utf-8") as f:
+        if caminho.endswith(".jsonl"):
+            for linha in f:
+                if linha.strip():
+                    yield json.loads(linha)
+        else:
+            yield from json.load(f).get("responses", [])
+
+
+def iterar_forms_json(caminho: str, caminho_schema: str = CAMINHO_SCHEMA,
+                      chunksize: int = TAMANHO_BLOCO_LEITURA, fuso: str = FUSO_FORMULARIO):
+    """
+    Converte respostas da Forms API para o layout da planilha de respostas,
+    usando os questionId do schema.json. Múltiplas respostas (CHECKBOX) são
+    unidas com ", " como o Sheets faz.
+    """
+    from zoneinfo import ZoneInfo
+
+    colunas = colunas_do_formulario(caminho_schema)
+    cabecalho = [COLUNA_TIMESTAMP] + [titulo for _, titulo in colunas]
+    fuso_local = ZoneInfo(fuso)
+
+    bloco, produzidos = [], 0
+    for resposta in _respostas_forms(caminho):
+        enviado = resposta.get("lastSubmittedTime") or resposta.get("createTime") or ''
+        if enviado:
+            instante = datetime.fromisoformat(enviado.replace("Z", "+00:00"))
+            enviado = instante.astimezone(fuso_local).strftime("%d/%m/%Y %H:%M:%S")
+
+        respostas = resposta.get("answers", {})
+        linha = [enviado]
+        for question_id, _ in colunas:
+            textos = respostas.get(question_id, {}).get("textAnswers", {}).get("answers", [])
+            linha.append(", ".join(t.get("value", '') for t in textos))
+        bloco.append(linha)
+
+        if len(bloco) >= chunksize:
+            yield pd.DataFrame(bloco, columns=cabecalho)
+            bloco, produzidos = [], produzidos + 1
+    if bloco or not produzidos:
+        yield pd.DataFrame(bloco, columns=cabecalho)
+
+
+def iterar_sheets(sheet_id: str, tab_name: str = "BaseBruta", chunksize: int = TAMANHO_BLOCO_LEITURA,
+                  client: SessaoSheets | None = None):
+    """
+    Lê a aba do Sheets em blocos de linhas (batch_get de intervalos "i:j"),
+    em vez de um get_all_values com a aba inteira. Linhas totalmente em branco
+    são descartadas, como em iterar_xlsx.
+    """
+    client = client or sessao_sheets()
+    ws = client.aba(sheet_id, tab_name)
+    logger.info(f"Lendo planilha em blocos de {chunksize} linhas: {sheet_id} | Aba: {tab_name}")
+
+    # O cabeçalho vem junto com o primeiro bloco
+    cabecalho_range, valores = chamar_sheets(ws.batch_get, ["1:1", f"2:{chunksize + 1}"])
+    cabecalho = cabecalho_range[0] if cabecalho_range else []
+    inicio, produzidos = chunksize + 2, 0
+    while True:
+        bloco = [linha[:len(cabecalho)] + [''] * (len(cabecalho) - len(linha))
+                 for linha in valores if any(linha)]
+        if bloco or not produzidos:
+            yield pd.DataFrame(bloco, columns=cabecalho)
+            produzidos += 1
+        # row_count pode estar desatualizado (aba aberta antes de novas respostas)
+        if inicio > ws.row_count and not valores:
+            break
+        valores, = chamar_sheets(ws.batch_get, [f"{inicio}:{inicio + chunksize - 1}"])
+        inicio += chunksize
+
+
+def _concatenar_blocos(blocos) -> pd.DataFrame:
+    blocos = list(blocos)
+    return pd.concat(blocos, ignore_index=True) if blocos else pd.DataFrame()
+
+
+def extract_csv(caminho: str, **opcoes) -> pd.DataFrame:
+    return _concatenar_blocos(iterar_csv(caminho, **opcoes))
+
+
+def extract_xlsx(caminho: str, **opcoes) -> pd.DataFrame:
+    return _concatenar_blocos(iterar_xlsx(caminho, **opcoes))
+
+
+def extract_forms_json(caminho: str, **opcoes) -> pd.DataFrame:
+    return _concatenar_blocos(iterar_forms_json(caminho, **opcoes))
+
+
+def extract_sheets(sheet_id: str, tab_name: str = "BaseBruta") -> pd.DataFrame:
+    df, _ = extract(sheet_id, tab_name)
+    return df
+
+
+SOURCES = {
+    'sheets': extract_sheets,
+    'csv': extract_csv,
+    'xlsx': extract_xlsx,
+    'forms_json': extract_forms_json,
+}
+
+# Fontes que aceitam leitura em blocos (usadas por iterar_fonte)
+ITERADORES_FONTE = {
+    'sheets': iterar_sheets,
+    'csv': iterar_csv,
+    'xlsx': iterar_xlsx,
+    'forms_json': iterar_forms_json,
+}
+
+
+def iterar_fonte(fonte: str, origem: str, **opcoes):
+    """
+    Lê a fonte em blocos de DataFrame (útil para exports históricos grandes).
+    """
+    if fonte not in ITERADORES_FONTE:
+        raise ValueError(f"Fonte sem leitura em blocos: {fonte}. Opções: {', '.join(ITERADORES_FONTE)}")
+    return ITERADORES_FONTE[fonte](origem, **opcoes)
+
+
+def extract_source(fonte: str, origem: str, **opcoes) -> pd.DataFrame:
+    """
+    Lê os dados brutos da fonte escolhida (ver SOURCES). Para 'sheets', `origem`
+    é o id da planilha e a aba vai em tab_name; nas demais, é o caminho do arquivo.
+    """
+    if fonte not in SOURCES:
+        raise ValueError(f"Fonte desconhecida: {fonte}. Opções: {', '.join(SOURCES)}")
+    logger.info(f"Lendo fonte '{fonte}': {origem}")
+    df = SOURCES[fonte](origem, **opcoes)
+    logger.info(f"Linhas carregadas: {len(df)}")
+    return df
+
+
+# -------------------------------------------------------------------
+# NORMALIZAÇÃO DE TEXTO LIVRE
+# -------------------------------------------------------------------
+_PADRAO_NAO_LETRAS = re.compile(r'[^a-zA-Z\s]')
+_PADRAO_ESPACOS = re.compile(r'\s+')
+
+
+@lru_cache(maxsize=65536)
 def limpar_texto(texto: str) -> str:
+    """
+    Remove acentos, pontuação e números, deixa em minúsculas e compacta espaços.
+    Respostas livres se repetem muito, então o resultado fica em cache por texto.
+    """
     texto = unicodedata.normalize('NFKD', texto).encode('ascii', 'ignore').decode('utf-8')
-    texto = re.sub(r'[^a-zA-Z\s]', ' ', texto.lower())
-    texto = re.sub(r'\s+', ' ', texto).strip()
+    texto = _PADRAO_NAO_LETRAS.sub(' ', texto.lower())
+    texto = _PADRAO_ESPACOS.sub(' ', texto).strip()
     return texto
 
-def gerar_nome_grupo(textos: list[str]) -> str:
+
+def limpar_textos(serie: pd.Series) -> pd.Series:
     """
-    Gera um nome legível para o grupo com base nas palavras mais comuns
+    Versão em lote de limpar_texto: normaliza só os valores distintos da
+    Series e espalha o resultado pelas linhas (NaN vira '').
+    """
+    codigos, unicos = pd.factorize(serie.fillna(''))
+    limpos = np.array([limpar_texto(str(t)) for t in unicos] + [''], dtype=object)
+    return pd.Series(limpos[codigos], index=serie.index, name=serie.name)
+
+def gerar_nome_grupo(textos: list[str], pesos: list[int] | None = None) -> str:
+    """
+    Gera um nome legível para o grupo com base nas palavras mais comuns.
+    `pesos` indica quantas vezes cada texto aparece (quando os textos são únicos).
     """
     # Palavras-chave conhecidas (você pode expandir)
     palavras_chave = {
@@ -102,9 +615,12 @@ def gerar_nome_grupo(textos: list[str]) -> str:
     }
 
     # Contar palavras limpas
-    texto_unido = ' '.join([limpar_texto(t) for t in textos])
-    palavras = texto_unido.split()
-    contador = Counter(palavras)
+    if pesos is None:
+        pesos = [1] * len(textos)
+    contador = Counter()
+    for texto, peso in zip(textos, pesos):
+        for palavra in limpar_texto(texto).split():
+            contador[palavra] += int(peso)
 
     # Detectar palavra-chave mais frequente
     for palavra, nome in palavras_chave.items():
@@ -120,144 +636,467 @@ def gerar_nome_grupo(textos: list[str]) -> str:
     else:
         return "Outros"
     
-def normalizar_area_atuacao(df: pd.DataFrame, n_clusters: int = 15) -> pd.DataFrame:
-    df = df.copy()
-    df['area_limpa'] = df['area_atuacao'].fillna('').apply(limpar_texto)
+# Modelo de agrupamento da área de atuação salvo entre execuções
+# Um único modelo para todas as planilhas/ondas, de propósito: o formulário é
+# o mesmo e os dashboards comparam ondas pelos mesmos nomes de grupo. Para
+# separar formulários diferentes, aponte ETL_MODELO_AREA para outro arquivo.
+CAMINHO_MODELO_AREA = os.environ.get("ETL_MODELO_AREA") or os.path.join(DIRETORIO_CACHE, "modelo_area_atuacao.pkl")
+# Reajusta o modelo se mais que esta fração das respostas acumuladas tiver
+# texto que não estava no último ajuste...
+LIMIAR_TEXTOS_NOVOS = 0.2
+# ...ou se esses textos ficarem, em média, este fator mais longe dos centróides
+# (só quando já são ao menos LIMIAR_MINIMO_NOVOS das respostas: um texto
+# estranho isolado não justifica renomear os grupos)
+LIMIAR_DISTANCIA_DRIFT = 1.5
+LIMIAR_MINIMO_NOVOS = 0.05
+
+
+def _ajustar_modelo_area(textos: np.ndarray, contagens: np.ndarray, n_clusters: int) -> dict:
+    """
+    Ajusta TF-IDF + KMeans só nos textos distintos, com peso = nº de respostas.
+    """
+    from sklearn.cluster import KMeans
+    from sklearn.feature_extraction.text import TfidfVectorizer
 
     vetorizador = TfidfVectorizer(max_features=500, stop_words='english')
-    X = vetorizador.fit_transform(df['area_limpa'])
+    X = vetorizador.fit_transform(textos)
 
+    # Poucos textos distintos (ex.: primeira execução incremental) limitam o nº de grupos
+    n_clusters = max(1, min(n_clusters, len(textos)))
     kmeans = KMeans(n_clusters=n_clusters, random_state=42, n_init=10)
-    df['grupo'] = kmeans.fit_predict(X)
+    grupos = kmeans.fit_predict(X, sample_weight=contagens)
+    distancias = kmeans.transform(X).min(axis=1)
+
+    nomes = {}
+    for grupo in np.unique(grupos):
+        mascara = grupos == grupo
+        nomes[int(grupo)] = gerar_nome_grupo(list(textos[mascara]), list(contagens[mascara]))
+
+    return {
+        'vetorizador': vetorizador,
+        'kmeans': kmeans,
+        'nomes': nomes,
+        'grupos_por_texto': dict(zip(textos, grupos.tolist())),
+        # Respostas acumuladas por texto (ajuste + execuções seguintes)
+        'contagens_por_texto': dict(zip(textos, contagens.tolist())),
+        # Textos atribuídos depois do ajuste -> distância ao centróide mais próximo
+        'distancias_novos': {},
+        'distancia_media': float(np.average(distancias, weights=contagens)),
+        'ajustado_em': datetime.now().isoformat(timespec="seconds"),
+    }
+
+
+def _prever_grupos_area(modelo: dict, textos: np.ndarray, contagens: np.ndarray) -> tuple[np.ndarray, bool]:
+    """
+    Usa o modelo salvo: textos já vistos pegam o grupo guardado, os novos vão
+    para o centróide mais próximo e passam a fazer parte do modelo. As
+    contagens do lote são somadas às acumuladas e o drift é medido sobre o
+    acumulado, então um lote pequeno (incremental) não dispara o reajuste
+    sozinho. Devolve (grupos, houve_drift); o modelo é atualizado no lugar.
+    """
+    conhecidos = modelo['grupos_por_texto']
+    # Modelos salvos antes das contagens acumuladas: 1 resposta por texto
+    acumuladas = modelo.setdefault('contagens_por_texto', dict.fromkeys(conhecidos, 1))
+    distancias_novos = modelo.setdefault('distancias_novos', {})
+
+    grupos = np.array([conhecidos.get(t, -1) for t in textos], dtype=np.int64)
+    novos = grupos == -1
+    if novos.any():
+        distancias = modelo['kmeans'].transform(modelo['vetorizador'].transform(textos[novos]))
+        grupos[novos] = distancias.argmin(axis=1)
+        for texto, grupo, distancia in zip(textos[novos], grupos[novos], distancias.min(axis=1)):
+            conhecidos[texto] = int(grupo)
+            distancias_novos[texto] = float(distancia)
+
+    for texto, contagem in zip(textos, contagens):
+        acumuladas[texto] = acumuladas.get(texto, 0) + int(contagem)
+    if not distancias_novos:
+        return grupos, False
+
+    pesos_novos = np.array([acumuladas[t] for t in distancias_novos], dtype=float)
+    fracao_novos = pesos_novos.sum() / sum(acumuladas.values())
+    distancia_novos = float(np.average(list(distancias_novos.values()), weights=pesos_novos))
+    drift = (fracao_novos > LIMIAR_TEXTOS_NOVOS
+             or (fracao_novos >= LIMIAR_MINIMO_NOVOS
+                 and distancia_novos > LIMIAR_DISTANCIA_DRIFT * modelo['distancia_media']))
+    if drift:
+        logger.info(f"Drift na área de atuação (respostas com texto novo: {fracao_novos:.0%}, "
+                    f"distância média: {distancia_novos:.2f} vs {modelo['distancia_media']:.2f}).")
+    return grupos, drift
+
+
+@contextlib.contextmanager
+def _travar_arquivo(caminho: str):
+    """
+    Trava exclusiva entre processos (flock em `caminho`.lock) para
+    ler-alterar-gravar o arquivo; sem fcntl (Windows) não trava.
+    """
+    try:
+        import fcntl
+    except ImportError:
+        yield
+        return
+    os.makedirs(os.path.dirname(caminho) or '.', exist_ok=True)
+    with open(caminho + '.lock', 'a') as trava:
+        fcntl.flock(trava, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(trava, fcntl.LOCK_UN)
+
+
+def _modo_arquivo(caminho: str) -> int:
+    # Permissões do arquivo atual ou, se ainda não existe, as padrão (umask)
+    with contextlib.suppress(FileNotFoundError):
+        return os.stat(caminho).st_mode & 0o777
+    umask = os.umask(0)
+    os.umask(umask)
+    return 0o666 & ~umask
+
+
+def _salvar_modelo_area(modelo: dict, caminho_modelo: str):
+    diretorio = os.path.dirname(caminho_modelo) or '.'
+    os.makedirs(diretorio, exist_ok=True)
+    # Temporário próprio do processo: jobs do lote podem salvar ao mesmo tempo
+    descritor, temporario = tempfile.mkstemp(dir=diretorio, prefix=os.path.basename(caminho_modelo), suffix='.tmp')
+    try:
+        with os.fdopen(descritor, 'wb') as f:
+            pickle.dump(modelo, f)
+        # mkstemp cria com 0600; o modelo mantém as permissões de antes
+        os.chmod(temporario, _modo_arquivo(caminho_modelo))
+        os.replace(temporario, caminho_modelo)
+    except BaseException:
+        with contextlib.suppress(OSError):
+            os.remove(temporario)
+        raise
+
+
+def agrupar_areas(originais: np.ndarray, contagem_original: np.ndarray, n_clusters: int = 15,
+                  caminho_modelo: str | None = CAMINHO_MODELO_AREA,
+                  reajustar: bool = False) -> np.ndarray:
+    """
+    Nome do grupo de cada texto distinto de área de atuação (`originais`, com
+    o nº de respostas em `contagem_original`).
+
+    Os textos são deduplicados antes do TF-IDF/KMeans. O modelo (vetorizador,
+    centróides, nomes, textos conhecidos e contagens acumuladas) fica salvo em
+    `caminho_modelo`; nas próximas execuções só os textos novos passam pelo
+    predict. Com drift (ou reajustar=True) o ajuste é refeito sobre todos os
+    textos acumulados mais os do lote, nunca só sobre o lote.
+    caminho_modelo=None desliga a persistência.
+    """
+    limpos = limpar_textos(pd.Series(originais, dtype=object)).to_numpy()
+    codigo_limpo, textos = pd.factorize(limpos)
+    textos = np.asarray(textos, dtype=object)
+    contagens = np.bincount(codigo_limpo, weights=contagem_original, minlength=len(textos))
+    if len(textos) == 0:
+        return np.array([], dtype=object)
+
+    # Jobs do lote em paralelo fazem ler-alterar-gravar no mesmo modelo: a
+    # trava vai da leitura à gravação, então nenhum perde contagens do outro
+    with _travar_arquivo(caminho_modelo) if caminho_modelo else contextlib.nullcontext():
+        modelo, anterior = None, None
+        if caminho_modelo and os.path.exists(caminho_modelo):
+            with open(caminho_modelo, 'rb') as f:
+                anterior = pickle.load(f)
+            grupos, drift = _prever_grupos_area(anterior, textos, contagens)
+            modelo = None if drift or reajustar else anterior
+
+        if modelo is None:
+            if anterior is not None:
+                # Corpus acumulado (já inclui os textos e contagens deste lote)
+                acumuladas = anterior['contagens_por_texto']
+                textos_ajuste = np.array(list(acumuladas), dtype=object)
+                contagens_ajuste = np.array(list(acumuladas.values()), dtype=float)
+            else:
+                textos_ajuste, contagens_ajuste = textos, contagens
+            logger.info(f"Ajustando agrupamento de área de atuação ({len(textos_ajuste)} textos distintos)...")
+            modelo = _ajustar_modelo_area(textos_ajuste, contagens_ajuste, n_clusters)
+            grupos = np.array([modelo['grupos_por_texto'][t] for t in textos], dtype=np.int64)
+
+        if caminho_modelo:
+            _salvar_modelo_area(modelo, caminho_modelo)
+
+    grupo_original = grupos[codigo_limpo]
+    nomes_original = np.array([modelo['nomes'].get(int(g), 'Outros') for g in grupo_original], dtype=object)
+
+    if logger.isEnabledFor(logging.DEBUG):
+        for grupo in pd.unique(grupo_original):
+            mascara = grupo_original == grupo
+            amostra = originais[mascara][contagem_original[mascara].argmax()]
+            logger.debug(f"Grupo {grupo}: {modelo['nomes'].get(int(grupo), 'Outros')} (ex: '{amostra}')")
+
+    return nomes_original
+
+
+def normalizar_area_atuacao(df: pd.DataFrame, n_clusters: int = 15,
+                            caminho_modelo: str | None = CAMINHO_MODELO_AREA,
+                            reajustar: bool = False) -> dict:
+    """
+    Agrupa as respostas livres de área de atuação e troca cada uma pelo nome
+    do grupo (ver agrupar_areas).
+    """
+    # Textos distintos e quantas respostas cada um tem
+    codigos, originais = pd.factorize(df['area_atuacao'].fillna(''))
+    if len(originais) == 0:
+        return {}
+    originais = np.asarray(originais, dtype=object)
+    contagem_original = np.bincount(codigos, minlength=len(originais))
 
-    grupo_nome = {}
-    for grupo in df['grupo'].unique():
-        textos_originais = df[df['grupo'] == grupo]['area_atuacao'].tolist()
-        nome = gerar_nome_grupo(textos_originais)
-        grupo_nome[grupo] = nome
+    nomes_original = agrupar_areas(originais, contagem_original, n_clusters, caminho_modelo, reajustar)
+    return {'area_atuacao': nomes_original[codigos]}
 
-    df['area_atuacao_normalizada'] = df['grupo'].map(grupo_nome)
 
-    print("📊 Grupos detectados:")
-    for grupo, nome in grupo_nome.items():
-        amostra = df[df['grupo'] == grupo]['area_atuacao'].mode()[0] if not df[df['grupo'] == grupo]['area_atuacao'].mode().empty else "-"
-        print(f"  Grupo {grupo}: {nome} (ex: '{amostra}')")
+def aplicar_grupos_area(df: pd.DataFrame, grupos: dict) -> dict:
+    """
+    Troca a área de atuação pelo nome do grupo já calculado ({texto: grupo}).
+    """
+    codigos, originais = pd.factorize(df['area_atuacao'].fillna(''))
+    nomes = np.array([grupos.get(texto, 'Outros') for texto in originais], dtype=object)
+    return {'area_atuacao': nomes[codigos]}
 
-    df['area_atuacao'] = df['area_atuacao_normalizada']
-    df = df.drop(columns=['area_limpa', 'grupo', 'area_atuacao_normalizada'])
 
-    return df
+# -------------------------------------------------------------------
+# SCHEMA – MAPEAMENTO DE COLUNAS E PLANO DE TIPOS
+# -------------------------------------------------------------------
+# Nome da coluna no ETL para cada pergunta do formulário (questionId do schema.json).
+# Os títulos vêm do schema, então espaços duplos/finais não precisam ser copiados.
+NOMES_COLUNAS = {
+    '23d6ba1b': 'ds_vinculado',
+    '062c0eee': 'coord_ds',
+    '010549e8': 'area_atuacao',
+    '265c5c3d': 'atuacao_info',
+    '73d12f19': 'competencia_tecnica_equipe',
+    '0afc2afb': 'participa_qualificacoes',
+    '4314abb3': 'cultura_uso_dados',
+    '7a1c9305': 'ferramentas_analise',
+    '116929aa': 'estacoes_trabalho_boas',
+    '41e238dc': 'computadores_problema',
+    '2b20b572': 'notebooks_boas',
+    '50284da2': 'notebooks_com_camera',
+    '2f70d770': 'notebooks_com_caixa_som',
+    '4159f9eb': 'notebooks_com_microfone',
+    '371ff546': 'webcams_disponiveis',
+    '63c7a495': 'microfones_disponiveis',
+    '19ff379a': 'fones_disponiveis',
+    '5f7980c4': 'caixas_som_disponiveis',
+    '7f7ded90': 'televisores',
+    '69314128': 'projetores',
+    '137e1d1b': 'cabos_adaptadores',
+    '51f5b24f': 'internet_estavel',
+    '29964720': 'qualidade_internet',
+    '67ec41e0': 'tipo_rede_internet',
+    '58079b0f': 'acesso_wifi',
+    '3f6a53ad': 'estrutura_eletrica_suporta',
+    '536b7148': 'sala_situacao',
+    '55e13e11': 'sala_climatizada',
+    '2ec03868': 'indicadores_definidos',
+    '1bff95bb': 'dados_subsidiam_metas',
+    '24515e2a': 'principais_indicadores',
+    '3bb3ae33': 'metas_base_dados',
+    '1b60801e': 'comunicacao_nivel_central',
+    '5e788062': 'meios_comunicacao',
+    '79e0111b': 'periodicidade_revisao_metas',
+    '3f8fb3b1': 'periodicidade_metas',
+    '316e4677': 'sistemas_informacao_utilizados',
+    '330f112e': 'qualidade_sinasc',
+    '220a756b': 'qualidade_vida_plus',
+    '52e4ec9c': 'qualidade_esus_sisab',
+    '05e8bef0': 'qualidade_sinan',
+    '41556684': 'qualidade_gal',
+    '7883027e': 'qualidade_sia_sus',
+    '00bbe572': 'qualidade_sih_sus',
+    '4e83d26c': 'qualidade_sim',
+    '42da21d8': 'qualidade_sivep_gripe',
+    '6ff35c9a': 'qualidade_esus_notifica',
+    '091ea3f9': 'qualidade_sisvan',
+    '0b081a41': 'fluxos_formalizados',
+    '33e381f5': 'rotina_validacao',
+    '2ba6c40a': 'equipe_treinada',
+    '47acb4a6': 'acoes_base_dados',
+    '418caa19': 'comparacao_series_historicas',
+    '3d8d6d64': 'devolutiva_resultados',
+    '5ebae9b0': 'discussao_boletins',
+    '3f859ae6': 'paineis_tomada_decisao',
+    '311d2034': 'paineis_utilizados',
+    '30748edd': 'estimulo_inovacao',
+    '4e68cc8d': 'compreensao_sala_situacao',
+    '221e6f4d': 'telessaude',
+    '16d465d5': 'conhecimento_lgpd',
+    '403d393a': 'treinamento_lgpd',
+    '477cb829': 'acesso_individualizado',
+    '38c6297d': 'protocolos_backup',
+}
+
+
+def _chave_titulo(titulo: str) -> str:
+    return ' '.join(str(titulo).split())
+
+
+def _opcoes_escala(opcoes: list[str]) -> bool:
+    """
+    Grade cujas opções numéricas formam uma escala (ex.: 1 a 5 + "Não sei informar").
+    """
+    numeros = [int(o) for o in opcoes if o.isdigit()]
+    return len(numeros) >= 3 and numeros == list(range(numeros[0], numeros[0] + len(numeros)))
 
-def rename_columns(df: pd.DataFrame) -> pd.DataFrame:
+
+@lru_cache(maxsize=None)
+def compilar_schema(caminho_schema: str = CAMINHO_SCHEMA) -> dict:
     """
-    Renomeia as colunas do DataFrame conforme o mapeamento fornecido.
-    """
-    rename_map = {
-        "Carimbo de data/hora": "timestamp",
-        "1 - Distrito Sanitário (DS) ao qual você está vinculado": "ds_vinculado",
-        "2 - Você é coordenador do DS?": "coord_ds",
-        "3  - Se não, qual a sua área de atuação no DS?": "area_atuacao",
-        "4 - Na sua área de atuação, você trabalha diretamente com a coleta, análise ou gestão da informação?": "atuacao_info",
-        "6 - Você participa de qualificações sobre análise de dados, sistemas de informação ou planejamento em saúde?": "participa_qualificacoes",
-        "7 - Na sua opinião existe,  por parte dos profissionais, uma cultura de valorização e uso de dados para a tomada de decisão no dia a dia do Distrito Sanitário?": "cultura_uso_dados",
-        "8 - Quais ferramentas são mais utilizadas por você para analisar dados?": "ferramentas_analise",
-        "9 - O distrito sanitário de saúde possui estações de trabalho (computador, teclado, mouse e monitor) em condições adequadas de uso? Quantas? ": "estacoes_trabalho_boas",
-        "10 - Quantos computadores de mesa estão instalados, mas apresentam problemas recorrentes (lentidão, defeitos de hardware, etc.)?": "computadores_problema",
-        "11 - O Distrito Sanitário possui notebooks em condições de uso? Se sim, quantos?": "notebooks_boas",
-        "11.1 - Se respondeu sim na pergunta anterior, quantos desses notebooks possuem câmera, microfone e alto-falantes integrados e funcionais?  [Câmeras (webcams)]": "notebooks_com_camera",
-        "11.1 - Se respondeu sim na pergunta anterior, quantos desses notebooks possuem câmera, microfone e alto-falantes integrados e funcionais?  [Caixas de som]": "notebooks_com_caixa_som",
-        "11.1 - Se respondeu sim na pergunta anterior, quantos desses notebooks possuem câmera, microfone e alto-falantes integrados e funcionais?  [Microfones]": "notebooks_com_microfone",
-        "12 - Para realizar reuniões remotas (videoconferências), marque quantos dos seguintes itens estão disponíveis e em condição de uso no Distrito Sanitário: [Câmeras (webcams)]": "webcams_disponiveis",
-        "12 - Para realizar reuniões remotas (videoconferências), marque quantos dos seguintes itens estão disponíveis e em condição de uso no Distrito Sanitário: [Microfones (de mesa ou headsets):]": "microfones_disponiveis",
-        "12 - Para realizar reuniões remotas (videoconferências), marque quantos dos seguintes itens estão disponíveis e em condição de uso no Distrito Sanitário: [Fones de ouvido (headsets ou simples):]": "fones_disponiveis",
-        "12 - Para realizar reuniões remotas (videoconferências), marque quantos dos seguintes itens estão disponíveis e em condição de uso no Distrito Sanitário: [Caixas de som (para uso coletivo em sala):]": "caixas_som_disponiveis",
-        "13 - O Distrito Sanitário possui televisores ou projetores que podem ser conectados a computadores/notebooks para apresentações? Se sim, quantos?  [Televisor]": "televisores",
-        "14 - Existem cabos (ex: HDMI) ou adaptadores disponíveis e funcionais para conectar os computadores a esses televisores/projetores?": "cabos_adaptadores",
-        "15 - Nos últimos 6 meses, o Distrito Sanitário possuiu conexão estável com a internet, permitindo o uso de videoconferências e acesso a sistemas de informação em saúde online e painéis de BI?": "internet_estavel",
-        "15.1 - Se sim, em uma escala de 0 (péssima) a 10 (excelente), como você avalia a qualidade geral (velocidade e estabilidade) da internet?": "qualidade_internet",
-        "16 - A rede de internet no Distrito Sanitário é:": "tipo_rede_internet",
-        "17 - O acesso à rede Wi-Fi, se existente, é:": "acesso_wifi",
-        "18 - A estrutura elétrica do Distrito Sanitário suporta a inserção de novos equipamentos tecnológicos (Ex: mais computadores, televisores, etc.)?": "estrutura_eletrica_suporta",
-        "19 - O Distrito Sanitário possui uma sala adequada para a realização de reuniões em grupo e que possa abrigar a estrutura da Sala de Situação (projeção de painéis, computadores, etc.)?": "sala_situacao",
-        "19.1 - Se possui uma sala, ela é climatizada (com ar-condicionado em funcionamento)?": "sala_climatizada",
-        "20 - Há indicadores definidos para monitorar o desempenho das ações de saúde acompanhadas pela equipe técnica distrital?": "indicadores_definidos",
-        "21 - As informações e análises de dados geradas no Distrito Sanitário subsidiam a elaboração das metas para a Programação Operativa Anual (POA)?": "dados_subsidiam_metas",
-        "21.1 - Se sim na pergunta anterior, descreva brevemente quais são os principais indicadores acompanhados.": "principais_indicadores",
-        "22 - As metas distritais são definidas a partir da análise dos dados?": "metas_base_dados",
-        "23 - Existem meios de comunicação entre o Distrito Sanitário e as áreas técnicas do Nível Central para dialogar sobre os indicadores por território?": "comunicacao_nivel_central",
-        "23.1 - Se sim, descreva quais os meios de comunicação utilizados (e-mail, reuniões, ofícios, grupos de mensagens, etc.) e com quais áreas técnicas.": "meios_comunicacao",
-        "24 - Há periodicidade definida para atualização e revisão das metas estratégicas que compõem a POA do Distrito Sanitário?": "periodicidade_revisao_metas",
-        "24.1 - Se sim, qual a periodicidade?": "periodicidade_metas",
-        "25 - Quais bases de dados dos Sistemas de Informação em Saúde (SIS), elencados abaixo, você utiliza para tabulação e análise dos dados no Distrito Sanitário?": "sistemas_informacao_utilizados",
-        "26 - Apenas para os sistemas escolhidos na questão anterior, avalie a qualidade dos dados desses sistemas refletindo em suas dimensões de qualidade. [SINASC]": "qualidade_sinasc",
-        "26 - Apenas para os sistemas escolhidos na questão anterior, avalie a qualidade dos dados desses sistemas refletindo em suas dimensões de qualidade. [Vida+]": "qualidade_vida_plus",
-        "26 - Apenas para os sistemas escolhidos na questão anterior, avalie a qualidade dos dados desses sistemas refletindo em suas dimensões de qualidade. [E-SUS AB/SISAB]": "qualidade_esus_sisab",
-        "26 - Apenas para os sistemas escolhidos na questão anterior, avalie a qualidade dos dados desses sistemas refletindo em suas dimensões de qualidade. [SINAN]": "qualidade_sinan",
-        "26 - Apenas para os sistemas escolhidos na questão anterior, avalie a qualidade dos dados desses sistemas refletindo em suas dimensões de qualidade. [GAL]": "qualidade_gal",
-        "26 - Apenas para os sistemas escolhidos na questão anterior, avalie a qualidade dos dados desses sistemas refletindo em suas dimensões de qualidade. [SIA-SUS]": "qualidade_sia_sus",
-        "26 - Apenas para os sistemas escolhidos na questão anterior, avalie a qualidade dos dados desses sistemas refletindo em suas dimensões de qualidade. [SIH-SUS]": "qualidade_sih_sus",
-        "26 - Apenas para os sistemas escolhidos na questão anterior, avalie a qualidade dos dados desses sistemas refletindo em suas dimensões de qualidade. [SIM]": "qualidade_sim",
-        "26 - Apenas para os sistemas escolhidos na questão anterior, avalie a qualidade dos dados desses sistemas refletindo em suas dimensões de qualidade. [Sivep-Gripe]": "qualidade_sivep_gripe",
-        "26 - Apenas para os sistemas escolhidos na questão anterior, avalie a qualidade dos dados desses sistemas refletindo em suas dimensões de qualidade. [E-SUS Notifica]": "qualidade_esus_notifica",
-        "26 - Apenas para os sistemas escolhidos na questão anterior, avalie a qualidade dos dados desses sistemas refletindo em suas dimensões de qualidade. [Sisvan]": "qualidade_sisvan",
-        "27 - Em relação aos dados digitados no Distrito Sanitário, os fluxos de coleta e digitação estão formalizados com as unidades de saúde do território? (Ex: Fichas do SINAN que são oriundas de unidades hospitalares)": "fluxos_formalizados",
-        "28 - Existe rotina de conferência e validação da consistência dos dados que são digitados no Distrito Sanitário?": "rotina_validacao",
-        "29 - Na sua opinião, a equipe responsável pelo registro dos dados é devidamente treinada?": "equipe_treinada",
-        "30 - Quais foram as ações (planejamento, intervenções, etc.) realizadas a partir dos dados tabulados no Distrito Sanitário?": "acoes_base_dados",
-        "31 - Os resultados dos indicadores são comparados com séries históricas ou padrões de referência para análise de tendências?": "comparacao_series_historicas",
-        "32 - Há momentos institucionais de devolutiva e discussões dos resultados com as equipes das unidades de saúde? ": "devolutiva_resultados",
-        "33 - Os boletins, informes ou comunicados com resultados dos indicadores de saúde analisados são discutidos com as unidades de saúde do território? ": "discussao_boletins",
-        "34 - Os painéis da Sala de Situação estão sendo utilizados para a tomada de decisão? ": "paineis_tomada_decisao",
-        "34.1 - Se sim, especificar quais painéis são mais utilizados. ": "paineis_utilizados",
-        "35 - Na sua opinião, existe estímulo à inovação e ao uso de novas ferramentas digitais para análise de dados no  Distrito Sanitário?": "estimulo_inovacao",
-        "36 - Você compreende o papel estratégico da Sala de Situação como uma ferramenta de apoio à gestão?": "compreensao_sala_situacao",
-        "37 - O Distrito Sanitário tem alguma unidade de saúde que utiliza a telessaúde para a realização de consultas ou atendimentos remotos? ": "telessaude",
-        "38 - Você sabe o que é e qual o objetivo da Lei Geral de Proteção de Dados Pessoais (LGPD)?": "conhecimento_lgpd",
-        "39 - Você já recebeu treinamentos ou orientações formais sobre a confidencialidade das informações de saúde e a conformidade com a LGPD?": "treinamento_lgpd",
-        "40 - O acesso aos sistemas de informação é controlado por níveis de permissão individualizados (cada profissional com seu próprio login e senha)?": "acesso_individualizado",
-        "41 - Existem protocolos de backup e recuperação de dados para os sistemas que são alimentados localmente no Distrito Sanitário?": "protocolos_backup",
-        "5 - Em uma escala de 1 (nenhuma) a 5 (muita), como você avalia a competência técnica da equipe do distrito para analisar e interpretar indicadores de saúde? [.]": "competencia_tecnica_equipe",
-        "13 - O Distrito Sanitário possui televisores ou projetores que podem ser conectados a computadores/notebooks para apresentações? Se sim, quantos?  [Projetor]": "projetores"
-    }
+    Lê o schema.json uma única vez e gera:
+    - 'rename': título da pergunta (espaços normalizados) -> nome da coluna
+    - 'plano': nome da coluna -> {'tipo', 'opcoes', 'outro'}, com tipo
+      'radio', 'checkbox', 'escala' ou 'texto'
+    """
+    with open(caminho_schema, encoding="utf-8") as f:
+        schema = json.load(f)
+
+    rename = {_chave_titulo(COLUNA_TIMESTAMP): 'timestamp'}
+    plano = {}
+
+    def registrar(question_id, titulo, tipo, opcoes=(), outro=False):
+        nome = NOMES_COLUNAS.get(question_id)
+        if nome is None:
+            return
+        rename[_chave_titulo(titulo)] = nome
+        plano[nome] = {'tipo': tipo, 'opcoes': list(opcoes), 'outro': outro}
+
+    for item in schema.get("items", []):
+        pergunta = item.get("questionItem", {}).get("question")
+        if pergunta:
+            escolha = pergunta.get("choiceQuestion")
+            escala = pergunta.get("scaleQuestion")
+            if escolha:
+                opcoes = [o["value"] for o in escolha.get("options", []) if "value" in o]
+                outro = any(o.get("isOther") for o in escolha.get("options", []))
+                if escolha.get("type") == "CHECKBOX":
+                    registrar(pergunta["questionId"], item["title"], 'checkbox', opcoes, outro)
+                elif outro:
+                    # Resposta livre em "Outro" – mantém como texto
+                    registrar(pergunta["questionId"], item["title"], 'texto', opcoes, outro)
+                else:
+                    registrar(pergunta["questionId"], item["title"], 'radio', opcoes)
+            elif escala:
+                opcoes = [str(i) for i in range(escala.get("low", 0), escala.get("high", 5) + 1)]
+                registrar(pergunta["questionId"], item["title"], 'escala', opcoes)
+            else:
+                registrar(pergunta["questionId"], item["title"], 'texto')
+
+        grade = item.get("questionGroupItem")
+        if grade:
+            opcoes = [o["value"] for o in grade.get("grid", {}).get("columns", {}).get("options", []) if "value" in o]
+            tipo = 'escala' if _opcoes_escala(opcoes) else 'radio'
+            for linha in grade.get("questions", []):
+                registrar(linha["questionId"], f"{item['title']} [{linha['rowQuestion']['title']}]", tipo, opcoes)
+
+    return {'rename': rename, 'plano': plano}
+
 
-    df = df.rename(columns=rename_map)
+def rename_columns(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Renomeia as colunas do DataFrame conforme o mapeamento gerado do schema.json.
+    """
+    mapa = compilar_schema()['rename']
+    df = df.rename(columns=lambda coluna: mapa.get(_chave_titulo(coluna), coluna))
     return df
 
-def transformar_atuacao_info(df: pd.DataFrame) -> pd.DataFrame:
+
+def _categorias_coluna(spec: dict, observados) -> list:
+    opcoes = set(spec['opcoes'])
+    extras = sorted(set(observados) - opcoes)
+    if '' not in opcoes and '' not in extras:
+        extras.append('')
+    return spec['opcoes'] + extras
+
+
+def tipar_colunas(df: pd.DataFrame, categorias: dict | None = None) -> dict:
+    """
+    Aplica o plano de tipos do schema: perguntas de escolha (RADIO, CHECKBOX e
+    escalas) viram Categorical com as opções na ordem do formulário, guardadas
+    como códigos int8. Respostas fora das opções (inclusive '') entram como
+    categorias extras, então nenhum valor se perde. Texto livre não muda.
+
+    `categorias` ({coluna: lista}) fixa as categorias em vez de derivá-las do
+    próprio df, para que blocos diferentes tenham o mesmo dtype.
+    """
+    plano = compilar_schema()['plano']
+
+    colunas = {}
+    for coluna, spec in plano.items():
+        if spec['tipo'] == 'texto' or coluna not in df.columns:
+            continue
+        if isinstance(df[coluna].dtype, pd.CategoricalDtype):
+            continue
+
+        if categorias is not None and coluna in categorias:
+            lista = categorias[coluna]
+        else:
+            lista = _categorias_coluna(spec, pd.unique(df[coluna].dropna()))
+        colunas[coluna] = pd.Categorical(df[coluna], categories=lista)
+
+    return colunas
+
+
+def mapear_valores(serie: pd.Series, mapeamento: dict) -> pd.Series:
+    """
+    Equivalente a serie.map(mapeamento) com resultado numérico (float). Em
+    colunas categóricas o mapeamento é aplicado só às categorias e expandido
+    pelos códigos, sem percorrer as strings linha a linha.
+    """
+    if isinstance(serie.dtype, pd.CategoricalDtype):
+        por_categoria = np.array(
+            [mapeamento.get(c, np.nan) for c in serie.cat.categories] + [np.nan], dtype=float
+        )
+        return pd.Series(por_categoria[serie.cat.codes.to_numpy()], index=serie.index, name=serie.name)
+    return serie.map(mapeamento)
+
+
+def multi_hot_checkbox(serie: pd.Series, opcoes: list[str], ignorar_caixa: bool = False) -> np.ndarray:
+    """
+    Decodifica uma coluna CHECKBOX ("op1, op2, ...") em matriz multi-hot
+    (linhas x opções, uint8). Cada combinação distinta é analisada uma única
+    vez; a opção só conta se aparecer inteira entre separadores ", ", então
+    "SIM" não casa dentro de outro nome nem opções com vírgula se quebram.
+    """
+    if isinstance(serie.dtype, pd.CategoricalDtype):
+        codigos, unicos = serie.cat.codes.to_numpy(), serie.cat.categories
+    else:
+        codigos, unicos = pd.factorize(serie)
+
+    flags = re.IGNORECASE if ignorar_caixa else 0
+    padroes = [re.compile(r'(?:^|, )' + re.escape(opcao) + r'(?=, |$)', flags) for opcao in opcoes]
+    por_unico = np.zeros((len(unicos) + 1, len(opcoes)), dtype=np.uint8)
+    for i, texto in enumerate(unicos):
+        texto = str(texto).strip()
+        por_unico[i] = [padrao.search(texto) is not None for padrao in padroes]
+
+    # Código -1 (NaN) cai na última linha, toda zerada
+    return por_unico[codigos]
+
+
+def transformar_atuacao_info(df: pd.DataFrame) -> dict:
     """
     Transforma a coluna de múltipla escolha em colunas binárias individuais
     """
-    
-    
+    info = df['atuacao_info'].str.lower().str.strip()
+
     # Criar colunas binárias para cada opção
-    df['atuacao_coleta'] = df['atuacao_info'].str.lower().str.strip().str.contains('coleta', na=False).astype(int)
-    df['atuacao_analise'] = df['atuacao_info'].str.lower().str.strip().str.contains('análise', na=False).astype(int)
-    df['atuacao_gestao'] = df['atuacao_info'].str.lower().str.strip().str.contains('gestão', na=False).astype(int)
-    df['atuacao_nao'] = (df['atuacao_info'].str.lower().str.strip() == 'não').astype(int)
-    
-    # Debug: verificar se as colunas foram criadas
-    '''
-    print("Colunas criadas:")
-    print(f"Coleta: {df['atuacao_coleta'].sum()}")
-    print(f"Análise: {df['atuacao_analise'].sum()}")
-    print(f"Gestão: {df['atuacao_gestao'].sum()}")
-    print(f"Não: {df['atuacao_nao'].sum()}")
-    '''
-    
-    # Agora criar as colunas combinadas
-    df['atuacao_multipla'] = (df['atuacao_coleta'] + df['atuacao_analise'] + df['atuacao_gestao'] > 1).astype(int)
-    df['atuacao_apenas_uma'] = (df['atuacao_coleta'] + df['atuacao_analise'] + df['atuacao_gestao'] == 1).astype(int)
+    coleta = info.str.contains('coleta', na=False).astype(int)
+    analise = info.str.contains('análise', na=False).astype(int)
+    gestao = info.str.contains('gestão', na=False).astype(int)
+    nao = (info == 'não').astype(int)
     
     # Criar categorias combinadas
     conditions = [
-        (df['atuacao_coleta'] == 1) & (df['atuacao_analise'] == 1) & (df['atuacao_gestao'] == 1),
-        (df['atuacao_coleta'] == 1) & (df['atuacao_analise'] == 1),
-        (df['atuacao_analise'] == 1) & (df['atuacao_gestao'] == 1),
-        (df['atuacao_coleta'] == 1) & (df['atuacao_gestao'] == 1),
-        (df['atuacao_coleta'] == 1),
-        (df['atuacao_analise'] == 1),
-        (df['atuacao_gestao'] == 1),
-        (df['atuacao_nao'] == 1)
+        (coleta == 1) & (analise == 1) & (gestao == 1),
+        (coleta == 1) & (analise == 1),
+        (analise == 1) & (gestao == 1),
+        (coleta == 1) & (gestao == 1),
+        (coleta == 1),
+        (analise == 1),
+        (gestao == 1),
+        (nao == 1)
     ]
     
     choices = [
@@ -270,467 +1109,361 @@ def transformar_atuacao_info(df: pd.DataFrame) -> pd.DataFrame:
         'Apenas Gestão',
         'Nenhuma'
     ]
-    
-    df['atuacao_categoria'] = np.select(conditions, choices, default='Outro')
 
-    '''
-    print("Distribuição das categorias:")
-    print(df['atuacao_categoria'].value_counts())
-    '''
-    return df
+    return {
+        'atuacao_coleta': coleta,
+        'atuacao_analise': analise,
+        'atuacao_gestao': gestao,
+        'atuacao_nao': nao,
+        # Agora criar as colunas combinadas
+        'atuacao_multipla': (coleta + analise + gestao > 1).astype(int),
+        'atuacao_apenas_uma': (coleta + analise + gestao == 1).astype(int),
+        'atuacao_categoria': np.select(conditions, choices, default='Outro'),
+    }
+
+# -------------------------------------------------------------------
+# FERRAMENTAS DE ANÁLISE – CLASSIFICADOR MULTI-RÓTULO
+# -------------------------------------------------------------------
+# Mapeamento básico das ferramentas padrão
+MAPEAMENTO_FERRAMENTAS = {
+    'Planilhas (Excel, Google Sheets, etc.)': 'Planilhas',
+    'Sistemas de tabulação do SUS (Tabwin, TabNet, etc.)': 'Sistemas SUS',
+    'Painéis de BI (Qlik Sense, Power BI, Looker Studio, Oracle, Sistema de Monitoramento da APS, etc.)': 'Painéis BI',
+    'Apresentações (PowerPoint, Google Slides, etc.)': 'Apresentações',
+}
+
+# Palavras-chave para categorizar automaticamente respostas livres
+PALAVRAS_CHAVE_FERRAMENTAS = {
+    'Planilhas': ['planilha', 'excel', 'google sheets', 'calc', 'sheet'],
+    'Sistemas SUS': ['sistema', 'tabwin', 'tabnet', 'sus', 'sinan', 'siscan', 'sivep',
+                     'sisvan', 'sim', 'sinasc', 'gal', 'sia', 'sih', 'datasus', 'e-sus'],
+    'Painéis BI': ['painel', 'bi', 'business intelligence', 'qlik', 'power bi', 'looker',
+                   'oracle', 'tableau', 'dashboard', 'painéis'],
+    'Apresentações': ['apresentação', 'powerpoint', 'google slides', 'slide', 'ppt']
+}
+
+# Frases que indicam ausência de ferramenta ("nenhuma ferramenta" ou similar)
+FRASES_SEM_FERRAMENTA = ['nenhuma ferramenta', 'não faz análise', 'não faz analise', 'incipiente']
 
-def transformar_ferramentas_analise(df: pd.DataFrame) -> pd.DataFrame:
+CATEGORIAS_FERRAMENTAS = ['Planilhas', 'Sistemas SUS', 'Painéis BI', 'Apresentações', 'Outras Ferramentas']
+
+_SEM_FERRAMENTA = '__sem_ferramenta__'
+
+
+def _nome_coluna_ferramenta(categoria: str) -> str:
+    return f"ferramenta_{categoria.lower().replace(' ', '_').replace('ã', 'a').replace('ç', 'c').replace('é', 'e')}"
+
+
+def _compilar_matcher_ferramentas():
     """
-    Transforma a coluna de ferramentas de análise em colunas binárias
+    Monta uma única regex com todos os padrões (mapeamento + palavras-chave +
+    frases de exclusão). A busca usa lookahead para encontrar ocorrências
+    sobrepostas; em cada posição a regex devolve o padrão mais longo, e
+    `categorias_por_padrao` já inclui as categorias de todos os padrões que
+    são prefixo dele, então o resultado é igual ao de testar padrão a padrão.
     """
-    
-    # Mapeamento básico das ferramentas padrão
-    mapeamento_ferramentas = {
-        'Planilhas (Excel, Google Sheets, etc.)': 'Planilhas',
-        'Sistemas de tabulação do SUS (Tabwin, TabNet, etc.)': 'Sistemas SUS', 
-        'Painéis de BI (Qlik Sense, Power BI, Looker Studio, Oracle, Sistema de Monitoramento da APS, etc.)': 'Painéis BI',
-        'Apresentações (PowerPoint, Google Slides, etc.)': 'Apresentações',
+    padrao_categoria = {}
+    for frase in FRASES_SEM_FERRAMENTA:
+        padrao_categoria.setdefault(frase, set()).add(_SEM_FERRAMENTA)
+    for padrao, categoria in MAPEAMENTO_FERRAMENTAS.items():
+        padrao_categoria.setdefault(padrao.lower(), set()).add(categoria)
+    for categoria, palavras in PALAVRAS_CHAVE_FERRAMENTAS.items():
+        for palavra in palavras:
+            padrao_categoria.setdefault(palavra, set()).add(categoria)
+
+    padroes = sorted(padrao_categoria, key=len, reverse=True)
+    categorias_por_padrao = {
+        padrao: frozenset().union(*(cats for outro, cats in padrao_categoria.items() if padrao.startswith(outro)))
+        for padrao in padroes
     }
-    
-    def categorizar_ferramentas(texto):
-        if pd.isna(texto) or texto == '':
-            return set(['Outras Ferramentas'])
-        
-        texto = str(texto).strip().lower()
-        categorias = set()
-        
-        # Verificar se é "nenhuma ferramenta" ou similar
-        if any(phrase in texto for phrase in ['nenhuma ferramenta', 'não faz análise', 'não faz analise', 'incipiente', 'não faz análise']):
-            return set(['Outras Ferramentas'])
-        
-        # 1. Primeiro busca pelos padrões exatos do mapeamento
-        for padrao, categoria in mapeamento_ferramentas.items():
-            if padrao.lower() in texto:
-                categorias.add(categoria)
-        
-        # 2. Busca por palavras-chave para categorizar automaticamente
-        palavras_chave = {
-            'Planilhas': ['planilha', 'excel', 'google sheets', 'calc', 'sheet'],
-            'Sistemas SUS': ['sistema', 'tabwin', 'tabnet', 'sus', 'sinan', 'siscan', 'sivep', 
-                           'sisvan', 'sim', 'sinasc', 'gal', 'sia', 'sih', 'datasus', 'e-sus'],
-            'Painéis BI': ['painel', 'bi', 'business intelligence', 'qlik', 'power bi', 'looker', 
-                          'oracle', 'tableau', 'dashboard', 'painéis'],
-            'Apresentações': ['apresentação', 'powerpoint', 'google slides', 'slide', 'ppt']
-        }
-        
-        for categoria, palavras in palavras_chave.items():
-            for palavra in palavras:
-                if palavra in texto:
-                    categorias.add(categoria)
-                    break
-        
-        # Se não encontrou nenhuma categoria padrão, classifica como "Outras Ferramentas"
-        if len(categorias) == 0:
-            categorias.add('Outras Ferramentas')
-        
-        return categorias
-    
+    regex = re.compile('(?=(' + '|'.join(re.escape(p) for p in padroes) + '))')
+    return regex, categorias_por_padrao
+
+
+_REGEX_FERRAMENTAS, _CATEGORIAS_POR_PADRAO = _compilar_matcher_ferramentas()
+
+
+@lru_cache(maxsize=None)
+def categorizar_ferramentas(texto: str) -> frozenset:
+    """
+    Classifica uma resposta em categorias de ferramenta numa única varredura.
+    O resultado fica em cache por texto distinto.
+    """
+    texto = texto.strip().lower()
+    if texto == '':
+        return frozenset(['Outras Ferramentas'])
+
+    categorias = set()
+    for match in _REGEX_FERRAMENTAS.finditer(texto):
+        categorias |= _CATEGORIAS_POR_PADRAO[match.group(1)]
+
+    # Verificar se é "nenhuma ferramenta" ou similar
+    if _SEM_FERRAMENTA in categorias or len(categorias) == 0:
+        return frozenset(['Outras Ferramentas'])
+
+    return frozenset(categorias)
+
+
+def transformar_ferramentas_analise(df: pd.DataFrame) -> dict:
+    """
+    Transforma a coluna de ferramentas de análise em colunas binárias
+    """
+    colunas = [_nome_coluna_ferramenta(categoria) for categoria in CATEGORIAS_FERRAMENTAS]
+
+    # Classifica cada resposta distinta uma única vez (NaN recebe código -1)
+    codigos, unicos = pd.factorize(df['ferramentas_analise'])
+    matriz_unicos = np.zeros((len(unicos) + 1, len(CATEGORIAS_FERRAMENTAS)), dtype=np.int64)
+    for i, texto in enumerate(unicos):
+        categorias = categorizar_ferramentas(str(texto))
+        matriz_unicos[i] = [categoria in categorias for categoria in CATEGORIAS_FERRAMENTAS]
+    matriz_unicos[-1] = [categoria == 'Outras Ferramentas' for categoria in CATEGORIAS_FERRAMENTAS]
+
     # Criar colunas dummy para cada categoria
-    categorias = ['Planilhas', 'Sistemas SUS', 'Painéis BI', 'Apresentações', 'Outras Ferramentas']
-    
-    for categoria in categorias:
-        coluna_nome = f"ferramenta_{categoria.lower().replace(' ', '_').replace('ã', 'a').replace('ç', 'c').replace('é', 'e')}"
-        df[coluna_nome] = df['ferramentas_analise'].apply(
-            lambda x: 1 if categoria in categorizar_ferramentas(x) else 0
-        )
-    
-    # Debug: mostrar distribuição
-    print("Distribuição das ferramentas:")
-    for categoria in categorias:
-        coluna = f"ferramenta_{categoria.lower().replace(' ', '_').replace('ã', 'a').replace('ç', 'c').replace('é', 'e')}"
-        print(f"{categoria}: {df[coluna].sum()}")
-    
+    matriz = matriz_unicos[codigos]
+    novas = dict(zip(colunas, matriz.T))
+
     # Calcular quantidade de ferramentas usadas (excluindo "Outras Ferramentas")
-    colunas_ferramentas_principais = [f"ferramenta_{cat.lower().replace(' ', '_').replace('ã', 'a').replace('ç', 'c').replace('é', 'e')}" 
-                                     for cat in ['Planilhas', 'Sistemas SUS', 'Painéis BI', 'Apresentações']]
-    
-    df['qtd_ferramentas'] = df[colunas_ferramentas_principais].sum(axis=1)
-    
+    qtd = matriz[:, :-1].sum(axis=1)
+    novas['qtd_ferramentas'] = qtd
+
     # Categorizar por quantidade
     conditions = [
-        df['qtd_ferramentas'] == 0,
-        df['qtd_ferramentas'] == 1,
-        df['qtd_ferramentas'] == 2,
-        df['qtd_ferramentas'] >= 3
+        qtd == 0,
+        qtd == 1,
+        qtd == 2,
+        qtd >= 3
     ]
-    
-    choices = ['Nenhuma', '1 ferramenta', '2 ferramentas', '3+ ferramentas']
-    
-    df['categoria_ferramentas'] = np.select(conditions, choices, default='Nenhuma')
-    
-    '''
-    print(f"\nPessoas sem ferramentas principais: {(df['qtd_ferramentas'] == 0).sum()}")
-    print(f"Pessoas com 1 ferramenta principal: {(df['qtd_ferramentas'] == 1).sum()}")
-    print(f"Pessoas com 2 ferramentas principais: {(df['qtd_ferramentas'] == 2).sum()}")
-    print(f"Pessoas com 3+ ferramentas principais: {(df['qtd_ferramentas'] >= 3).sum()}")
-    print(f"Pessoas com outras ferramentas: {df['ferramenta_outras_ferramentas'].sum()}")
-    '''
 
-    return df
+    choices = ['Nenhuma', '1 ferramenta', '2 ferramentas', '3+ ferramentas']
 
-def transformar_categoricos_grandes(df: pd.DataFrame) -> pd.DataFrame:
+    novas['categoria_ferramentas'] = np.select(conditions, choices, default='Nenhuma')
+
+    return novas
+
+# Colunas de cada família de transformação (também usadas no agendamento das etapas)
+COLUNAS_CATEGORICOS_GRANDES = ['estacoes_trabalho_boas']
+COLUNAS_CATEGORICOS_PEQUENOS = [
+    'webcams_disponiveis',
+    'microfones_disponiveis',
+    'fones_disponiveis',
+    'caixas_som_disponiveis',
+    'notebooks_com_camera',
+    'notebooks_com_caixa_som',
+    'notebooks_com_microfone',
+
+    'notebooks_boas',
+    'computadores_problema',
+
+    'televisores',
+    'projetores'
+]
+COLUNAS_ESCALA_ZERO_DEZ = ['qualidade_internet']
+COLUNAS_ESCALA_ZERO_CINCO = ['competencia_tecnica_equipe']
+
+
+# Escalas ordinais: cada nível, na ordem, com (valor numérico, faixa
+# simplificada). Valores numéricos de intervalos são o ponto médio; None vira
+# NaN. Respostas fora da tabela (vazio, "Não sei informar" quando não listado)
+# ficam NaN na coluna ordenada e em _num e caem em FAIXA_NAO_INFORMADO; o
+# relatório de qualidade as lista em 'nao_mapeadas' (respostas_nao_mapeadas).
+FAIXA_NAO_INFORMADO = 'Não informado'
+ESCALAS_ORDINAIS = {
+    'categoricos_grandes': {
+        'colunas': COLUNAS_CATEGORICOS_GRANDES,
+        'niveis': [
+            ('Nenhum', 0, 'Baixa'),
+            ('1 a 10', 5, 'Baixa'),
+            ('11 a 15', 13, 'Média'),
+            ('16 a 20', 18, 'Alta'),
+            ('21 ou mais', 25, 'Muito Alta'),
+        ],
+    },
+    'categoricos_pequenos': {
+        'colunas': COLUNAS_CATEGORICOS_PEQUENOS,
+        'niveis': [
+            ('Nenhum', 0, 'Baixa'),
+            ('1', 1, 'Baixa'),
+            ('2', 2, 'Média'),
+            ('3 a 5', 4, 'Alta'),
+            ('3 ou mais', 3, 'Alta'),  # televisores e projetores
+            ('6 ou mais', 6, 'Muito Alta'),
+            ('Não sei informar', None, FAIXA_NAO_INFORMADO),
+            ('Não se aplica', None, FAIXA_NAO_INFORMADO),
+        ],
+    },
+    'escalas_zero_dez': {
+        'colunas': COLUNAS_ESCALA_ZERO_DEZ,
+        'niveis': [(str(i), i, 'Baixa (0-3)') for i in range(0, 4)]
+                  + [(str(i), i, 'Média (4-6)') for i in range(4, 7)]
+                  + [(str(i), i, 'Alta (7-8)') for i in range(7, 9)]
+                  + [(str(i), i, 'Muito Alta (9-10)') for i in range(9, 11)],
+    },
+    'escalas_zero_cinco': {
+        'colunas': COLUNAS_ESCALA_ZERO_CINCO,
+        'niveis': [
+            ('1', 1, 'Baixa (1-2)'),
+            ('2', 2, 'Baixa (1-2)'),
+            ('3', 3, 'Média (3)'),
+            ('4', 4, 'Alta (4-5)'),
+            ('5', 5, 'Alta (4-5)'),
+            ('Não sei informar', None, FAIXA_NAO_INFORMADO),
+        ],
+    },
+}
+
+
+def codificar_ordinal(serie: pd.Series, niveis: list[tuple]) -> tuple[pd.Series, np.ndarray, np.ndarray]:
     """
-    Transforma as colunas em valores numéricos e categorias ordenados
+    Converte a coluna em categórica ordenada uma única vez e deriva o valor
+    numérico e a faixa simplificada indexando tabelas pelos códigos (np.take),
+    sem novas passadas sobre as strings. Retorna (ordenada, numeros, faixas).
     """
-    
-    # Mapeamento para valores numéricos (ponto médio dos intervalos)
-    mapeamento_numerico = {
-        '1 a 10': 5,
-        '11 a 15': 13, 
-        '16 a 20': 18,
-        '21 ou mais': 25,
-        'Nenhum': 0,
-        'Não sei informar': None,
-        '': None
-    }
-    
-    
-    # Aplicar mapeamento às colunas específicas
-    colunas_perifericos = [
-        'estacoes_trabalho_boas'
-    
-    ]
+    rotulos = pd.Index([nivel for nivel, _, _ in niveis])
+    if isinstance(serie.dtype, pd.CategoricalDtype):
+        # Recodifica só as categorias e expande pelos códigos (-1 = NaN)
+        por_categoria = np.append(rotulos.get_indexer(serie.cat.categories), -1)
+        codigos = por_categoria[serie.cat.codes.to_numpy()]
+    else:
+        codigos = rotulos.get_indexer(serie)
+    categorica = pd.Categorical.from_codes(codigos, categories=rotulos, ordered=True)
+    # Código -1 (fora da tabela) cai na última posição
+    codigos = np.where(codigos < 0, len(niveis), codigos)
+    numeros = np.array([np.nan if numero is None else numero for _, numero, _ in niveis] + [np.nan], dtype=float)
+    faixas = np.array([faixa for _, _, faixa in niveis] + [FAIXA_NAO_INFORMADO])
+    return pd.Series(categorica, index=serie.index), np.take(numeros, codigos), np.take(faixas, codigos)
 
-    
-    for coluna in colunas_perifericos:
+
+def codificar_escalas(df: pd.DataFrame, escala: dict) -> dict:
+    """
+    Aplica codificar_ordinal a cada coluna da escala presente no DataFrame:
+    substitui a coluna pela versão ordenada e cria <coluna>_num e
+    <coluna>_cat_simples.
+    """
+    novas = {}
+    for coluna in escala['colunas']:
         if coluna not in df.columns:
             continue
-            
-        # 1. Criar versão numérica
-        df[f'{coluna}_num'] = df[coluna].map(mapeamento_numerico)
-        
-        # 2. Substituir a coluna original pela versão ordenada
-        ordem_categorias = ['Nenhum', '1 a 10', '11 a 15', '16 a 20', '21 ou mais']
-        df[coluna] = pd.Categorical(
-            df[coluna], 
-            categories=ordem_categorias, 
-            ordered=True
-        )
-        
-        # 3. Criar categorias simplificadas
-        conditions = [
-            df[coluna].isin(['1 a 10', 'Nenhum']),
-            df[coluna] == '11 a 15',
-            df[coluna] == '16 a 20', 
-            df[coluna] == '21 ou mais',
-            df[coluna].isin(['Não sei informar', 'Não se aplica'])
+        ordenada, numeros, faixas = codificar_ordinal(df[coluna], escala['niveis'])
+        novas[f'{coluna}_num'] = pd.Series(numeros, index=df.index)
+        novas[coluna] = ordenada
+        novas[f'{coluna}_cat_simples'] = faixas
+    return novas
 
-        ]
-        
-        choices = ['Baixa', 'Média', 'Alta', 'Muito Alta', 'Não informado']
-        df[f'{coluna}_cat_simples'] = np.select(conditions, choices, default='Não informado')
 
-    return df
+def transformar_categoricos_grandes(df: pd.DataFrame) -> dict:
+    """
+    Transforma as colunas em valores numéricos e categorias ordenados
+    """
+    return codificar_escalas(df, ESCALAS_ORDINAIS['categoricos_grandes'])
 
-def transformar_categoricos_pequenos(df: pd.DataFrame) -> pd.DataFrame:
+
+def transformar_categoricos_pequenos(df: pd.DataFrame) -> dict:
     """
     Transforma as colunas em valores numéricos e categorias ordenados
     """
-    
-    # Mapeamento para valores numéricos (ponto médio dos intervalos)
-    mapeamento_numerico = {
-        'Nenhum': 0,
-        '1': 1,
-        '2': 2,
-        '3 a 5': 4,  # ponto médio
-        '6 ou mais': 6,
-        'Não sei informar': None,
-        'Não se aplica': None,
-        '': None
-    }
-    
-    colunas_perifericos = [
-        'webcams_disponiveis',
-        'microfones_disponiveis', 
-        'fones_disponiveis',
-        'caixas_som_disponiveis',
-        'notebooks_com_camera',
-        'notebooks_com_caixa_som', 
-        'notebooks_com_microfone',
-
-        'notebooks_boas',
-        'computadores_problema',
-
-        'televisores',
-        'projetores'
-    
-    ]
-    
-    for coluna in colunas_perifericos:
-        if coluna not in df.columns:
-            print(f"⚠️ Coluna {coluna} não encontrada")
-            continue
-            
-        print(f"\n🔍 Analisando {coluna}:")
-        print(f"Valores únicos antes: {df[coluna].unique()}")
-        print(f"Contagem de valores:\n{df[coluna].value_counts()}")
-        
-        # 1. Criar versão numérica
-        df[f'{coluna}_num'] = df[coluna].map(mapeamento_numerico)
-        
-        print(f"Valores numéricos criados:")
-        print(f"Mínimo: {df[f'{coluna}_num'].min()}")
-        print(f"Máximo: {df[f'{coluna}_num'].max()}")
-        print(f"Média: {df[f'{coluna}_num'].mean()}")
-        print(f"Contagem de NaNs: {df[f'{coluna}_num'].isna().sum()}")
-        
-        ordem_categorias = ['Nenhum', '1', '2', '3 a 5', '6 ou mais', 'Não sei informar', 'Não se aplica']
-        df[coluna] = pd.Categorical(df[coluna], categories=ordem_categorias, ordered=True)
-        
-        conditions = [
-            df[coluna].isin(['Nenhum', '1']),
-            df[coluna] == '2',
-            df[coluna] == '3 a 5', 
-            df[coluna] == '6 ou mais',
-            df[coluna].isin(['Não sei informar', 'Não se aplica'])
-        ]
-        
-        choices = ['Baixa', 'Média', 'Alta', 'Muito Alta', 'Não informado']
-        df[f'{coluna}_cat_simples'] = np.select(conditions, choices, default='Não informado')
-
-    return df
+    return codificar_escalas(df, ESCALAS_ORDINAIS['categoricos_pequenos'])
 
 
-def transformar_escala_ordenada(df: pd.DataFrame, coluna: str, ordem_categorias: list) -> pd.DataFrame:
-    """
-    Função auxiliar para transformar qualquer coluna em categórica ordenada
-    """
-    if coluna not in df.columns:
-        return df
-        
-    # Converter para categórica ordenada
-    df[coluna] = pd.Categorical(
-        df[coluna], 
-        categories=ordem_categorias, 
-        ordered=True
-    )
-    
-    return df
-
-def transformar_escalas_zero_dez(df: pd.DataFrame) -> pd.DataFrame:
+def transformar_escalas_zero_dez(df: pd.DataFrame) -> dict:
     """
     Aplica transformação ordenada a todas as colunas de escala 0-10
     """
-    mapeamento_numerico = {
-        '0': 0, '1': 1, '2': 2, '3': 3, '4': 4, '5': 5,
-        '6': 6, '7': 7, '8': 8, '9': 9, '10': 10,
-        'Não sei informar': None, 'Não se aplica': None,
-    }
-    
-    # Definir a ordem natural para escala 0-10
-    ordem_escala = ['0', '1', '2', '3', '4', '5', '6', '7', '8', '9', '10']
-    
-    # Colunas que são escalas 0-10
-    colunas_escala = ['qualidade_internet']
-    
-    for coluna in colunas_escala:
-        if coluna not in df.columns:
-            continue
-            
-        # 1. Criar versão numérica
-        df[f'{coluna}_num'] = df[coluna].map(mapeamento_numerico)
-        
-        # 2. Aplicar transformação ordenada usando a função auxiliar
-        df = transformar_escala_ordenada(df, coluna, ordem_escala)
-        
-        # 3. Criar categorias simplificadas
-        conditions = [
-            df[coluna].isin(['0', '1', '2', '3']),
-            df[coluna].isin(['4', '5', '6']),
-            df[coluna].isin(['7', '8']),
-            df[coluna].isin(['9', '10']),
-            df[coluna].isin(['Não sei informar', 'Não se aplica'])
-        ]
-        
-        choices = ['Baixa (0-3)', 'Média (4-6)', 'Alta (7-8)', 'Muito Alta (9-10)', 'Não informado']
-        df[f'{coluna}_cat_simples'] = np.select(conditions, choices, default='Não informado')
-    
-    return df
-
-def transformar_escala_ordenada(df: pd.DataFrame, coluna: str, ordem_categorias: list) -> pd.DataFrame:
-    """
-    Função auxiliar para transformar qualquer coluna em categórica ordenada
-    """
-    if coluna not in df.columns:
-        return df
-        
-    # Converter para categórica ordenada
-    df[coluna] = pd.Categorical(
-        df[coluna], 
-        categories=ordem_categorias, 
-        ordered=True
-    )
-    
-    return df
+    return codificar_escalas(df, ESCALAS_ORDINAIS['escalas_zero_dez'])
 
-def transformar_escalas_zero_dez(df: pd.DataFrame) -> pd.DataFrame:
-    """
-    Aplica transformação ordenada a todas as colunas de escala 0-10
-    """
-    mapeamento_numerico = {
-        '0': 0, '1': 1, '2': 2, '3': 3, '4': 4, '5': 5,
-        '6': 6, '7': 7, '8': 8, '9': 9, '10': 10,
-        'Não sei informar': None, 'Não se aplica': None,
-    }
-    
-    # Definir a ordem natural para escala 0-10
-    ordem_escala = ['0', '1', '2', '3', '4', '5', '6', '7', '8', '9', '10']
-    
-    # Colunas que são escalas 0-10
-    colunas_escala = ['qualidade_internet']
-    
-    for coluna in colunas_escala:
-        if coluna not in df.columns:
-            continue
-            
-        # 1. Criar versão numérica
-        df[f'{coluna}_num'] = df[coluna].map(mapeamento_numerico)
-        
-        # 2. Aplicar transformação ordenada usando a função auxiliar
-        df = transformar_escala_ordenada(df, coluna, ordem_escala)
-        
-        # 3. Criar categorias simplificadas
-        conditions = [
-            df[coluna].isin(['0', '1', '2', '3']),
-            df[coluna].isin(['4', '5', '6']),
-            df[coluna].isin(['7', '8']),
-            df[coluna].isin(['9', '10']),
-            df[coluna].isin(['Não sei informar', 'Não se aplica'])
-        ]
-        
-        choices = ['Baixa (0-3)', 'Média (4-6)', 'Alta (7-8)', 'Muito Alta (9-10)', 'Não informado']
-        df[f'{coluna}_cat_simples'] = np.select(conditions, choices, default='Não informado')
-    
-    return df
 
-def transformar_escalas_zero_cinco(df: pd.DataFrame) -> pd.DataFrame:
+def transformar_escalas_zero_cinco(df: pd.DataFrame) -> dict:
     """
     Aplica transformação ordenada a todas as colunas de escala 1-5
     """
-    mapeamento_numerico = {
-        '1': 1, '2': 2, '3': 3, '4': 4, '5': 5,
-        'Não sei informar': None
-    }
-    
-    # Definir a ordem natural para escala 1-5
-    ordem_escala = ['1', '2', '3', '4', '5']
-    
-    # Colunas que são escalas 1-5
-    colunas_escala = ['competencia_tecnica_equipe']
-    
-    for coluna in colunas_escala:
-        if coluna not in df.columns:
-            continue
-            
-        # 1. Criar versão numérica
-        df[f'{coluna}_num'] = df[coluna].map(mapeamento_numerico)
-        
-        # 2. Aplicar transformação ordenada usando a função auxiliar
-        df = transformar_escala_ordenada(df, coluna, ordem_escala)
-        
-        # 3. Criar categorias simplificadas
-        conditions = [
-            df[coluna].isin(['1', '2']),
-            df[coluna] == '3',
-            df[coluna].isin(['4', '5']),
-            df[coluna] == 'Não sei informar'
-        ]
-        
-        choices = ['Baixa (1-2)', 'Média (3)', 'Alta (4-5)', 'Não informado']
-        df[f'{coluna}_cat_simples'] = np.select(conditions, choices, default='Não informado')
-    
-    return df
-
-def tratar_sistemas_e_qualidade(df: pd.DataFrame) -> pd.DataFrame:
+    return codificar_escalas(df, ESCALAS_ORDINAIS['escalas_zero_cinco'])
+
+
+# Lista de sistemas possíveis (baseado nas colunas de qualidade)
+SISTEMAS_INFORMACAO = [
+    'SINASC', 'Vida+', 'E-SUS AB/SISAB', 'SINAN', 'GAL',
+    'SIA-SUS', 'SIH-SUS', 'SIM', 'Sivep-Gripe', 'E-SUS Notifica', 'Sisvan'
+]
+
+
+# Mapeamento correto de sistema -> nomes reais das colunas
+COLUNAS_SISTEMAS = {
+    'SINASC': ('usou_sinasc', 'qualidade_sinasc'),
+    'Vida+': ('usou_vidaplus', 'qualidade_vida_plus'),
+    'E-SUS AB/SISAB': ('usou_e_sus_ab/sisab', 'qualidade_esus_sisab'),
+    'SINAN': ('usou_sinan', 'qualidade_sinan'),
+    'GAL': ('usou_gal', 'qualidade_gal'),
+    'SIA-SUS': ('usou_sia_sus', 'qualidade_sia_sus'),
+    'SIH-SUS': ('usou_sih_sus', 'qualidade_sih_sus'),
+    'SIM': ('usou_sim', 'qualidade_sim'),
+    'Sivep-Gripe': ('usou_sivep_gripe', 'qualidade_sivep_gripe'),
+    'E-SUS Notifica': ('usou_e_sus_notifica', 'qualidade_esus_notifica'),
+    'Sisvan': ('usou_sisvan', 'qualidade_sisvan')
+}
+
+NOTAS_QUALIDADE = {
+    'Muito Ruim': 1,
+    'Ruim': 2,
+    'Bom': 3,
+    'Muito bom': 4,
+    'Excelente': 5
+}
+
+
+def tratar_sistemas_e_qualidade(df: pd.DataFrame) -> dict:
     """
     Trata as colunas Q25 (sistemas usados) e Q26 (qualidade dos dados).
     Cria colunas binárias de uso e avaliação por sistema.
     Detecta inconsistências entre uso e avaliação.
-    """
-
-    # Lista de sistemas possíveis (baseado nas colunas de qualidade)
-    sistemas = [
-        'SINASC', 'Vida+', 'E-SUS AB/SISAB', 'SINAN', 'GAL',
-        'SIA-SUS', 'SIH-SUS', 'SIM', 'Sivep-Gripe', 'E-SUS Notifica', 'Sisvan'
-    ]
 
-    # Normalizar a coluna de sistemas usados
-    df['sistemas_informacao_utilizados'] = df['sistemas_informacao_utilizados'].fillna('').str.strip()
+    A resposta CHECKBOX é decodificada uma vez numa matriz linhas x sistemas
+    (ver multi_hot_checkbox); avaliação, inconsistências e totais saem de
+    operações sobre essa matriz.
+    """
+    sistemas = SISTEMAS_INFORMACAO
+    colunas_uso = [COLUNAS_SISTEMAS[sistema][0] for sistema in sistemas]
+    colunas_avaliou = [coluna.replace('usou_', 'avaliou_', 1) for coluna in colunas_uso]
 
-    # Criar colunas binárias de uso
-    for sistema in sistemas:
-        col_uso = f'usou_{sistema.lower().replace("-", "_").replace("+", "plus").replace(" ", "_")}'
-        df[col_uso] = df['sistemas_informacao_utilizados'].str.contains(sistema, case=False, na=False).astype(int)
+    # Normalizar a coluna de sistemas usados (texto, como as demais colunas
+    # livres; .str na coluna categórica devolveria object)
+    utilizados = df['sistemas_informacao_utilizados'].astype(str).fillna('').str.strip()
 
-    # Criar colunas binárias de avaliação (se avaliou, o valor não é vazio ou "Não se aplica")
-    for sistema in sistemas:
-        col_qualidade = f'qualidade_{sistema.lower().replace("-", "_").replace("+", "plus").replace(" ", "_")}'
-        col_avaliou = f'avaliou_{sistema.lower().replace("-", "_").replace("+", "plus").replace(" ", "_")}'
+    # Uso: opção inteira entre separadores (sem "SIM" dentro de outros nomes)
+    uso = multi_hot_checkbox(df['sistemas_informacao_utilizados'], sistemas, ignorar_caixa=True).astype(np.int64)
 
+    # Avaliação: a coluna de qualidade do sistema não está vazia nem "Não se aplica"
+    avaliou = np.zeros_like(uso)
+    for j, sistema in enumerate(sistemas):
+        col_qualidade = COLUNAS_SISTEMAS[sistema][1]
         if col_qualidade in df.columns:
-            df[col_avaliou] = df[col_qualidade].notna() & (~df[col_qualidade].isin(['', 'Não se aplica'])).astype(int)
-        else:
-            df[col_avaliou] = 0  # Se não existe coluna de qualidade, não avaliou
+            qualidade = df[col_qualidade]
+            avaliou[:, j] = (qualidade.notna() & ~qualidade.isin(['', 'Não se aplica'])).to_numpy()
 
-    # Detectar inconsistências
-    df['sistemas_inconsistentes'] = 0
-    for sistema in sistemas:
-        col_uso = f'usou_{sistema.lower().replace("-", "_").replace("+", "plus").replace(" ", "_")}'
-        col_avaliou = f'avaliou_{sistema.lower().replace("-", "_").replace("+", "plus").replace(" ", "_")}'
+    novas = {'sistemas_informacao_utilizados': utilizados}
+    novas.update(zip(colunas_uso, uso.T))
+    novas.update(zip(colunas_avaliou, avaliou.T))
 
-        # Inconsistência: avaliou mas não usou
-        inconsistencia = (df[col_avaliou] == 1) & (df[col_uso] == 0)
-        df.loc[inconsistencia, 'sistemas_inconsistentes'] += 1
+    # Inconsistência: avaliou mas não usou
+    novas['sistemas_inconsistentes'] = ((avaliou == 1) & (uso == 0)).sum(axis=1)
 
     # Criar contadores
-    df['total_sistemas_usados'] = df[[f'usou_{s.lower().replace("-", "_").replace("+", "plus").replace(" ", "_")}' for s in sistemas]].sum(axis=1)
-    df['total_sistemas_avaliados'] = df[[f'avaliou_{s.lower().replace("-", "_").replace("+", "plus").replace(" ", "_")}' for s in sistemas]].sum(axis=1)
+    novas['total_sistemas_usados'] = uso.sum(axis=1)
+    novas['total_sistemas_avaliados'] = avaliou.sum(axis=1)
 
-    return df
+    return novas
 
 def criar_resumo_sistemas(df: pd.DataFrame) -> pd.DataFrame:
     """
     Cria uma tabela resumo com uso e qualidade média por sistema.
     """
 
-    sistemas = [
-        'SINASC', 'Vida+', 'E-SUS AB/SISAB', 'SINAN', 'GAL', 'SIA-SUS', 'SIH-SUS', 'SIM', 'Sivep-Gripe', 'E-SUS Notifica', 'Sisvan'
-    ]
-
-    # Mapeamento correto de sistema -> nomes reais das colunas
-    col_map = {
-        'SINASC': ('usou_sinasc', 'qualidade_sinasc'),
-        'Vida+': ('usou_vidaplus', 'qualidade_vida_plus'),
-        'E-SUS AB/SISAB': ('usou_e_sus_ab/sisab', 'qualidade_esus_sisab'),
-        'SINAN': ('usou_sinan', 'qualidade_sinan'),
-        'GAL': ('usou_gal', 'qualidade_gal'),
-        'SIA-SUS': ('usou_sia_sus', 'qualidade_sia_sus'),
-        'SIH-SUS': ('usou_sih_sus', 'qualidade_sih_sus'),
-        'SIM': ('usou_sim', 'qualidade_sim'),
-        'Sivep-Gripe': ('usou_sivep_gripe', 'qualidade_sivep_gripe'),
-        'E-SUS Notifica': ('usou_e_sus_notifica', 'qualidade_esus_notifica'),
-        'Sisvan': ('usou_sisvan', 'qualidade_sisvan')
-    }
-
-    qualidade_map = {
-        'Muito Ruim': 1,
-        'Ruim': 2, 
-        'Bom': 3,
-        'Muito bom': 4,
-        'Excelente': 5
-    }
+    sistemas = SISTEMAS_INFORMACAO
 
     resumo = []
     for sistema in sistemas:
-        col_uso, col_qualidade = col_map[sistema]
+        col_uso, col_qualidade = COLUNAS_SISTEMAS[sistema]
         
         uso = df[col_uso].sum()
-        qualidades = df[col_qualidade].dropna().map(qualidade_map)
+        qualidades = mapear_valores(df[col_qualidade].dropna(), NOTAS_QUALIDADE)
         
         if len(qualidades) > 0:
             qualidade_media = qualidades.mean()
@@ -748,211 +1481,2082 @@ def criar_resumo_sistemas(df: pd.DataFrame) -> pd.DataFrame:
     return resumo_df
 
 # FUNÇÕES para INDICADORES – PONTUAÇÃO POR DIMENSÃO
+#
+# Cada dimensão do IP-SalaSit é uma soma ponderada de itens normalizados 0-1:
+# - item com 'mapa': resposta -> valor (respostas fora do mapa viram 'padrao')
+# - item numérico: min(coluna, 'limite') / 'escala', com NaN -> 'padrao'
+# 'padrao' None mantém NaN (a dimensão e o IP ficam NaN para aquela linha).
+# Os pesos podem ser sobrescritos por um JSON no mesmo formato (ETL_PESOS_IP).
+RESPOSTA_SIM_PARCIAL = {'Sim': 1, 'Parcialmente': 0.5, 'Não': 0, 'Não sei informar': 0}
+
+DIMENSOES_IP = {
+    'ip_pessoas': {
+        'peso': 0.30,
+        'itens': [
+            {'coluna': 'competencia_tecnica_equipe_num', 'escala': 5, 'padrao': 1, 'peso': 40},
+            {'coluna': 'participa_qualificacoes', 'padrao': 0, 'peso': 25, 'mapa': {
+                'Sim, regularmente (ao menos uma vez por ano)': 1,
+                'Sim, mas esporadicamente': 0.5,
+                'Não': 0,
+            }},
+            {'coluna': 'cultura_uso_dados', 'padrao': 0, 'peso': 25, 'mapa': {
+                'Sim, a análise de dados é central em nossas reuniões e planejamentos.': 1,
+                'Em partes, usamos dados, mas as decisões ainda são muito baseadas na experiência.': 0.5,
+                'Não, os dados são vistos mais como uma obrigação de preenchimento do que como uma ferramenta de gestão.': 0,
+            }},
+            {'coluna': 'qtd_ferramentas', 'limite': 4, 'escala': 4, 'padrao': 0, 'peso': 10},
+        ],
+    },
+    'ip_infra': {
+        'peso': 0.30,
+        'itens': [
+            {'coluna': 'estacoes_trabalho_boas_num', 'escala': 25, 'padrao': 0, 'peso': 30},
+            {'coluna': 'notebooks_boas_num', 'escala': 6, 'padrao': 0, 'peso': 15},
+            {'coluna': 'internet_estavel', 'mapa': {'Sim': 1}, 'padrao': 0, 'peso': 20},
+            {'coluna': 'qualidade_internet_num', 'escala': 10, 'padrao': 0, 'peso': 10},
+            {'coluna': 'sala_situacao', 'mapa': {'Sim, possui uma sala adequada': 1}, 'padrao': 0, 'peso': 20},
+            {'coluna': 'cabos_adaptadores', 'mapa': {'Sim, para todos os equipamentos': 1}, 'padrao': 0, 'peso': 5},
+        ],
+    },
+    'ip_processos': {
+        'peso': 0.25,
+        'itens': [
+            {'coluna': 'indicadores_definidos', 'mapa': {'Sim': 1}, 'padrao': 0, 'peso': 20},
+            {'coluna': 'dados_subsidiam_metas', 'mapa': RESPOSTA_SIM_PARCIAL, 'padrao': None, 'peso': 15},
+            {'coluna': 'metas_base_dados', 'mapa': RESPOSTA_SIM_PARCIAL, 'padrao': None, 'peso': 15},
+            {'coluna': 'fluxos_formalizados', 'mapa': {'Sim': 1}, 'padrao': 0, 'peso': 15},
+            {'coluna': 'rotina_validacao', 'mapa': {'Sim': 1}, 'padrao': 0, 'peso': 20},
+            {'coluna': 'paineis_tomada_decisao', 'mapa': RESPOSTA_SIM_PARCIAL, 'padrao': None, 'peso': 15},
+        ],
+    },
+    'ip_seguranca': {
+        'peso': 0.15,
+        'itens': [
+            {'coluna': 'conhecimento_lgpd', 'padrao': None, 'peso': 30, 'mapa': {
+                'Sim': 1, 'Tenho uma noção, mas não conheço em detalhes': 0.5, 'Não': 0}},
+            {'coluna': 'treinamento_lgpd', 'padrao': None, 'peso': 25, 'mapa': {
+                'Sim': 1, 'Apenas orientações informais': 0.5, 'Não': 0}},
+            {'coluna': 'acesso_individualizado', 'padrao': None, 'peso': 25, 'mapa': {
+                'Sim': 1, 'Em parte (alguns sistemas sim, outros não)': 0.5, 'Não, os acessos são compartilhados': 0}},
+            {'coluna': 'protocolos_backup', 'mapa': {'Sim': 1}, 'padrao': 0, 'peso': 20},
+        ],
+    },
+}
+
+
+def carregar_dimensoes_ip(caminho: str | None = None) -> dict:
+    """
+    Pesos do IP-SalaSit: os padrões de DIMENSOES_IP ou um JSON com a mesma estrutura.
+    """
+    caminho = caminho or os.environ.get("ETL_PESOS_IP")
+    if not caminho:
+        return DIMENSOES_IP
+    logger.info(f"Usando pesos do IP-SalaSit de {caminho}")
+    with open(caminho, encoding="utf-8") as f:
+        return json.load(f)
+
 
-def _pontuar_pessoas(df: pd.DataFrame) -> pd.Series:
-    """
-    0-100 baseado em:
-    - competencia_tecnica_equipe (1-5)
-    - participa_qualificacoes
-    - cultura_uso_dados
-    - qtd_ferramentas (0-4+)
-    """
-    logger = logging.getLogger("ETL.ip_sala_situacao.pessoas")
-
-    # ---- valores brutos ----
-    comp_raw = pd.to_numeric(df['competencia_tecnica_equipe_num'], errors='coerce').fillna(1)
-    comp = comp_raw / 5                                    # 0-1
-    qual = df['participa_qualificacoes'].map({
-        'Sim, regularmente (ao menos uma vez por ano)': 1,
-        'Sim, mas esporadicamente': 0.5,
-        'Não': 0
-    }).fillna(0)
-    cult = df['cultura_uso_dados'].map({
-        'Sim, a análise de dados é central em nossas reuniões e planejamentos.': 1,
-        'Em partes, usamos dados, mas as decisões ainda são muito baseadas na experiência.': 0.5,
-        'Não, os dados são vistos mais como uma obrigação de preenchimento do que como uma ferramenta de gestão.': 0
-    }).fillna(0)
-    ferr = np.minimum(df['qtd_ferramentas'].fillna(0), 4) / 4   # 0-1
-
-    # ---- log de exemplo (primeira linha) ----
-    if len(df) > 0:
-        logger.info(f"Exemplo linha 0 -> comp: {comp.iloc[0]:.2f}, qual: {qual.iloc[0]:.2f}, "
-                    f"cult: {cult.iloc[0]:.2f}, ferr: {ferr.iloc[0]:.2f}")
-
-    # ---- score final 0-100 (sem duplicar *100) ----
-    score = (
-        comp * 40 +
-        qual * 25 +
-        cult * 25 +
-        ferr * 10
-    ) * 1
-    return score.clip(0, 100)
-
-def _pontuar_infraestrutura(df: pd.DataFrame) -> pd.Series:
-    logger = logging.getLogger("ETL.ip_sala_situacao.infra")
-
-    est = df['estacoes_trabalho_boas_num'].fillna(0) / 25
-    note = df['notebooks_boas_num'].fillna(0) / 6
-    net_ok = (df['internet_estavel'] == 'Sim').astype(int)
-    net_not = pd.to_numeric(df['qualidade_internet_num'], errors='coerce').fillna(0) / 10
-    sala = (df['sala_situacao'] == 'Sim, possui uma sala adequada').astype(int)
-    cabo = (df['cabos_adaptadores'] == 'Sim, para todos os equipamentos').astype(int)
-
-    if len(df) > 0:
-        logger.info(f"Exemplo linha 0 -> est: {est.iloc[0]:.2f}, note: {note.iloc[0]:.2f}, "
-                    f"net_ok: {net_ok.iloc[0]:.2f}, net_not: {net_not.iloc[0]:.2f}, "
-                    f"sala: {sala.iloc[0]:.2f}, cabo: {cabo.iloc[0]:.2f}")
-
-    score = (
-        est * 30 +
-        note * 15 +
-        net_ok * 20 + net_not * 10 +
-        sala * 20 +
-        cabo * 5
-    )  # <-- removido *100
-    return score.clip(0, 100)
-
-def _pontuar_processos(df: pd.DataFrame) -> pd.Series:
-    logger = logging.getLogger("ETL.ip_sala_situacao.processos")
-
-    # ---- etapas normalizadas 0-1 ----
-    ind_def     = (df['indicadores_definidos']        == 'Sim').astype(int)
-    dados_meta  = df['dados_subsidiam_metas'].map({'Sim': 1, 'Parcialmente': 0.5, 'Não': 0, 'Não sei informar': 0})
-    meta_dados  = df['metas_base_dados'].map({'Sim': 1, 'Parcialmente': 0.5, 'Não': 0, 'Não sei informar': 0})
-    fluxos      = (df['fluxos_formalizados']         == 'Sim').astype(int)
-    rotina      = (df['rotina_validacao']            == 'Sim').astype(int)
-    paineis     = df['paineis_tomada_decisao'].map({'Sim': 1, 'Parcialmente': 0.5, 'Não': 0, 'Não sei informar': 0})
-
-    # ---- log amostral (5 primeiras) ----
-    for i in range(min(5, len(df))):
-        logger.info(f"idx {i} -> ind_def:{ind_def.iloc[i]:.2f} dados_meta:{dados_meta.iloc[i]:.2f} "
-                    f"meta_dados:{meta_dados.iloc[i]:.2f} fluxos:{fluxos.iloc[i]:.2f} "
-                    f"rotina:{rotina.iloc[i]:.2f} paineis:{paineis.iloc[i]:.2f}")
-
-    score = (
-        ind_def   * 20 +
-        dados_meta * 15 +
-        meta_dados * 15 +
-        fluxos    * 15 +
-        rotina    * 20 +
-        paineis   * 15
-    )  # já 0-100
-    logger.info(f"ESTATÍSTICA processos -> min:{score.min():.1f} | média:{score.mean():.1f} | max:{score.max():.1f}")
-    return score.clip(0, 100)
-
-def _pontuar_seguranca(df: pd.DataFrame) -> pd.Series:
-    logger = logging.getLogger("ETL.ip_sala_situacao.seguranca")
-
-    # ---- etapas normalizadas 0-1 ----
-    lgpd        = df['conhecimento_lgpd'].map({'Sim': 1, 'Tenho uma noção, mas não conheço em detalhes': 0.5, 'Não': 0})
-    treino      = df['treinamento_lgpd'].map({'Sim': 1, 'Apenas orientações informais': 0.5, 'Não': 0})
-    acesso      = df['acesso_individualizado'].map({'Sim': 1, 'Em parte (alguns sistemas sim, outros não)': 0.5, 'Não, os acessos são compartilhados': 0})
-    backup      = (df['protocolos_backup'] == 'Sim').astype(int)
-
-    # ---- log amostral (5 primeiras) ----
-    for i in range(min(5, len(df))):
-        logger.info(f"idx {i} -> lgpd:{lgpd.iloc[i]:.2f} treino:{treino.iloc[i]:.2f} "
-                    f"acesso:{acesso.iloc[i]:.2f} backup:{backup.iloc[i]:.2f}")
-
-    score = (
-        lgpd   * 30 +
-        treino * 25 +
-        acesso * 25 +
-        backup * 20
-    ) 
-    logger.info(f"ESTATÍSTICA seguranca -> min:{score.min():.1f} | média:{score.mean():.1f} | max:{score.max():.1f}")
-    return score.clip(0, 100)
-
-def adicionar_ip_sala_situacao(df: pd.DataFrame) -> pd.DataFrame:
+def _valores_item(df: pd.DataFrame, item: dict) -> np.ndarray:
+    coluna = item['coluna']
+    if coluna not in df.columns:
+        logger.warning(f"Coluna {coluna} não encontrada – preenchendo com 0")
+        return np.zeros(len(df))
+
+    serie = df[coluna]
+    if 'mapa' in item:
+        # Respostas viram códigos categóricos uma vez; o mapa é aplicado por categoria
+        if not isinstance(serie.dtype, pd.CategoricalDtype):
+            serie = serie.astype('category')
+        valores = mapear_valores(serie, item['mapa']).to_numpy(dtype=float)
+    else:
+        valores = pd.to_numeric(serie, errors='coerce').to_numpy(dtype=float)
+
+    if item.get('padrao') is not None:
+        valores = np.where(np.isnan(valores), item['padrao'], valores)
+    if 'limite' in item:
+        valores = np.minimum(valores, item['limite'])
+    return valores / item.get('escala', 1)
+
+
+def pontuar_dimensoes(df: pd.DataFrame, dimensoes: dict | None = None) -> pd.DataFrame:
+    """
+    Calcula as dimensões (0-100) e o IP-SalaSit de uma vez, acumulando item a
+    item numa matriz linhas x dimensões.
+    """
+    dimensoes = dimensoes or carregar_dimensoes_ip()
+    nomes = list(dimensoes)
+
+    # Soma item a item, na ordem declarada (não via matmul: a ordem de soma do
+    # BLAS muda com o nº de linhas e o resultado não pode depender do bloco)
+    scores = np.zeros((len(df), len(nomes)))
+    nulos = np.zeros((len(df), len(nomes)), dtype=bool)
+    for j, nome in enumerate(nomes):
+        for item in dimensoes[nome]['itens']:
+            valores = _valores_item(df, item)
+            # NaN num item anula só a dimensão que usa o item
+            if item['peso'] != 0:
+                nulos[:, j] |= np.isnan(valores)
+            scores[:, j] += np.nan_to_num(valores) * item['peso']
+    scores[nulos] = np.nan
+    scores = np.clip(scores, 0, 100)
+
+    # Soma na ordem das dimensões (não via dot) para o arredondamento em
+    # valores como 58.375 não mudar em relação ao cálculo original
+    ip = np.zeros(len(df))
+    for j, nome in enumerate(nomes):
+        ip = ip + dimensoes[nome]['peso'] * scores[:, j]
+
+    resultado = pd.DataFrame(scores, columns=nomes, index=df.index)
+    resultado['ip_sala_situacao'] = np.round(ip, 2)
+    return resultado
+
+
+def adicionar_ip_sala_situacao(df: pd.DataFrame) -> dict:
     logger.info("Calculando IP-SalaSit...")
-    df = df.copy()
-
-    num_cols = ['competencia_tecnica_equipe_num', 'estacoes_trabalho_boas_num',
-                'notebooks_boas_num', 'qualidade_internet_num', 'qtd_ferramentas']
-    for c in num_cols:
-        if c not in df.columns:
-            logger.warning(f"Coluna {c} não encontrada – preenchendo com 0")
-            df[c] = 0
-
-    df['ip_pessoas'] = _pontuar_pessoas(df)
-    df['ip_infra'] = _pontuar_infraestrutura(df)
-    df['ip_processos'] = _pontuar_processos(df)
-    df['ip_seguranca'] = _pontuar_seguranca(df)
-
-    df['ip_sala_situacao'] = (
-        0.30 * df['ip_pessoas'] +
-        0.30 * df['ip_infra'] +
-        0.25 * df['ip_processos'] +
-        0.15 * df['ip_seguranca']
-    ).round(2)
+
+    scores = pontuar_dimensoes(df)
 
     logger.info("IP-SalaSit calculado com sucesso.")
-    return df
+    return dict(scores.items())
+
+# -------------------------------------------------------------------
+# CUBO DE AGREGADOS PARA OS DASHBOARDS
+# -------------------------------------------------------------------
+# Contagem e médias por distrito × área de atuação × coordenação, com todos os
+# subtotais (dimensão agregada = TOTAL_CUBO). As somas são feitas uma vez no
+# nível mais fino e os subtotais saem delas, então o custo não cresce com o
+# número de combinações.
+DIMENSOES_CUBO = ['ds_vinculado', 'area_atuacao', 'coord_ds']
+TOTAL_CUBO = '(Todos)'
+COLUNAS_CATEGORIA_CUBO = ['atuacao_categoria', 'categoria_ferramentas']
+
+
+def medidas_cubo(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Uma coluna float por medida (NaN fica fora da média): IP-SalaSit e
+    dimensões, uso e nota de qualidade por sistema, uso de cada categoria de
+    ferramenta e participação de cada valor das colunas de categoria.
+    """
+    medidas = {}
+    for coluna in list(carregar_dimensoes_ip()) + ['ip_sala_situacao']:
+        if coluna in df.columns:
+            medidas[f'media_{coluna}'] = df[coluna].astype(float)
+    for col_uso, col_qualidade in COLUNAS_SISTEMAS.values():
+        if col_uso in df.columns:
+            medidas[f'pct_{col_uso}'] = df[col_uso].astype(float)
+        if col_qualidade in df.columns:
+            medidas[f'media_{col_qualidade}'] = mapear_valores(df[col_qualidade], NOTAS_QUALIDADE).astype(float)
+    for categoria in CATEGORIAS_FERRAMENTAS:
+        coluna = _nome_coluna_ferramenta(categoria)
+        if coluna in df.columns:
+            medidas[f'pct_{coluna}'] = df[coluna].astype(float)
+    for coluna in COLUNAS_CATEGORIA_CUBO:
+        if coluna in df.columns:
+            valores = df[coluna].astype(object)
+            for valor in sorted(pd.unique(valores.dropna()), key=str):
+                medidas[f'pct_{coluna}: {valor}'] = (valores == valor).astype(float)
+    return pd.DataFrame(medidas, index=df.index)
+
+
+def criar_cubo(df: pd.DataFrame, dimensoes: list[str] | None = None) -> pd.DataFrame:
+    """
+    Uma linha por combinação observada das dimensões e por subtotal, com
+    n_respostas e a média de cada medida (ver medidas_cubo).
+    """
+    dimensoes = [d for d in (dimensoes or DIMENSOES_CUBO) if d in df.columns]
+    medidas = medidas_cubo(df)
+    nomes = list(medidas.columns)
+
+    partes = []
+    if dimensoes:
+        chaves = [df[d].astype(object).fillna('').rename(d) for d in dimensoes]
+        agrupado = medidas.groupby(chaves, sort=True)
+        somas, contagens, tamanhos = agrupado.sum(), agrupado.count(), agrupado.size()
+
+        for k in range(len(dimensoes), 0, -1):
+            for grupo in combinations(dimensoes, k):
+                nivel = list(grupo)
+                media = somas.groupby(level=nivel).sum() / contagens.groupby(level=nivel).sum().replace(0, np.nan)
+                media.insert(0, 'n_respostas', tamanhos.groupby(level=nivel).sum())
+                partes.append(media.reset_index())
+
+    # Total geral
+    total = medidas.sum() / medidas.count().replace(0, np.nan)
+    partes.append(pd.DataFrame([{'n_respostas': len(df), **total.to_dict()}]))
+
+    cubo = pd.concat(partes, ignore_index=True)
+    for d in dimensoes:
+        cubo[d] = cubo[d].fillna(TOTAL_CUBO)
+    cubo[nomes] = cubo[nomes].round(4)
+    return cubo[dimensoes + ['n_respostas'] + nomes]
+
+
+# -------------------------------------------------------------------
+# QUALIDADE DOS DADOS – RELATÓRIO FORA DO CAMINHO DO TRANSFORM
+# -------------------------------------------------------------------
+# Perfil de cada coluna do resultado (distribuição, nulos, estatísticas),
+# respostas fora do formulário e estatísticas das dimensões do IP, em JSON.
+# Desligado por padrão: ETL_QUALIDADE=1 ativa.
+QUALIDADE_ATIVA = os.environ.get("ETL_QUALIDADE", "0") == "1"
+DIRETORIO_QUALIDADE = os.environ.get("ETL_QUALIDADE_DIR", "qualidade")
+# Valores mais frequentes guardados por coluna
+LIMITE_DISTRIBUICAO = 50
+
+
+def _numero_json(valor) -> float | None:
+    return None if valor is None or np.isnan(valor) else round(float(valor), 4)
+
+
+def _contar_valores(serie: pd.Series) -> tuple[int, pd.Series]:
+    """
+    Nulos e contagem completa dos valores de uma coluna não numérica, em ordem
+    decrescente: categóricas contam os códigos (bincount), as demais usam um
+    value_counts.
+    """
+    if isinstance(serie.dtype, pd.CategoricalDtype):
+        contagem = np.bincount(serie.cat.codes.to_numpy().astype(np.int64) + 1,
+                               minlength=len(serie.cat.categories) + 1)
+        nulos = int(contagem[0])
+        distribuicao = pd.Series(contagem[1:], index=serie.cat.categories.astype(str))
+        distribuicao = distribuicao[distribuicao > 0]
+    else:
+        distribuicao = serie.value_counts(dropna=True)
+        nulos = len(serie) - int(distribuicao.sum())
+        distribuicao.index = distribuicao.index.astype(str)
+    return nulos, distribuicao.sort_values(ascending=False, kind='stable')
+
+
+def perfil_coluna(serie: pd.Series, contagem: tuple[int, pd.Series] | None = None) -> dict:
+    """
+    Perfil de uma coluna numa única passada: numéricas/booleanas tiram
+    min/média/max do array e as demais usam _contar_valores (ou a `contagem`
+    já calculada por ele), com a distribuição cortada em LIMITE_DISTRIBUICAO.
+    """
+    n = len(serie)
+    if pd.api.types.is_numeric_dtype(serie.dtype):
+        valores = serie.to_numpy(dtype=float, na_value=np.nan)
+        validos = valores[~np.isnan(valores)]
+        return {
+            'tipo': str(serie.dtype),
+            'nulos': n - len(validos),
+            'taxa_nulos': round((n - len(validos)) / n, 4) if n else 0.0,
+            'min': _numero_json(validos.min()) if len(validos) else None,
+            'media': _numero_json(validos.mean()) if len(validos) else None,
+            'max': _numero_json(validos.max()) if len(validos) else None,
+        }
+
+    nulos, distribuicao = contagem or _contar_valores(serie)
+    return {
+        'tipo': str(serie.dtype),
+        'nulos': nulos,
+        'taxa_nulos': round(nulos / n, 4) if n else 0.0,
+        'distintos': len(distribuicao),
+        'distribuicao': {valor: int(total) for valor, total in distribuicao.head(LIMITE_DISTRIBUICAO).items()},
+    }
+
+
+def respostas_tipadas(bruto: pd.DataFrame) -> pd.DataFrame:
+    """
+    Bruto renomeado e tipado (rename_columns + tipar_colunas), com as respostas
+    como vieram do formulário, antes de as etapas de codificação as trocarem
+    por NaN.
+    """
+    return aplicar_etapa(tipar_colunas, rename_columns(bruto))
+
+
+def respostas_nao_mapeadas(tipado: pd.DataFrame, dimensoes: dict | None = None) -> dict:
+    """
+    Respostas que o transform não reconhece, contadas no frame tipado
+    (respostas_tipadas), com {coluna: {valor: total}}. Uma resposta é não
+    mapeada se estiver fora das opções do formulário (perguntas RADIO), dos
+    níveis de ESCALAS_ORDINAIS ou do 'mapa' de um item do IP sem 'padrao';
+    nesses dois últimos casos ela vira NaN na saída. Vazio não conta (é
+    resposta em branco, já contada nos nulos do perfil).
+    """
+    dimensoes = dimensoes or carregar_dimensoes_ip()
+    plano = compilar_schema()['plano']
+
+    conhecidos = {coluna: set(spec['opcoes']) for coluna, spec in plano.items() if spec['tipo'] == 'radio'}
+    for escala in ESCALAS_ORDINAIS.values():
+        niveis = {nivel for nivel, _, _ in escala['niveis']}
+        for coluna in escala['colunas']:
+            conhecidos[coluna] = conhecidos.get(coluna, niveis) & niveis
+    for dimensao in dimensoes.values():
+        for item in dimensao['itens']:
+            if 'mapa' in item and item.get('padrao') is None:
+                coluna = item['coluna']
+                conhecidos[coluna] = conhecidos.get(coluna, set(item['mapa'])) & set(item['mapa'])
+
+    nao_mapeadas = {}
+    for coluna, validos in conhecidos.items():
+        if coluna not in tipado.columns or pd.api.types.is_numeric_dtype(tipado[coluna].dtype):
+            continue
+        _, distribuicao = _contar_valores(tipado[coluna])
+        fora = {valor: int(total) for valor, total in distribuicao.items()
+                if valor not in validos and valor != ''}
+        if fora:
+            nao_mapeadas[coluna] = fora
+    return nao_mapeadas
+
+
+def relatorio_qualidade(df: pd.DataFrame, dimensoes: dict | None = None,
+                        tipado: pd.DataFrame | None = None) -> dict:
+    """
+    Relatório de qualidade do DataFrame transformado. Cada coluna é lida uma
+    vez (perfil_coluna), com contagem completa nas perguntas RADIO, e as
+    estatísticas das dimensões do IP saem dos perfis, sem nova passada.
+
+    As respostas não mapeadas saem de `tipado` (respostas_tipadas do bruto):
+    no frame transformado as escalas ordinais e o IP já trocaram essas
+    respostas por NaN. Sem `tipado`, são contadas no próprio df e só as
+    perguntas que o transform não codifica aparecem.
+    """
+    dimensoes = dimensoes or carregar_dimensoes_ip()
+    plano = compilar_schema()['plano']
+    radios = {coluna for coluna, spec in plano.items() if spec['tipo'] == 'radio' and coluna in df.columns}
+    contagens = {coluna: _contar_valores(df[coluna]) for coluna in radios
+                 if not pd.api.types.is_numeric_dtype(df[coluna].dtype)}
+    colunas = {coluna: perfil_coluna(df[coluna], contagens.get(coluna)) for coluna in df.columns}
+
+    estatisticas_ip = {nome: colunas[nome] for nome in [*dimensoes, 'ip_sala_situacao'] if nome in colunas}
+    return {
+        'gerado_em': datetime.now().isoformat(timespec="seconds"),
+        'linhas': len(df),
+        'colunas': colunas,
+        'nao_mapeadas': respostas_nao_mapeadas(df if tipado is None else tipado, dimensoes),
+        'dimensoes_ip': estatisticas_ip,
+    }
+
+
+def salvar_relatorio_qualidade(df: pd.DataFrame, caminho: str | None = None,
+                               bruto: pd.DataFrame | None = None) -> str:
+    """
+    Grava o relatório de qualidade em JSON. `bruto` (o frame extraído, antes
+    do transform) permite contar as respostas não mapeadas antes da
+    codificação; sem ele elas são contadas no df transformado.
+    """
+    tipado = respostas_tipadas(bruto) if bruto is not None else None
+    relatorio = relatorio_qualidade(df, tipado=tipado)
+    caminho = caminho or os.path.join(DIRETORIO_QUALIDADE, f"qualidade_{_inicio_execucao}.json")
+    os.makedirs(os.path.dirname(caminho) or '.', exist_ok=True)
+    temporario = caminho + ".tmp"
+    with open(temporario, "w", encoding="utf-8") as f:
+        json.dump(relatorio, f, ensure_ascii=False, indent=2)
+    os.replace(temporario, caminho)
+
+    total_fora = sum(sum(valores.values()) for valores in relatorio['nao_mapeadas'].values())
+    logger.info(f"Relatório de qualidade salvo em {caminho} "
+                f"({len(relatorio['nao_mapeadas'])} colunas com {total_fora} respostas não mapeadas)")
+    return caminho
+
 
 # -------------------------------------------------------------------
 # # TRANSFORM – APLICA TRANSFORMAÇÕES NOS DADOS
 # -------------------------------------------------------------------
-def transform(df: pd.DataFrame) -> pd.DataFrame:
+# Contrato das etapas: recebem o df e não o alteram; devolvem um dict
+# {coluna: valores} só com as colunas novas ou substituídas (ou um DataFrame
+# novo, quando mudam a estrutura, como rename_columns). aplicar_etapa é o
+# único ponto que monta o frame seguinte, sem copiar as colunas intactas.
+def juntar_colunas(df: pd.DataFrame, resultado) -> pd.DataFrame:
+    """
+    Junta o resultado de uma etapa ao df: colunas substituídas mantêm a posição
+    e as novas entram no fim, na ordem do dict, num único concat.
+    """
+    if isinstance(resultado, pd.DataFrame):
+        return resultado
+
+    novas = {coluna: valores for coluna, valores in resultado.items() if coluna not in df.columns}
+    substituidas = {coluna: valores for coluna, valores in resultado.items() if coluna in df.columns}
+    if substituidas:
+        df = df.copy(deep=False)
+        for coluna, valores in substituidas.items():
+            df[coluna] = valores
+    if novas:
+        df = pd.concat([df, pd.DataFrame(novas, index=df.index)], axis=1)
+    return df
+
+
+def aplicar_etapa(etapa, df: pd.DataFrame) -> pd.DataFrame:
+    return juntar_colunas(df, etapa(df))
+
+
+# Ordem das etapas de transformação (nome, função)
+ETAPAS_TRANSFORM = [
+    ('rename_columns', rename_columns),
+    ('tipar_colunas', tipar_colunas),
+    ('normalizar_area_atuacao', normalizar_area_atuacao),
+    ('transformar_atuacao_info', transformar_atuacao_info),
+    ('transformar_ferramentas_analise', transformar_ferramentas_analise),
+    ('transformar_categoricos_grandes', transformar_categoricos_grandes),
+    ('transformar_categoricos_pequenos', transformar_categoricos_pequenos),
+    ('transformar_escalas_zero_dez', transformar_escalas_zero_dez),
+    ('transformar_escalas_zero_cinco', transformar_escalas_zero_cinco),
+    ('tratar_sistemas_e_qualidade', tratar_sistemas_e_qualidade),
+    ('adicionar_ip_sala_situacao', adicionar_ip_sala_situacao),
+]
+
+
+def selecionar_etapas(nomes: list[str]) -> list[tuple]:
+    """
+    Recorte de ETAPAS_TRANSFORM com as etapas escolhidas e as anteriores de
+    que elas dependem (alguma coluna lida é escrita por elas, ver
+    colunas_das_etapas), na ordem do pipeline. A lista do módulo não muda: o
+    recorte é passado aos transform_* e as chaves de cache incluem os nomes
+    das etapas, então ele nunca reaproveita estágios de outro.
+    """
+    desconhecidas = set(nomes) - {nome for nome, _ in ETAPAS_TRANSFORM}
+    if desconhecidas:
+        raise ValueError(f"Etapas desconhecidas: {', '.join(sorted(desconhecidas))}")
+
+    declaradas = colunas_das_etapas()
+    escolhidas = set(nomes)
+    # De trás para frente, para as dependências das dependências entrarem também
+    for i in range(len(ETAPAS_TRANSFORM) - 1, -1, -1):
+        nome = ETAPAS_TRANSFORM[i][0]
+        if nome not in escolhidas:
+            continue
+        le = declaradas.get(nome, (None, None))[0]
+        for anterior, _ in ETAPAS_TRANSFORM[:i]:
+            escreve = declaradas.get(anterior, (None, None))[1]
+            if le is None or escreve is None or le & escreve:
+                escolhidas.add(anterior)
+
+    adicionadas = [nome for nome, _ in ETAPAS_TRANSFORM if nome in escolhidas - set(nomes)]
+    if adicionadas:
+        logger.info(f"Etapas incluídas por dependência: {', '.join(adicionadas)}")
+    return [(nome, etapa) for nome, etapa in ETAPAS_TRANSFORM if nome in escolhidas]
+
+
+# -------------------------------------------------------------------
+# AGENDAMENTO DAS ETAPAS – ONDAS INDEPENDENTES EM PARALELO
+# -------------------------------------------------------------------
+# ETL_PARALELO: 'sequencial' (padrão), 'threads' ou 'processos'; ETL_WORKERS
+# limita o pool. Etapas da mesma onda não tocam colunas umas das outras,
+# recebem o mesmo df e têm os resultados juntados na ordem de
+# ETAPAS_TRANSFORM, então a saída é idêntica à da execução sequencial.
+MODOS_PARALELO = ('sequencial', 'threads', 'processos')
+MODO_PARALELO = os.environ.get("ETL_PARALELO", "sequencial")
+WORKERS_PARALELO = int(os.environ.get("ETL_WORKERS", "0")) or None
+
+
+def _com_derivadas(colunas: list[str]) -> set[str]:
+    return {c for coluna in colunas for c in (coluna, f'{coluna}_num', f'{coluna}_cat_simples')}
+
+
+def colunas_das_etapas() -> dict:
+    """
+    Colunas lidas e escritas por cada etapa: {nome: (le, escreve)}. None quer
+    dizer "todas" (a etapa roda sozinha, como barreira); etapas sem declaração
+    também são tratadas assim.
+    """
+    plano = compilar_schema()['plano']
+    tipadas = {coluna for coluna, spec in plano.items() if spec['tipo'] != 'texto'}
+    colunas_uso = [col_uso for col_uso, _ in COLUNAS_SISTEMAS.values()]
+    dimensoes = carregar_dimensoes_ip()
+    return {
+        'rename_columns': (None, None),
+        'tipar_colunas': (tipadas, tipadas),
+        'normalizar_area_atuacao': ({'area_atuacao'}, {'area_atuacao'}),
+        'transformar_atuacao_info': (
+            {'atuacao_info'},
+            {'atuacao_coleta', 'atuacao_analise', 'atuacao_gestao', 'atuacao_nao',
+             'atuacao_multipla', 'atuacao_apenas_uma', 'atuacao_categoria'},
+        ),
+        'transformar_ferramentas_analise': (
+            {'ferramentas_analise'},
+            {_nome_coluna_ferramenta(c) for c in CATEGORIAS_FERRAMENTAS} | {'qtd_ferramentas', 'categoria_ferramentas'},
+        ),
+        'transformar_categoricos_grandes': (set(COLUNAS_CATEGORICOS_GRANDES), _com_derivadas(COLUNAS_CATEGORICOS_GRANDES)),
+        'transformar_categoricos_pequenos': (set(COLUNAS_CATEGORICOS_PEQUENOS), _com_derivadas(COLUNAS_CATEGORICOS_PEQUENOS)),
+        'transformar_escalas_zero_dez': (set(COLUNAS_ESCALA_ZERO_DEZ), _com_derivadas(COLUNAS_ESCALA_ZERO_DEZ)),
+        'transformar_escalas_zero_cinco': (set(COLUNAS_ESCALA_ZERO_CINCO), _com_derivadas(COLUNAS_ESCALA_ZERO_CINCO)),
+        'tratar_sistemas_e_qualidade': (
+            {'sistemas_informacao_utilizados'} | {col_qualidade for _, col_qualidade in COLUNAS_SISTEMAS.values()},
+            {'sistemas_informacao_utilizados', 'sistemas_inconsistentes', 'total_sistemas_usados',
+             'total_sistemas_avaliados'} | set(colunas_uso) | {c.replace('usou_', 'avaliou_', 1) for c in colunas_uso},
+        ),
+        'adicionar_ip_sala_situacao': (
+            {item['coluna'] for dimensao in dimensoes.values() for item in dimensao['itens']},
+            set(dimensoes) | {'ip_sala_situacao'},
+        ),
+    }
+
+
+def _conflitam(a: tuple, b: tuple) -> bool:
+    (le_a, escreve_a), (le_b, escreve_b) = a, b
+    if None in (le_a, escreve_a, le_b, escreve_b):
+        return True
+    return bool(le_a & escreve_b or escreve_a & le_b or escreve_a & escreve_b)
+
+
+def ondas_de_execucao(etapas: list | None = None) -> list[list[tuple]]:
+    """
+    Agrupa as etapas em ondas: cada etapa vai para a primeira onda depois de
+    todas as etapas anteriores com que conflita. Dentro da onda a ordem de
+    ETAPAS_TRANSFORM é mantida.
+    """
+    etapas = etapas or ETAPAS_TRANSFORM
+    declaradas = colunas_das_etapas()
+    colunas = [declaradas.get(nome, (None, None)) for nome, _ in etapas]
+
+    niveis = []
+    for i in range(len(etapas)):
+        anteriores = [niveis[j] + 1 for j in range(i) if _conflitam(colunas[i], colunas[j])]
+        niveis.append(max(anteriores, default=0))
+
+    ondas = [[] for _ in range(max(niveis, default=-1) + 1)]
+    for etapa, nivel in zip(etapas, niveis):
+        ondas[nivel].append(etapa)
+    return ondas
+
+
+def _juntar_onda(df: pd.DataFrame, futuros: list) -> pd.DataFrame:
+    for futuro in futuros:
+        df = juntar_colunas(df, futuro.result())
+    return df
+
+
+def _transform_paralelo(df: pd.DataFrame, modo: str, workers: int | None, etapas: list) -> pd.DataFrame:
+    from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+    declaradas = colunas_das_etapas()
+    executor = ThreadPoolExecutor if modo == 'threads' else ProcessPoolExecutor
+    with executor(max_workers=workers) as pool:
+        for onda in ondas_de_execucao(etapas):
+            if len(onda) == 1:
+                nome, etapa = onda[0]
+                df = medir(nome, aplicar_etapa, etapa, df)
+                continue
+
+            futuros = []
+            for nome, etapa in onda:
+                entrada = df
+                if modo == 'processos':
+                    # Só as colunas lidas pela etapa são enviadas ao processo
+                    le = declaradas[nome][0]
+                    entrada = df[[coluna for coluna in df.columns if coluna in le]]
+                futuros.append(pool.submit(etapa, entrada))
+            df = medir('+'.join(nome for nome, _ in onda), _juntar_onda, df, futuros)
+    return df
+
+
+def transform(df: pd.DataFrame, modo: str | None = None, workers: int | None = None,
+              etapas: list | None = None) -> pd.DataFrame:
+    """
+    Aplica `etapas` (padrão: ETAPAS_TRANSFORM). Com modo 'threads' ou
+    'processos' as etapas independentes rodam em paralelo (ver
+    ondas_de_execucao); se o pool não puder ser usado, cai na execução
+    sequencial.
+    """
+    from concurrent.futures import BrokenExecutor
+
+    modo = modo or MODO_PARALELO
+    etapas = etapas or ETAPAS_TRANSFORM
+    if modo not in MODOS_PARALELO:
+        raise ValueError(f"Modo de execução desconhecido: {modo}. Opções: {', '.join(MODOS_PARALELO)}")
     logger.info("Iniciando transformações...")
-    
-    df = rename_columns(df)
-    df = normalizar_area_atuacao(df)
-    df = transformar_atuacao_info(df)
-    df = transformar_ferramentas_analise(df)
-    df = transformar_categoricos_grandes(df)
-    df = transformar_categoricos_pequenos(df)
-    df = transformar_escalas_zero_dez(df)
-    df = transformar_escalas_zero_cinco(df)
-    df = tratar_sistemas_e_qualidade(df)
-    df = adicionar_ip_sala_situacao(df)
+
+    if modo != 'sequencial':
+        try:
+            df_transformado = _transform_paralelo(df, modo, workers or WORKERS_PARALELO, etapas)
+            logger.info("Transformação concluída.")
+            return df_transformado
+        except (OSError, NotImplementedError, BrokenExecutor) as e:
+            # As etapas não alteram o df de entrada, então dá para recomeçar do zero
+            logger.warning(f"Execução em {modo} indisponível ({e}) – seguindo em modo sequencial.")
+
+    for nome, etapa in etapas:
+        df = medir(nome, aplicar_etapa, etapa, df)
 
     logger.info("Transformação concluída.")
     return df
 
+
+# -------------------------------------------------------------------
+# TRANSFORM EM BLOCOS – MEMÓRIA LIMITADA AO TAMANHO DO BLOCO
+# -------------------------------------------------------------------
+# Só tipar_colunas (categorias observadas) e normalizar_area_atuacao (ajuste
+# do agrupamento) dependem do conjunto inteiro: uma primeira passada junta o
+# que elas precisam e a segunda aplica todas as etapas bloco a bloco.
+def estatisticas_globais(blocos) -> dict:
+    """
+    Primeira passada: valores observados em cada coluna categórica e contagem
+    de cada texto de área de atuação.
+    """
+    plano = compilar_schema()['plano']
+    observados: dict[str, set] = {}
+    areas: Counter = Counter()
+    linhas = 0
+
+    for bloco in blocos:
+        bloco = rename_columns(bloco)
+        linhas += len(bloco)
+        for coluna, spec in plano.items():
+            if spec['tipo'] != 'texto' and coluna in bloco.columns:
+                observados.setdefault(coluna, set()).update(pd.unique(bloco[coluna].dropna()))
+        if 'area_atuacao' in bloco.columns:
+            areas.update(bloco['area_atuacao'].fillna('').value_counts().to_dict())
+
+    categorias = {coluna: _categorias_coluna(plano[coluna], valores) for coluna, valores in observados.items()}
+    return {'linhas': linhas, 'categorias': categorias, 'areas': areas}
+
+
+def etapas_com_estatisticas(estatisticas: dict, n_clusters: int = 15,
+                            etapas: list | None = None) -> tuple[list, dict]:
+    """
+    `etapas` (padrão: ETAPAS_TRANSFORM) com as etapas globais trocadas por
+    versões que usam o que foi calculado em estatisticas_globais. Devolve
+    (etapas, {texto: grupo da área}).
+    """
+    etapas = etapas or ETAPAS_TRANSFORM
+    grupos_area = {}
+    if estatisticas['areas'] and any(nome == 'normalizar_area_atuacao' for nome, _ in etapas):
+        originais = np.array(list(estatisticas['areas']), dtype=object)
+        contagens = np.array(list(estatisticas['areas'].values()), dtype=np.int64)
+        grupos_area = dict(zip(originais, agrupar_areas(originais, contagens, n_clusters)))
+
+    substitutas = {
+        'tipar_colunas': partial(tipar_colunas, categorias=estatisticas['categorias']),
+        'normalizar_area_atuacao': partial(aplicar_grupos_area, grupos=grupos_area),
+    }
+    return [(nome, substitutas.get(nome, etapa)) for nome, etapa in etapas], grupos_area
+
+
+def transform_em_blocos(abrir_blocos, n_clusters: int = 15, etapas: list | None = None):
+    """
+    Gera o resultado do transform() em blocos. `abrir_blocos` é chamada duas
+    vezes e deve devolver um iterável novo de DataFrames brutos a cada chamada
+    (ex.: lambda: iterar_fonte('csv', caminho)).
+    """
+    logger.info("Transformação em blocos: primeira passada (estatísticas globais)...")
+    estatisticas = estatisticas_globais(abrir_blocos())
+    logger.info(f"Linhas na fonte: {estatisticas['linhas']}")
+    etapas, _ = etapas_com_estatisticas(estatisticas, n_clusters, etapas)
+
+    for numero, bloco in enumerate(abrir_blocos(), start=1):
+        for _, etapa in etapas:
+            bloco = aplicar_etapa(etapa, bloco)
+        logger.info(f"Bloco {numero} transformado ({len(bloco)} linhas).")
+        yield bloco
+
+
+# -------------------------------------------------------------------
+# CACHE COLUNAR DE ESTÁGIOS (ARROW IPC)
+# -------------------------------------------------------------------
+# Cada estágio é salvo como arquivo Arrow sem compressão (lido via memory-map).
+# A chave do bruto é o hash do conteúdo; a chave de cada etapa encadeia a chave
+# anterior + nome da etapa + assinatura do código, então qualquer edição no
+# etl.py invalida os estágios transformados. Como chaves antigas nunca mais
+# são lidas, o diretório é podado por LRU (data de modificação, renovada a
+# cada leitura) até LIMITE_CACHE_ESTAGIOS_MB ao fim de cada execução.
+LIMITE_CACHE_ESTAGIOS_MB = float(os.environ.get("ETL_CACHE_LIMITE_MB", "2048"))
+
+with open(__file__, 'rb') as _f:
+    _ASSINATURA_CODIGO = hashlib.sha256(_f.read()).hexdigest()[:16]
+
+
+def hash_dataframe(df: pd.DataFrame) -> str:
+    """
+    Hash de conteúdo do DataFrame (colunas + valores, sem o índice).
+    """
+    h = hashlib.sha256()
+    h.update(json.dumps(df.columns.tolist(), ensure_ascii=False).encode('utf-8'))
+    h.update(pd.util.hash_pandas_object(df, index=False).values.tobytes())
+    return h.hexdigest()[:32]
+
+
+def _chave_etapa(chave_anterior: str, nome_etapa: str) -> str:
+    return hashlib.sha256(f"{chave_anterior}:{nome_etapa}:{_ASSINATURA_CODIGO}".encode('utf-8')).hexdigest()[:32]
+
+
+def _assinatura_pesos() -> str:
+    # Pesos vindos de ETL_PESOS_IP mudam o resultado sem mudar o código
+    return json.dumps(carregar_dimensoes_ip(), ensure_ascii=False, sort_keys=True, default=str)
+
+
+def _caminho_estagio(chave: str, diretorio: str = DIRETORIO_CACHE) -> str:
+    return os.path.join(diretorio, "estagios", f"{chave}.arrow")
+
+
+def salvar_estagio(df: pd.DataFrame, chave: str, diretorio: str = DIRETORIO_CACHE) -> bool:
+    """
+    Salva o DataFrame como Arrow IPC. O cache é best-effort: se o frame não
+    puder ser convertido (ex.: coluna object com tipos mistos) só registra aviso.
+    """
+    import pyarrow as pa
+    from pyarrow import feather
+
+    caminho = _caminho_estagio(chave, diretorio)
+    if os.path.exists(caminho):
+        os.utime(caminho)
+        return True
+    os.makedirs(os.path.dirname(caminho), exist_ok=True)
+    try:
+        tabela = pa.Table.from_pandas(df, preserve_index=False)
+    except (pa.ArrowException, ValueError, TypeError) as e:
+        logger.warning(f"Estágio {chave} não salvo no cache: {e}")
+        return False
+
+    temporario = caminho + ".tmp"
+    feather.write_feather(tabela, temporario, compression='uncompressed')
+    os.replace(temporario, caminho)
+    return True
+
+
+def ler_estagio(chave: str, diretorio: str = DIRETORIO_CACHE, colunas: list[str] | None = None) -> pd.DataFrame | None:
+    """
+    Lê um estágio do cache via memory-map, opcionalmente só as colunas pedidas.
+    """
+    from pyarrow import feather
+
+    caminho = _caminho_estagio(chave, diretorio)
+    if not os.path.exists(caminho):
+        return None
+    os.utime(caminho)
+    tabela = feather.read_table(caminho, columns=colunas, memory_map=True)
+    return tabela.to_pandas()
+
+
+def podar_estagios(manter=(), diretorio: str = DIRETORIO_CACHE,
+                   limite_mb: float | None = None) -> list[str]:
+    """
+    Apaga os estágios usados há mais tempo até o diretório caber em
+    `limite_mb` (padrão LIMITE_CACHE_ESTAGIOS_MB). As chaves em `manter` (as
+    da execução atual) nunca são apagadas. Devolve as chaves removidas.
+    """
+    limite = (LIMITE_CACHE_ESTAGIOS_MB if limite_mb is None else limite_mb) * 1024 * 1024
+    pasta = os.path.join(diretorio, "estagios")
+    if not os.path.isdir(pasta):
+        return []
+
+    arquivos = []
+    for entrada in os.scandir(pasta):
+        if entrada.name.endswith(".arrow"):
+            info = entrada.stat()
+            arquivos.append((info.st_mtime, info.st_size, entrada.name[:-len(".arrow")], entrada.path))
+    total = sum(tamanho for _, tamanho, _, _ in arquivos)
+
+    removidas, manter = [], set(manter)
+    for _, tamanho, chave, caminho in sorted(arquivos):
+        if total <= limite:
+            break
+        if chave in manter:
+            continue
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(caminho)
+        total -= tamanho
+        removidas.append(chave)
+    if removidas:
+        logger.info(f"Cache de estágios: {len(removidas)} estágios antigos removidos "
+                    f"({total / 1024 / 1024:.0f} MB em uso)")
+    return removidas
+
+
+def _salvar_ponteiro(sheet_id: str, tab_name: str, chave_bruta: str, diretorio: str = DIRETORIO_CACHE):
+    os.makedirs(diretorio, exist_ok=True)
+    with open(_caminho_cache(sheet_id, tab_name, "ultimo.json", diretorio), "w", encoding="utf-8") as f:
+        json.dump({"chave_bruta": chave_bruta, "salvo_em": datetime.now().isoformat(timespec="seconds")}, f)
+
+
+def _executar_etapas_com_cache(chave_bruta: str, df_bruto: pd.DataFrame | None,
+                               diretorio: str = DIRETORIO_CACHE, etapas: list | None = None) -> pd.DataFrame:
+    etapas = etapas or ETAPAS_TRANSFORM
+    chaves = []
+    chave = f"{chave_bruta}:{_assinatura_pesos()}"
+    for nome, _ in etapas:
+        chave = _chave_etapa(chave, nome)
+        chaves.append(chave)
+
+    # Retoma a partir do último estágio válido
+    inicio, df = 0, None
+    for i in range(len(chaves) - 1, -1, -1):
+        df = ler_estagio(chaves[i], diretorio)
+        if df is not None:
+            inicio = i + 1
+            logger.info(f"Retomando após a etapa '{etapas[i][0]}' (cache {chaves[i]})")
+            break
+
+    if df is None:
+        df = df_bruto if df_bruto is not None else ler_estagio(chave_bruta, diretorio)
+    if df is None:
+        raise FileNotFoundError(f"Estágio bruto {chave_bruta} não encontrado no cache.")
+
+    for (nome, etapa), chave in zip(etapas[inicio:], chaves[inicio:]):
+        df = medir(nome, aplicar_etapa, etapa, df)
+        salvar_estagio(df, chave, diretorio)
+
+    podar_estagios([chave_bruta, *chaves], diretorio)
+    return df
+
+
+def transform_com_cache(df_bruto: pd.DataFrame, sheet_id: str, tab_name: str,
+                        diretorio: str = DIRETORIO_CACHE, etapas: list | None = None) -> pd.DataFrame:
+    """
+    Igual a transform(), mas salva o bruto e a saída de cada etapa no cache
+    colunar e reaproveita os estágios já calculados para o mesmo conteúdo.
+    """
+    logger.info("Iniciando transformações (com cache de estágios)...")
+
+    chave_bruta = hash_dataframe(df_bruto)
+    salvar_estagio(df_bruto, chave_bruta, diretorio)
+    _salvar_ponteiro(sheet_id, tab_name, chave_bruta, diretorio)
+    df = _executar_etapas_com_cache(chave_bruta, df_bruto, diretorio, etapas)
+
+    logger.info("Transformação concluída.")
+    return df
+
+
+def _ler_ponteiro(sheet_id: str, tab_name: str, diretorio: str = DIRETORIO_CACHE) -> str:
+    caminho = _caminho_cache(sheet_id, tab_name, "ultimo.json", diretorio)
+    if not os.path.exists(caminho):
+        raise FileNotFoundError(f"Nenhuma execução anterior em cache para {sheet_id} | {tab_name}.")
+    with open(caminho, encoding="utf-8") as f:
+        return json.load(f)["chave_bruta"]
+
+
+def retomar_transform(sheet_id: str, tab_name: str, diretorio: str = DIRETORIO_CACHE,
+                      etapas: list | None = None) -> pd.DataFrame:
+    """
+    Retoma a última execução desta planilha/aba sem baixar os dados de novo.
+    """
+    chave_bruta = _ler_ponteiro(sheet_id, tab_name, diretorio)
+    logger.info(f"Retomando execução em cache: {sheet_id} | Aba: {tab_name}")
+    return _executar_etapas_com_cache(chave_bruta, None, diretorio, etapas)
+
+
+def _unir_categorias(df: pd.DataFrame, outro: pd.DataFrame) -> dict:
+    """
+    {coluna: categorias} das colunas categóricas não ordenadas com categorias
+    diferentes nos dois frames: as de `df` seguidas das que só `outro` tem.
+    """
+    categorias = {}
+    for coluna in df.columns.intersection(outro.columns):
+        a, b = df[coluna].dtype, outro[coluna].dtype
+        if not (isinstance(a, pd.CategoricalDtype) and isinstance(b, pd.CategoricalDtype)):
+            continue
+        if a.ordered or b.ordered or a.categories.equals(b.categories):
+            continue
+        conhecidas = set(a.categories)
+        categorias[coluna] = a.categories.tolist() + [c for c in b.categories if c not in conhecidas]
+    return categorias
+
+
+def transform_incremental(df_novos: pd.DataFrame, sheet_id: str, tab_name: str,
+                          completo: bool, diretorio: str = DIRETORIO_CACHE,
+                          etapas: list | None = None) -> pd.DataFrame:
+    """
+    Transforma apenas as linhas novas e junta com o snapshot transformado salvo
+    na execução anterior. Em leitura completa o snapshot é descartado.
+    """
+    caminho_snapshot = _caminho_cache(sheet_id, tab_name, "snapshot.pkl", diretorio)
+    snapshot = None
+    if not completo and os.path.exists(caminho_snapshot):
+        snapshot = pd.read_pickle(caminho_snapshot)
+    elif not completo:
+        logger.warning("Snapshot transformado não encontrado – o resultado conterá apenas as linhas novas.")
+
+    if len(df_novos) > 0:
+        df_novos = transform(df_novos, etapas=etapas)
+    elif snapshot is not None:
+        logger.info("Nenhuma linha nova – reutilizando snapshot.")
+        return snapshot
+
+    if snapshot is None:
+        df = df_novos
+    else:
+        # As linhas novas foram tipadas só com as próprias respostas; sem as
+        # mesmas categorias dos dois lados o concat viraria object
+        categorias = _unir_categorias(snapshot, df_novos)
+        df = pd.concat([_alinhar_categorias(snapshot, categorias), _alinhar_categorias(df_novos, categorias)],
+                       ignore_index=True)
+
+    os.makedirs(diretorio, exist_ok=True)
+    df.to_pickle(caminho_snapshot)
+    return df
+
+# -------------------------------------------------------------------
+# TRANSFORM PARTICIONADO POR DISTRITO SANITÁRIO
+# -------------------------------------------------------------------
+# Cada distrito (ds_vinculado) é transformado à parte, com as etapas globais
+# calculadas uma vez sobre todas as respostas. A saída de cada partição fica
+# no cache colunar com chave = conteúdo bruto da partição + grupos de área
+# que ela usa + pesos do IP + código, então só os distritos que mudaram são
+# recalculados.
+COLUNA_PARTICAO = 'ds_vinculado'
+SEM_DISTRITO = 'Sem distrito'
+
+
+def executar_em_pool(funcao, argumentos: list[tuple], modo: str | None = None,
+                     workers: int | None = None) -> list:
+    """
+    [funcao(*args) for args in argumentos] num pool de threads/processos
+    (ver ETL_PARALELO), na ordem dos argumentos. Sem pool disponível, roda em
+    sequência.
+    """
+    from concurrent.futures import BrokenExecutor, ProcessPoolExecutor, ThreadPoolExecutor
+
+    modo = modo or MODO_PARALELO
+    if modo not in MODOS_PARALELO:
+        raise ValueError(f"Modo de execução desconhecido: {modo}. Opções: {', '.join(MODOS_PARALELO)}")
+    if modo != 'sequencial' and len(argumentos) > 1:
+        executor = ThreadPoolExecutor if modo == 'threads' else ProcessPoolExecutor
+        try:
+            with executor(max_workers=workers or WORKERS_PARALELO) as pool:
+                futuros = [pool.submit(funcao, *args) for args in argumentos]
+                return [futuro.result() for futuro in futuros]
+        except (OSError, NotImplementedError, BrokenExecutor) as e:
+            logger.warning(f"Execução em {modo} indisponível ({e}) – seguindo em modo sequencial.")
+    return [funcao(*args) for args in argumentos]
+
+
+def _transformar_particao(bruto: pd.DataFrame, etapas: list) -> pd.DataFrame:
+    df = bruto
+    for _, etapa in etapas:
+        df = aplicar_etapa(etapa, df)
+    return df
+
+
+def _chave_particao(bruto: pd.DataFrame, grupos_area: dict, etapas: list) -> str:
+    textos = sorted(set(bruto['area_atuacao'].fillna(''))) if 'area_atuacao' in bruto.columns else []
+    grupos = json.dumps([(texto, grupos_area.get(texto)) for texto in textos], ensure_ascii=False)
+    pesos = _assinatura_pesos()
+    nomes = ','.join(nome for nome, _ in etapas)
+    return _chave_etapa(f"{hash_dataframe(bruto)}:{grupos}:{pesos}:{nomes}", 'particao')
+
+
+def _alinhar_categorias(df: pd.DataFrame, categorias: dict) -> pd.DataFrame:
+    """
+    Partições vindas do cache (ou o snapshot do incremental) podem ter sido
+    tipadas com menos categorias extras; iguala às atuais para todas
+    concatenarem com o mesmo dtype.
+    """
+    ajustes = {}
+    for coluna, lista in categorias.items():
+        if coluna not in df.columns or not isinstance(df[coluna].dtype, pd.CategoricalDtype):
+            continue
+        serie = df[coluna]
+        if not serie.cat.ordered and serie.cat.categories.tolist() != lista:
+            ajustes[coluna] = serie.cat.set_categories(lista)
+    return juntar_colunas(df, ajustes) if ajustes else df
+
+
+def particionar(df: pd.DataFrame) -> dict[str, pd.DataFrame]:
+    """
+    Separa o df (já renomeado) por distrito, na ordem das opções do formulário;
+    respostas sem distrito ficam em SEM_DISTRITO.
+    """
+    distritos = df[COLUNA_PARTICAO].astype(object).fillna('').replace('', SEM_DISTRITO)
+    opcoes = compilar_schema()['plano'].get(COLUNA_PARTICAO, {}).get('opcoes', [])
+    ordem = {distrito: i for i, distrito in enumerate(opcoes)}
+    grupos = dict(iter(df.groupby(distritos, sort=False)))
+    return {distrito: grupos[distrito]
+            for distrito in sorted(grupos, key=lambda d: (ordem.get(d, len(ordem)), d))}
+
+
+def transform_particionado(df_bruto: pd.DataFrame, n_clusters: int = 15, modo: str | None = None,
+                           workers: int | None = None, diretorio: str = DIRETORIO_CACHE,
+                           etapas: list | None = None) -> dict[str, pd.DataFrame]:
+    """
+    Transforma cada distrito separadamente (em paralelo conforme `modo`) e
+    devolve {distrito: df transformado}. As partições mantêm o índice das
+    linhas no bruto (ver consolidar_particoes).
+    """
+    logger.info("Iniciando transformação particionada por distrito...")
+    df_bruto = rename_columns(df_bruto)
+    estatisticas = estatisticas_globais([df_bruto])
+    etapas, grupos_area = etapas_com_estatisticas(estatisticas, n_clusters, etapas)
+
+    particoes = particionar(df_bruto)
+    resultado, pendentes, chaves = {}, [], {}
+    for distrito, bruto in particoes.items():
+        chave = chaves[distrito] = _chave_particao(bruto, grupos_area, etapas)
+        df = ler_estagio(chave, diretorio)
+        if df is not None and len(df) == len(bruto):
+            df.index = bruto.index
+            resultado[distrito] = df
+        else:
+            pendentes.append((distrito, chave))
+    logger.info(f"Partições: {len(particoes)} | do cache: {len(resultado)} | a transformar: {len(pendentes)}")
+
+    transformadas = executar_em_pool(_transformar_particao,
+                                     [(particoes[distrito], etapas) for distrito, _ in pendentes], modo, workers)
+    for (distrito, chave), df in zip(pendentes, transformadas):
+        salvar_estagio(df, chave, diretorio)
+        resultado[distrito] = df
+    podar_estagios(chaves.values(), diretorio)
+
+    logger.info("Transformação particionada concluída.")
+    return {distrito: _alinhar_categorias(resultado[distrito], estatisticas['categorias']) for distrito in particoes}
+
+
+def consolidar_particoes(particoes: dict[str, pd.DataFrame]) -> pd.DataFrame:
+    """
+    Junta as partições de volta na ordem original das respostas.
+    """
+    if not particoes:
+        return pd.DataFrame()
+    return pd.concat(particoes.values()).sort_index()
+
+
 # -------------------------------------------------------------------
 # LOAD – CRIA ABA E ESCREVE DADOS NA MESMA PLANILHA
 # -------------------------------------------------------------------
-def load_to_sheet(client, sheet_id: str, df: pd.DataFrame, new_tab: str = "DadosEtl"):
-    logger.info(f"Atualizando aba '{new_tab}' sem excluir...")
+# Limite de células por chamada batch_update (mantém o payload abaixo do limite da API)
+MAX_CELULAS_POR_LOTE = 40_000
+
+
+def preparar_valores(df: pd.DataFrame) -> list[list]:
+    """
+    Converte o DataFrame na matriz de valores enviada ao Sheets (com cabeçalho).
+    Monta as linhas coluna a coluna, sem copiar o DataFrame.
+    """
+    colunas = []
+    for col in df.columns:
+        serie = df[col]
+        if serie.dtype.name == 'category':
+            serie = serie.astype(str)
+        colunas.append(serie.astype(object).where(serie.notna(), '').tolist())
+
+    return [df.columns.tolist()] + [list(linha) for linha in zip(*colunas)]
+
+
+# Cota de escrita da Sheets API: 60 requisições por minuto por usuário
+REQUISICOES_POR_MINUTO = int(os.environ.get("ETL_SHEETS_REQ_MINUTO", "60"))
+# Chamadas de escrita em andamento ao mesmo tempo (o limitador continua valendo)
+CONEXOES_SHEETS = int(os.environ.get("ETL_SHEETS_CONEXOES", "2"))
+MAX_TENTATIVAS_SHEETS = 6
+ESPERA_MAXIMA_SHEETS = 64
+CODIGOS_RETENTAVEIS = {408, 429, 500, 502, 503, 504}
+SUFIXO_STAGING = "__staging"
+
+
+class LimitadorTaxa:
+    """
+    Token bucket compartilhado entre threads: permite rajadas de até
+    `capacidade` chamadas e repõe uma ficha a cada 60/por_minuto segundos.
+    """
+
+    def __init__(self, por_minuto: int, capacidade: int | None = None):
+        self.intervalo = 60.0 / por_minuto
+        self.capacidade = capacidade or max(1, por_minuto // 6)
+        self.fichas = float(self.capacidade)
+        self.ultima_reposicao = time.monotonic()
+        self._trava = threading.Lock()
+
+    def aguardar(self):
+        while True:
+            with self._trava:
+                agora = time.monotonic()
+                self.fichas = min(self.capacidade, self.fichas + (agora - self.ultima_reposicao) / self.intervalo)
+                self.ultima_reposicao = agora
+                if self.fichas >= 1:
+                    self.fichas -= 1
+                    return
+                espera = (1 - self.fichas) * self.intervalo
+            time.sleep(espera)
+
+
+LIMITADOR_SHEETS = LimitadorTaxa(REQUISICOES_POR_MINUTO)
+
+
+def _retentavel(erro: Exception) -> bool:
+    import gspread
 
-    sh = client.open_by_key(sheet_id)
+    if isinstance(erro, gspread.exceptions.APIError):
+        return erro.code in CODIGOS_RETENTAVEIS
+    # Falhas de rede (requests.ConnectionError, timeouts) são OSError
+    return isinstance(erro, OSError)
+
+
+def chamar_sheets(funcao, *args, limitador: LimitadorTaxa | None = None,
+                  tentativas: int = MAX_TENTATIVAS_SHEETS, confirmar=None, **kwargs):
+    """
+    Chama a API do Sheets passando pelo limitador de taxa. Erros de cota (429),
+    5xx e falhas de rede são repetidos com backoff exponencial e jitter
+    (1s, 2s, 4s... até ESPERA_MAXIMA_SHEETS); os demais sobem direto.
+
+    Chamadas não idempotentes (criar ou apagar aba, publicar o staging) passam
+    `confirmar`: depois de um 5xx ou falha de rede o pedido pode ter sido
+    aplicado, então antes de repetir confirmar() lê o estado da planilha; se
+    devolver algo diferente de None o pedido já valeu e isso é o resultado.
+    Um 429 é repetido direto (a API rejeita sem aplicar).
+    """
+    import gspread
+
+    limitador = limitador or LIMITADOR_SHEETS
+    for tentativa in range(tentativas):
+        limitador.aguardar()
+        try:
+            return funcao(*args, **kwargs)
+        except (gspread.exceptions.APIError, OSError) as e:
+            if not _retentavel(e) or tentativa == tentativas - 1:
+                raise
+            if confirmar is not None and getattr(e, 'code', None) != 429:
+                aplicado = chamar_sheets(confirmar, limitador=limitador, tentativas=tentativas)
+                if aplicado is not None:
+                    logger.warning(f"Sheets falhou ({e}), mas o pedido foi aplicado – não será repetido.")
+                    return aplicado
+            espera = min(ESPERA_MAXIMA_SHEETS, 2 ** tentativa) + random.random()
+            logger.warning(f"Sheets falhou ({e}) – tentativa {tentativa + 1}/{tentativas}, "
+                           f"aguardando {espera:.1f}s.")
+            time.sleep(espera)
+
+
+def enviar_lotes(ws, lotes, conexoes: int = CONEXOES_SHEETS) -> int:
+    """
+    Envia os lotes de batch_update (ver _lotes_de_atualizacao) com até
+    `conexoes` chamadas em andamento. Devolve o número de chamadas.
+    """
+    lotes = list(lotes)
+    if conexoes <= 1 or len(lotes) <= 1:
+        for lote in lotes:
+            chamar_sheets(ws.batch_update, lote)
+    else:
+        from concurrent.futures import ThreadPoolExecutor
+        with ThreadPoolExecutor(max_workers=conexoes) as pool:
+            list(pool.map(lambda lote: chamar_sheets(ws.batch_update, lote), lotes))
+    return len(lotes)
+
+
+def _abrir_ou_criar_aba(client: SessaoSheets, sheet_id: str, new_tab: str, linhas: int, colunas: int):
+    import gspread
 
     try:
-        ws = sh.worksheet(new_tab)
-        logger.info(f"Aba '{new_tab}' encontrada. Limpando e sobrescrevendo...")
+        ws = chamar_sheets(client.aba, sheet_id, new_tab)
+        logger.info(f"Aba '{new_tab}' encontrada.")
+        return ws, False
     except gspread.exceptions.WorksheetNotFound:
         logger.info(f"Aba '{new_tab}' não existe. Criando...")
-        ws = sh.add_worksheet(title=new_tab, rows=str(len(df) + 5), cols=str(len(df.columns) + 5))
+        ws = chamar_sheets(client.planilha(sheet_id).add_worksheet, title=new_tab,
+                           rows=str(linhas + 5), cols=str(colunas + 5),
+                           confirmar=lambda: client.abas(sheet_id).get(new_tab))
+        client.guardar_aba(sheet_id, ws)
+        return ws, True
+
 
-    ws.clear()
+def _publicar_staging(sh, staging, destino, new_tab: str, n_linhas: int, n_colunas: int):
+    """
+    Troca o conteúdo da aba pelo do staging numa única chamada batch_update,
+    que a API aplica de forma atômica. Com a aba já existente, a grade dela é
+    ajustada, os valores são colados do staging e o staging é apagado – o id da
+    aba não muda, então links e fórmulas que apontam para ela continuam
+    válidos. Sem aba de destino, o staging só é renomeado.
+    """
+    if destino is None:
+        requisicoes = [{'updateSheetProperties': {
+            'properties': {'sheetId': staging.id, 'title': new_tab, 'gridProperties': {'frozenRowCount': 1}},
+            'fields': 'title,gridProperties.frozenRowCount',
+        }}]
+    else:
+        grade = {'startRowIndex': 0, 'endRowIndex': n_linhas, 'startColumnIndex': 0, 'endColumnIndex': n_colunas}
+        requisicoes = [
+            {'updateSheetProperties': {
+                # A API não aceita congelar todas as linhas da grade
+                'properties': {'sheetId': destino.id, 'gridProperties': {
+                    'rowCount': max(n_linhas, 2), 'columnCount': n_colunas, 'frozenRowCount': 1}},
+                'fields': 'gridProperties.rowCount,gridProperties.columnCount,gridProperties.frozenRowCount',
+            }},
+            {'updateCells': {'range': {'sheetId': destino.id}, 'fields': 'userEnteredValue'}},
+            {'copyPaste': {
+                'source': {'sheetId': staging.id, **grade},
+                'destination': {'sheetId': destino.id, **grade},
+                'pasteType': 'PASTE_VALUES',
+            }},
+            {'deleteSheet': {'sheetId': staging.id}},
+        ]
+    def publicado():
+        # A chamada é atômica: se o staging sumiu, ela foi aplicada
+        return None if staging.id in {ws.id for ws in sh.worksheets()} else True
 
-    df_preparado = df.copy()
-    for col in df_preparado.columns:
-        if df_preparado[col].dtype.name == 'category':
-            df_preparado[col] = df_preparado[col].astype(str)
-    df_preparado = df_preparado.fillna('')
+    chamar_sheets(sh.batch_update, {'requests': requisicoes}, confirmar=publicado)
 
-    values = [df_preparado.columns.tolist()] + df_preparado.values.tolist()
-    ws.update(values)
 
-    ws.freeze(rows=1)
+def load_to_sheet(client: SessaoSheets, sheet_id: str, df: pd.DataFrame, new_tab: str = "DadosEtl",
+                  modo: str = "completo"):
+    """
+    Escreve o DataFrame na aba `new_tab`.
+
+    modo="completo" reescreve tudo: os valores vão em lotes para uma aba de
+    staging e só depois substituem o conteúdo da aba (ver _publicar_staging),
+    então uma falha no meio nunca deixa a aba vazia ou pela metade. modo="diff"
+    envia apenas as células que mudaram em relação ao conteúdo atual (ver
+    load_to_sheet_diff).
+    """
+    if modo == "diff":
+        return load_to_sheet_diff(client, sheet_id, df, new_tab)
+    if modo != "completo":
+        raise ValueError(f"Modo de escrita desconhecido: {modo}")
+
+    logger.info(f"Atualizando aba '{new_tab}' via staging...")
+
+    values = preparar_valores(df)
+    n_linhas, n_colunas = len(values), len(values[0])
+    sh = chamar_sheets(client.planilha, sheet_id)
+    abas = chamar_sheets(client.abas, sheet_id)
+
+    nome_staging = f"{new_tab}{SUFIXO_STAGING}"
+    if nome_staging in abas:
+        logger.info(f"Removendo staging de uma execução interrompida: '{nome_staging}'.")
+        chamar_sheets(sh.del_worksheet, abas[nome_staging],
+                      confirmar=lambda: None if nome_staging in client.abas(sheet_id) else True)
+    # Sem aba de destino o staging é renomeado com a 1ª linha congelada, e a API
+    # não aceita congelar todas as linhas da grade (só o cabeçalho)
+    staging = chamar_sheets(sh.add_worksheet, title=nome_staging, rows=max(n_linhas, 2), cols=n_colunas,
+                            confirmar=lambda: client.abas(sheet_id).get(nome_staging))
+
+    n_lotes = enviar_lotes(staging, _lotes_de_atualizacao([(0, 0, n_linhas - 1, n_colunas - 1)], values))
+    logger.info(f"Staging '{nome_staging}' preenchido: {n_linhas} linhas em {n_lotes} chamadas.")
+
+    _publicar_staging(sh, staging, abas.get(new_tab), new_tab, n_linhas, n_colunas)
+    client.esquecer_aba(sheet_id, nome_staging, new_tab)
+    _salvar_sombra(sheet_id, new_tab, values)
 
     logger.info(f"Aba '{new_tab}' atualizada com sucesso — sem excluir!")
 
+
+# -------------------------------------------------------------------
+# LOAD DIFERENCIAL – ENVIA SÓ AS CÉLULAS ALTERADAS
+# -------------------------------------------------------------------
+def _salvar_sombra(sheet_id: str, new_tab: str, values: list[list], diretorio: str = DIRETORIO_CACHE):
+    """
+    Guarda localmente o que foi escrito na aba, usado como base do próximo diff.
+    """
+    os.makedirs(diretorio, exist_ok=True)
+    caminho = _caminho_cache(sheet_id, new_tab, "sombra.json", diretorio)
+    temporario = caminho + ".tmp"
+    with open(temporario, "w", encoding="utf-8") as f:
+        json.dump(values, f, ensure_ascii=False)
+    os.replace(temporario, caminho)
+
+
+def _carregar_sombra(sheet_id: str, new_tab: str, diretorio: str = DIRETORIO_CACHE) -> list[list] | None:
+    caminho = _caminho_cache(sheet_id, new_tab, "sombra.json", diretorio)
+    if not os.path.exists(caminho):
+        return None
+    with open(caminho, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def _faixas_alteradas(antigos: list[list], novos: list[list]) -> list[tuple[int, int, int, int]]:
+    """
+    Compara as duas matrizes e devolve retângulos (linha0, col0, linha1, col1),
+    índices 0-based inclusivos, cobrindo todas as células diferentes. Células
+    que existiam e sumiram entram como vazias para serem limpas. Linhas
+    consecutivas com o mesmo trecho alterado viram um único retângulo.
+    """
+    n_linhas = max(len(antigos), len(novos))
+    n_colunas = max(max((len(l) for l in antigos), default=0), max((len(l) for l in novos), default=0))
+    vazia = [''] * n_colunas
+
+    def linha_completa(matriz, i):
+        if i >= len(matriz):
+            return vazia
+        linha = matriz[i]
+        return linha if len(linha) == n_colunas else list(linha) + [''] * (n_colunas - len(linha))
+
+    faixas = []
+    abertas = {}  # (col0, col1) -> [linha0, linha1]
+    for i in range(n_linhas):
+        antiga, nova = linha_completa(antigos, i), linha_completa(novos, i)
+        # Um trecho por linha, da primeira à última coluna alterada: reenviar
+        # algumas células iguais no meio custa menos que várias faixas
+        trechos = set()
+        if antiga != nova:
+            diferentes = [j for j in range(n_colunas) if antiga[j] != nova[j]]
+            trechos.add((diferentes[0], diferentes[-1]))
+
+        # Junta trechos com as mesmas colunas em linhas consecutivas
+        for chave in list(abertas):
+            if chave not in trechos:
+                linha0, linha1 = abertas.pop(chave)
+                faixas.append((linha0, chave[0], linha1, chave[1]))
+        for chave in trechos:
+            if chave in abertas:
+                abertas[chave][1] = i
+            else:
+                abertas[chave] = [i, i]
+
+    for chave, (linha0, linha1) in abertas.items():
+        faixas.append((linha0, chave[0], linha1, chave[1]))
+    return sorted(faixas)
+
+
+def _lotes_de_atualizacao(faixas: list[tuple[int, int, int, int]], novos: list[list],
+                          max_celulas: int = MAX_CELULAS_POR_LOTE):
+    """
+    Agrupa as faixas em lotes de batch_update com no máximo `max_celulas`
+    células; faixas maiores que o limite são quebradas por linhas.
+    """
+    import gspread
+
+    def valor(i, j):
+        if i < len(novos) and j < len(novos[i]):
+            return novos[i][j]
+        return ''
+
+    lote, celulas = [], 0
+    for linha0, col0, linha1, col1 in faixas:
+        largura = col1 - col0 + 1
+        passo = max(1, max_celulas // largura)
+        for inicio in range(linha0, linha1 + 1, passo):
+            fim = min(linha1, inicio + passo - 1)
+            tamanho = (fim - inicio + 1) * largura
+            if lote and celulas + tamanho > max_celulas:
+                yield lote
+                lote, celulas = [], 0
+            lote.append({
+                'range': f"{gspread.utils.rowcol_to_a1(inicio + 1, col0 + 1)}:"
+                         f"{gspread.utils.rowcol_to_a1(fim + 1, col1 + 1)}",
+                'values': [[valor(i, j) for j in range(col0, col1 + 1)] for i in range(inicio, fim + 1)],
+            })
+            celulas += tamanho
+    if lote:
+        yield lote
+
+
+def load_to_sheet_diff(client: SessaoSheets, sheet_id: str, df: pd.DataFrame, new_tab: str = "DadosEtl"):
+    """
+    Atualiza a aba enviando só as células alteradas, em batch_update por lotes.
+
+    A base da comparação é a cópia-sombra local da última escrita; sem ela, o
+    conteúdo atual é lido da aba (valores não formatados). A aba nunca fica
+    vazia durante a atualização.
+    """
+    import gspread
+
+    logger.info(f"Atualizando aba '{new_tab}' (modo diff)...")
+
+    values = preparar_valores(df)
+    n_colunas = len(values[0])
+    ws, criada = _abrir_ou_criar_aba(client, sheet_id, new_tab, len(values), n_colunas)
+
+    if criada:
+        antigos = []
+    else:
+        antigos = _carregar_sombra(sheet_id, new_tab)
+        if antigos is None:
+            logger.info("Sem cópia-sombra local – lendo conteúdo atual da aba.")
+            antigos = chamar_sheets(ws.get_all_values,
+                                    value_render_option=gspread.utils.ValueRenderOption.unformatted)
+
+    faixas = _faixas_alteradas(antigos, values)
+    if not faixas:
+        logger.info(f"Aba '{new_tab}' já está atualizada – nada a enviar.")
+        _salvar_sombra(sheet_id, new_tab, values)
+        return
+
+    # Garante que a grade comporta a nova matriz
+    linhas_grade, colunas_grade = getattr(ws, 'row_count', 0), getattr(ws, 'col_count', 0)
+    if linhas_grade < len(values) or colunas_grade < n_colunas:
+        chamar_sheets(ws.resize, rows=max(linhas_grade, len(values)), cols=max(colunas_grade, n_colunas))
+
+    total_celulas = sum((l1 - l0 + 1) * (c1 - c0 + 1) for l0, c0, l1, c1 in faixas)
+    n_lotes = enviar_lotes(ws, _lotes_de_atualizacao(faixas, values))
+
+    if criada:
+        chamar_sheets(ws.freeze, rows=1)
+    _salvar_sombra(sheet_id, new_tab, values)
+
+    logger.info(f"Aba '{new_tab}' atualizada: {len(faixas)} faixas, {total_celulas} células, {n_lotes} chamadas.")
+
+# -------------------------------------------------------------------
+# LOAD – DESTINOS (SINKS) PLUGÁVEIS
+# -------------------------------------------------------------------
+# Todos os destinos recebem (df, destino, **opcoes); `destino` é a aba no
+# Sheets ou o caminho do arquivo nos destinos locais.
+def _escrever_atomico(caminho: str, escrever):
+    pasta = os.path.dirname(caminho)
+    if pasta:
+        os.makedirs(pasta, exist_ok=True)
+    temporario = caminho + ".tmp"
+    escrever(temporario)
+    os.replace(temporario, caminho)
+
+
+def _categorias_para_texto(df: pd.DataFrame) -> pd.DataFrame:
+    colunas = [col for col in df.columns if df[col].dtype.name == 'category']
+    return df.astype({col: str for col in colunas}) if colunas else df
+
+
+def load_parquet(df: pd.DataFrame, caminho: str, **opcoes):
+    _escrever_atomico(caminho, lambda tmp: df.to_parquet(tmp, index=False, **opcoes))
+    logger.info(f"Parquet gravado: {caminho} ({len(df)} linhas)")
+
+
+def load_csv(df: pd.DataFrame, caminho: str, chunksize: int = 50_000, **opcoes):
+    """
+    CSV escrito em blocos de `chunksize` linhas (UTF-8 com BOM para abrir no Excel).
+    """
+    _escrever_atomico(caminho, lambda tmp: df.to_csv(tmp, index=False, chunksize=chunksize,
+                                                     encoding='utf-8-sig', **opcoes))
+    logger.info(f"CSV gravado: {caminho} ({len(df)} linhas)")
+
+
+def load_sqlite(df: pd.DataFrame, caminho: str, tabela: str = "DadosEtl", chunksize: int = 10_000):
+    """
+    Substitui a tabela `tabela` no banco SQLite com inserção em lote (executemany)
+    dentro de uma única transação.
+    """
+    import sqlite3
+
+    pasta = os.path.dirname(caminho)
+    if pasta:
+        os.makedirs(pasta, exist_ok=True)
+
+    with sqlite3.connect(caminho) as conn:
+        _categorias_para_texto(df).to_sql(tabela, conn, if_exists='replace', index=False, chunksize=chunksize)
+    conn.close()
+    logger.info(f"SQLite gravado: {caminho} | tabela '{tabela}' ({len(df)} linhas)")
+
+
+def load_duckdb(df: pd.DataFrame, caminho: str, tabela: str = "DadosEtl"):
+    """
+    Substitui a tabela `tabela` no banco DuckDB lendo o DataFrame direto (sem INSERT linha a linha).
+    """
+    import duckdb
+
+    pasta = os.path.dirname(caminho)
+    if pasta:
+        os.makedirs(pasta, exist_ok=True)
+
+    with duckdb.connect(caminho) as conn:
+        conn.register('df_etl', df)
+        conn.execute(f'CREATE OR REPLACE TABLE "{tabela}" AS SELECT * FROM df_etl')
+        conn.unregister('df_etl')
+    logger.info(f"DuckDB gravado: {caminho} | tabela '{tabela}' ({len(df)} linhas)")
+
+
+def load_sheets(df: pd.DataFrame, new_tab: str, client: SessaoSheets | None = None, sheet_id: str | None = None,
+                modo: str = "completo"):
+    load_to_sheet(client or sessao_sheets(), sheet_id, df, new_tab, modo=modo)
+
+
+SINKS = {
+    'sheets': load_sheets,
+    'parquet': load_parquet,
+    'csv': load_csv,
+    'sqlite': load_sqlite,
+    'duckdb': load_duckdb,
+}
+
+EXTENSOES_SINK = {'parquet': 'parquet', 'csv': 'csv', 'sqlite': 'sqlite', 'duckdb': 'duckdb'}
+
+
+def load(df: pd.DataFrame, sink: str = "sheets", destino: str = "DadosEtl", **opcoes):
+    """
+    Envia o DataFrame para o destino escolhido (ver SINKS).
+    """
+    if sink not in SINKS:
+        raise ValueError(f"Destino desconhecido: {sink}. Opções: {', '.join(SINKS)}")
+    logger.info(f"Carregando dados no destino '{sink}': {destino}")
+    return SINKS[sink](df, destino, **opcoes)
+
+
+# -------------------------------------------------------------------
+# LOAD EM BLOCOS – ESCREVE CADA BLOCO ASSIM QUE FICA PRONTO
+# -------------------------------------------------------------------
+# Usado com transform_em_blocos: o resultado completo nunca fica em memória.
+def load_csv_blocos(blocos, caminho: str, **opcoes) -> int:
+    linhas = 0
+
+    def escrever(tmp):
+        nonlocal linhas
+        for numero, bloco in enumerate(blocos):
+            bloco.to_csv(tmp, index=False, mode='w' if numero == 0 else 'a', header=numero == 0,
+                         encoding='utf-8-sig' if numero == 0 else 'utf-8', **opcoes)
+            linhas += len(bloco)
+
+    _escrever_atomico(caminho, escrever)
+    logger.info(f"CSV gravado em blocos: {caminho} ({linhas} linhas)")
+    return linhas
+
+
+def load_parquet_blocos(blocos, caminho: str, **opcoes) -> int:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    linhas = 0
+
+    def escrever(tmp):
+        nonlocal linhas
+        escritor = None
+        try:
+            for bloco in blocos:
+                if escritor is None:
+                    tabela = pa.Table.from_pandas(bloco, preserve_index=False)
+                    escritor = pq.ParquetWriter(tmp, tabela.schema, **opcoes)
+                else:
+                    tabela = pa.Table.from_pandas(bloco, schema=escritor.schema, preserve_index=False)
+                escritor.write_table(tabela)
+                linhas += len(bloco)
+        finally:
+            if escritor is not None:
+                escritor.close()
+
+    _escrever_atomico(caminho, escrever)
+    logger.info(f"Parquet gravado em blocos: {caminho} ({linhas} linhas)")
+    return linhas
+
+
+def load_sqlite_blocos(blocos, caminho: str, tabela: str = "DadosEtl", chunksize: int = 10_000) -> int:
+    import sqlite3
+
+    pasta = os.path.dirname(caminho)
+    if pasta:
+        os.makedirs(pasta, exist_ok=True)
+
+    linhas = 0
+    with sqlite3.connect(caminho) as conn:
+        for numero, bloco in enumerate(blocos):
+            _categorias_para_texto(bloco).to_sql(tabela, conn, if_exists='replace' if numero == 0 else 'append',
+                                                 index=False, chunksize=chunksize)
+            linhas += len(bloco)
+    conn.close()
+    logger.info(f"SQLite gravado em blocos: {caminho} | tabela '{tabela}' ({linhas} linhas)")
+    return linhas
+
+
+def load_duckdb_blocos(blocos, caminho: str, tabela: str = "DadosEtl") -> int:
+    import duckdb
+
+    pasta = os.path.dirname(caminho)
+    if pasta:
+        os.makedirs(pasta, exist_ok=True)
+
+    linhas = 0
+    with duckdb.connect(caminho) as conn:
+        for numero, bloco in enumerate(blocos):
+            conn.register('df_etl', bloco)
+            if numero == 0:
+                conn.execute(f'CREATE OR REPLACE TABLE "{tabela}" AS SELECT * FROM df_etl')
+            else:
+                conn.execute(f'INSERT INTO "{tabela}" SELECT * FROM df_etl')
+            conn.unregister('df_etl')
+            linhas += len(bloco)
+    logger.info(f"DuckDB gravado em blocos: {caminho} | tabela '{tabela}' ({linhas} linhas)")
+    return linhas
+
+
+SINKS_BLOCOS = {
+    'csv': load_csv_blocos,
+    'parquet': load_parquet_blocos,
+    'sqlite': load_sqlite_blocos,
+    'duckdb': load_duckdb_blocos,
+}
+
+
+def load_em_blocos(blocos, sink: str = "csv", destino: str = "DadosEtl", **opcoes):
+    """
+    Envia blocos de DataFrame para o destino. Destinos sem escrita em blocos
+    (ex.: sheets) recebem os blocos concatenados.
+    """
+    if sink not in SINKS_BLOCOS:
+        logger.info(f"Destino '{sink}' não grava em blocos – concatenando o resultado.")
+        return load(_concatenar_blocos(blocos), sink, destino, **opcoes)
+    logger.info(f"Carregando dados em blocos no destino '{sink}': {destino}")
+    return SINKS_BLOCOS[sink](blocos, destino, **opcoes)
+
+
+# -------------------------------------------------------------------
+# LOAD PARTICIONADO – UMA SAÍDA POR DISTRITO + CONSOLIDADO
+# -------------------------------------------------------------------
+def destino_derivado(destino: str, sufixo: str, sink: str = "sheets") -> str:
+    """
+    Destino ao lado do principal: aba "DadosEtl - Brotas" no Sheets; arquivo
+    "DadosEtl_brotas.parquet" nos demais.
+    """
+    if sink == "sheets":
+        return f"{destino} - {sufixo}"
+    ascii_ = unicodedata.normalize('NFKD', sufixo).encode('ascii', 'ignore').decode('ascii')
+    sufixo = re.sub(r'[^a-z0-9]+', '_', ascii_.lower()).strip('_')
+    raiz, extensao = os.path.splitext(destino)
+    return f"{raiz}_{sufixo}{extensao}"
+
+
+def load_particoes(particoes: dict[str, pd.DataFrame], sink: str = "sheets", destino: str = "DadosEtl", **opcoes):
+    """
+    Grava cada distrito no seu destino (ver destino_derivado) e o consolidado em `destino`.
+    """
+    for carga in cargas_particoes(particoes, sink, destino, **opcoes):
+        carga()
+
+
+def cargas_particoes(particoes: dict[str, pd.DataFrame], sink: str = "sheets", destino: str = "DadosEtl",
+                     **opcoes) -> list:
+    """
+    As gravações de load_particoes como chamadas independentes (podem rodar
+    em paralelo, ver executar_cargas).
+    """
+    cargas = [partial(load, df, sink, destino_derivado(destino, distrito, sink), **opcoes)
+              for distrito, df in particoes.items()]
+    return cargas + [lambda: load(consolidar_particoes(particoes), sink, destino, **opcoes)]
+
+
+def gravar_cubo(base: pd.DataFrame, sink: str = "sheets", destino: str = "DadosEtl", **opcoes):
+    """
+    Agregados prontos para os dashboards, gravados ao lado dos dados linha a linha.
+    """
+    cubo = medir('criar_cubo', criar_cubo, base)
+    load(cubo, sink, destino_derivado(destino, 'Cubo', sink), **opcoes)
+    load(criar_resumo_sistemas(base), sink, destino_derivado(destino, 'ResumoSistemas', sink), **opcoes)
+
+
+# -------------------------------------------------------------------
+# EXECUÇÃO ASSÍNCRONA – LEITURA, TRANSFORM E ESCRITA SOBREPOSTAS
+# -------------------------------------------------------------------
+# As chamadas bloqueantes (leitura de arquivo, gspread, escrita) rodam em
+# threads via asyncio.to_thread; o laço só coordena as filas. O transform em
+# si continua sequencial e na mesma ordem, então a saída é idêntica.
+# Blocos lidos/escritos adiantados em cada fila (memória: ~2x isso em blocos)
+PROFUNDIDADE_FILA = int(os.environ.get("ETL_PREFETCH", "2"))
+# Gravações independentes (abas, partições, cubo) em andamento ao mesmo tempo
+CARGAS_SIMULTANEAS = int(os.environ.get("ETL_CARGAS_SIMULTANEAS", "4"))
+_FIM_FILA = object()
+
+
+async def _ler_adiante(iteravel, fila):
+    """
+    Produtor: lê o próximo item numa thread enquanto o anterior é consumido.
+    Erros de leitura seguem pela fila até o consumidor.
+    """
+    import asyncio
+
+    iterador = iter(iteravel)
+    try:
+        while (item := await asyncio.to_thread(next, iterador, _FIM_FILA)) is not _FIM_FILA:
+            await fila.put(item)
+    except Exception as e:
+        await fila.put(e)
+        return
+    await fila.put(_FIM_FILA)
+
+
+def _iterar_fila(fila, loop):
+    """
+    Lado síncrono de uma fila asyncio, para funções que consomem iteráveis
+    (estatisticas_globais, load_*_blocos) rodando em outra thread.
+    """
+    import asyncio
+
+    while (item := asyncio.run_coroutine_threadsafe(fila.get(), loop).result()) is not _FIM_FILA:
+        if isinstance(item, BaseException):
+            raise item
+        yield item
+
+
+async def _entregar(fila, item, escrita):
+    """
+    fila.put que desiste se a escrita já terminou (falhou), em vez de esperar
+    para sempre por espaço na fila.
+    """
+    import asyncio
+
+    colocar = asyncio.ensure_future(fila.put(item))
+    await asyncio.wait({colocar, escrita}, return_when=asyncio.FIRST_COMPLETED)
+    if not colocar.done():
+        colocar.cancel()
+        escrita.result()
+        raise RuntimeError("A escrita terminou antes de receber todos os blocos.")
+
+
+def _aplicar_etapas(etapas: list, df: pd.DataFrame) -> pd.DataFrame:
+    for _, etapa in etapas:
+        df = aplicar_etapa(etapa, df)
+    return df
+
+
+async def _pipeline_blocos_assincrono(abrir_blocos, sink: str, destino: str, n_clusters: int, etapas: list | None,
+                                      opcoes: dict):
+    import asyncio
+
+    loop = asyncio.get_running_loop()
+
+    logger.info("Transformação em blocos (assíncrona): primeira passada (estatísticas globais)...")
+    fila = asyncio.Queue(PROFUNDIDADE_FILA)
+    leitura = asyncio.create_task(_ler_adiante(abrir_blocos(), fila))
+    estatisticas = await asyncio.to_thread(estatisticas_globais, _iterar_fila(fila, loop))
+    await leitura
+    logger.info(f"Linhas na fonte: {estatisticas['linhas']}")
+    etapas, _ = await asyncio.to_thread(etapas_com_estatisticas, estatisticas, n_clusters, etapas)
+
+    # Segunda passada: lê o próximo bloco e grava o anterior enquanto transforma o atual
+    entrada, saida = asyncio.Queue(PROFUNDIDADE_FILA), asyncio.Queue(PROFUNDIDADE_FILA)
+    leitura = asyncio.create_task(_ler_adiante(abrir_blocos(), entrada))
+    escrita = asyncio.ensure_future(
+        asyncio.to_thread(load_em_blocos, _iterar_fila(saida, loop), sink, destino, **opcoes))
+    try:
+        numero = 0
+        while (bloco := await entrada.get()) is not _FIM_FILA:
+            if isinstance(bloco, BaseException):
+                raise bloco
+            bloco = await asyncio.to_thread(_aplicar_etapas, etapas, bloco)
+            numero += 1
+            logger.info(f"Bloco {numero} transformado ({len(bloco)} linhas).")
+            await _entregar(saida, bloco, escrita)
+        await _entregar(saida, _FIM_FILA, escrita)
+        return await escrita
+    except BaseException as e:
+        leitura.cancel()
+        if not escrita.done():
+            # O erro chega ao escritor, que aborta sem publicar o arquivo parcial
+            with contextlib.suppress(Exception):
+                await _entregar(saida, e, escrita)
+        await asyncio.gather(escrita, leitura, return_exceptions=True)
+        raise
+
+
+def load_em_blocos_assincrono(abrir_blocos, sink: str = "csv", destino: str = "DadosEtl", n_clusters: int = 15,
+                              etapas: list | None = None, **opcoes):
+    """
+    Mesmo resultado de load_em_blocos(transform_em_blocos(abrir_blocos), ...),
+    mas com leitura adiantada dos blocos nas duas passadas e escrita em
+    segundo plano: a latência de disco/rede fica escondida atrás do transform.
+    """
+    import asyncio
+
+    return asyncio.run(_pipeline_blocos_assincrono(abrir_blocos, sink, destino, n_clusters, etapas, opcoes))
+
+
+async def _executar_cargas_assincrono(cargas: list, limite: int) -> list:
+    import asyncio
+
+    semaforo = asyncio.Semaphore(limite)
+
+    async def executar(carga):
+        async with semaforo:
+            return await asyncio.to_thread(carga)
+
+    return await asyncio.gather(*(executar(carga) for carga in cargas))
+
+
+def executar_cargas(cargas: list, assincrono: bool = False, limite: int = CARGAS_SIMULTANEAS) -> list:
+    """
+    Executa gravações independentes (funções sem argumentos). No modo
+    assíncrono elas rodam juntas em threads, até `limite` ao mesmo tempo, e o
+    que é só CPU (cubo, relatório) se sobrepõe à espera de rede das demais;
+    nesse caso o perfil não registra CPU nem pico de memória de cada uma.
+    """
+    global _etapa_isolada
+
+    if not assincrono or len(cargas) <= 1:
+        return [carga() for carga in cargas]
+    import asyncio
+
+    _etapa_isolada = False
+    try:
+        return asyncio.run(_executar_cargas_assincrono(cargas, limite))
+    finally:
+        _etapa_isolada = True
+
+
 # -------------------------------------------------------------------
 # MAIN
 # -------------------------------------------------------------------
-def main():
-    SHEET_ID = "..."
-    TAB = "BaseBruta"
-    NEW_TAB = "DadosEtl"
+def _ligado(variavel: str) -> bool:
+    return os.environ.get(variavel, "0") == "1"
 
-    df, client = extract(SHEET_ID, TAB)
-    df = transform(df)
-    
-    load_to_sheet(client, SHEET_ID, df, NEW_TAB)
+
+def ler_argumentos(argv: list[str] | None = None) -> argparse.Namespace:
+    """
+    Opções de linha de comando; os padrões vêm das variáveis ETL_* para que
+    agendamentos antigos continuem funcionando sem mudança.
+    """
+    parser = argparse.ArgumentParser(description="ETL das respostas do formulário (extract, transform e load).")
+    parser.add_argument("--sheet-id", default=os.environ.get("ETL_SHEET_ID"),
+                        help="planilha do Google usada como fonte e/ou destino 'sheets'")
+    parser.add_argument("--aba-origem", default=os.environ.get("ETL_ABA_ORIGEM", "BaseBruta"))
+    parser.add_argument("--aba-destino", default=os.environ.get("ETL_ABA_DESTINO", "DadosEtl"))
+    parser.add_argument("--fonte", choices=list(SOURCES), default=os.environ.get("ETL_FONTE", "sheets"))
+    parser.add_argument("--origem", default=os.environ.get("ETL_ORIGEM"), help="arquivo de entrada (fontes locais)")
+    parser.add_argument("--sink", choices=list(SINKS), default=os.environ.get("ETL_SINK", "sheets"))
+    parser.add_argument("--destino", default=os.environ.get("ETL_DESTINO"),
+                        help="aba (sheets) ou arquivo; padrão derivado de --aba-destino")
+    parser.add_argument("--modo-escrita", choices=["completo", "diff"],
+                        default=os.environ.get("ETL_MODO_ESCRITA", "completo"))
+    parser.add_argument("--etapas", nargs="+", metavar="ETAPA", choices=[nome for nome, _ in ETAPAS_TRANSFORM],
+                        help="roda só estas etapas do transform (ex.: pular normalizar_area_atuacao "
+                             "dispensa o scikit-learn)")
+    parser.add_argument("--incremental", action="store_true", default=_ligado("ETL_INCREMENTAL"))
+    parser.add_argument("--cache", action="store_true", default=_ligado("ETL_CACHE"))
+    parser.add_argument("--retomar", action="store_true", default=_ligado("ETL_RETOMAR"))
+    parser.add_argument("--blocos", action="store_true", default=_ligado("ETL_BLOCOS"))
+    parser.add_argument("--tamanho-bloco", type=int,
+                        default=int(os.environ.get("ETL_TAMANHO_BLOCO", TAMANHO_BLOCO_LEITURA)))
+    parser.add_argument("--particionar", action="store_true", default=_ligado("ETL_PARTICIONAR"))
+    parser.add_argument("--cubo", action="store_true", default=_ligado("ETL_CUBO"))
+    parser.add_argument("--qualidade", action="store_true", default=QUALIDADE_ATIVA)
+    parser.add_argument("--assincrono", action="store_true", default=_ligado("ETL_ASSINCRONO"),
+                        help="sobrepõe leitura, transform e escrita (blocos) e grava as saídas em paralelo")
+    parser.add_argument("--manifesto", help="JSON com a lista de jobs para rodar em lote (ver executar_lote)")
+    parser.add_argument("--workers", type=int, default=WORKERS_PARALELO, help="processos do lote")
+    parser.add_argument("--resumo", help="arquivo do resumo do lote (padrão: ETL_LOTES_DIR/lote_<data>.json)")
+    args = parser.parse_args(argv)
+
+    if args.manifesto:
+        return args
+    if args.fonte != "sheets" and not args.origem:
+        parser.error(f"--origem é obrigatório com a fonte '{args.fonte}'")
+    if args.incremental and args.fonte != "sheets":
+        parser.error("--incremental só funciona com a fonte 'sheets' (usa a marca d'água da planilha)")
+    if args.incremental and args.particionar:
+        parser.error("--particionar não pode ser combinado com --incremental")
+    if "sheets" in (args.fonte, args.sink) and not args.sheet_id:
+        parser.error("--sheet-id (ou ETL_SHEET_ID) é obrigatório com fonte ou destino 'sheets'")
+    return args
+
+
+def executar_pipeline(args: argparse.Namespace, caminho_perfil: str | None = None) -> str:
+    """
+    Extract -> transform -> load conforme as opções (ver ler_argumentos).
+    Devolve o destino gravado.
+    """
+    SHEET_ID = args.sheet_id
+    TAB = args.aba_origem
+    NEW_TAB = args.aba_destino
+    INCREMENTAL = args.incremental
+    CACHE = args.cache
+    RETOMAR = args.retomar
+    BLOCOS = args.blocos
+    PARTICIONAR = args.particionar
+    CUBO = args.cubo
+    QUALIDADE = args.qualidade
+    ASSINCRONO = args.assincrono
+    TAMANHO_BLOCO = args.tamanho_bloco
+    FONTE = args.fonte
+    ORIGEM = args.origem
+    SINK = args.sink
+    DESTINO = args.destino or (
+        NEW_TAB if SINK == "sheets" else f"{NEW_TAB}.{EXTENSOES_SINK.get(SINK, SINK)}")
+
+    ETAPAS = selecionar_etapas(args.etapas) if args.etapas else list(ETAPAS_TRANSFORM)
+
+    # Identifica a origem nos caches locais (id da planilha ou caminho do arquivo)
+    ID_ORIGEM = SHEET_ID if FONTE == "sheets" else ORIGEM
+
+    if BLOCOS and FONTE not in ITERADORES_FONTE:
+        logger.warning(f"A fonte {FONTE} não tem leitura em blocos – ignorando --blocos/--assincrono.")
+    elif BLOCOS:
+        ignoradas = [f"--{nome}" for nome, ligado in [('incremental', INCREMENTAL), ('cache', CACHE),
+                                                     ('retomar', RETOMAR), ('particionar', PARTICIONAR),
+                                                     ('cubo', CUBO), ('qualidade', QUALIDADE)] if ligado]
+        if ignoradas:
+            logger.warning(f"Leitura em blocos não suporta {', '.join(ignoradas)} – opções ignoradas.")
+
+    try:
+        if BLOCOS and FONTE in ITERADORES_FONTE:
+            # Bases grandes: lê, transforma e grava bloco a bloco
+            origem = {'tab_name': TAB} if FONTE == "sheets" else {}
+            abrir_blocos = partial(iterar_fonte, FONTE, ID_ORIGEM, chunksize=TAMANHO_BLOCO, **origem)
+            opcoes = {'client': None, 'sheet_id': SHEET_ID} if SINK == "sheets" else {}
+            if ASSINCRONO:
+                medir(f'load_{SINK}_blocos', load_em_blocos_assincrono, abrir_blocos, SINK, DESTINO,
+                      etapas=ETAPAS, **opcoes)
+            else:
+                medir(f'load_{SINK}_blocos', load_em_blocos, transform_em_blocos(abrir_blocos, etapas=ETAPAS),
+                      SINK, DESTINO, **opcoes)
+        else:
+            particoes = None
+            if RETOMAR:
+                # Reaproveita o bruto e os estágios salvos (ex.: após falha no load)
+                df = retomar_transform(ID_ORIGEM, TAB, etapas=ETAPAS)
+                bruto = ler_estagio(_ler_ponteiro(ID_ORIGEM, TAB)) if QUALIDADE else None
+                client = None
+            elif INCREMENTAL:
+                marca = carregar_marca_dagua(SHEET_ID, TAB)
+                df, client, marca, completo = medir('extract_incremental', extract_incremental, SHEET_ID, TAB, marca)
+                # O snapshot só guarda o transformado: o relatório confere as linhas novas
+                bruto = df
+                df = transform_incremental(df, SHEET_ID, TAB, completo, etapas=ETAPAS)
+                # Só avança a marca depois que o snapshot com as linhas novas foi salvo
+                salvar_marca_dagua(SHEET_ID, TAB, marca)
+            else:
+                if FONTE == "sheets":
+                    df, client = medir('extract', extract, SHEET_ID, TAB)
+                else:
+                    df, client = medir('extract', extract_source, FONTE, ORIGEM), None
+                bruto = df
+                if PARTICIONAR:
+                    # Uma saída por distrito + consolidado; só distritos alterados são recalculados
+                    particoes = transform_particionado(df, etapas=ETAPAS)
+                elif CACHE:
+                    df = transform_com_cache(df, ID_ORIGEM, TAB, etapas=ETAPAS)
+                else:
+                    df = transform(df, etapas=ETAPAS)
+
+            opcoes = {}
+            if SINK == "sheets":
+                opcoes = {'client': client, 'sheet_id': SHEET_ID, 'modo': args.modo_escrita}
+            nome_load = 'load_to_sheet' if SINK == "sheets" else f'load_{SINK}'
+            if particoes is not None:
+                cargas = cargas_particoes(particoes, SINK, DESTINO, **opcoes)
+            else:
+                cargas = [partial(medir, nome_load, load, df, SINK, DESTINO, **opcoes)]
+
+            if CUBO or QUALIDADE:
+                base = consolidar_particoes(particoes) if particoes is not None else df
+            if QUALIDADE:
+                cargas.append(partial(medir, 'relatorio_qualidade', salvar_relatorio_qualidade, base, bruto=bruto))
+            if CUBO:
+                cargas.append(partial(gravar_cubo, base, SINK, DESTINO, **opcoes))
+            executar_cargas(cargas, ASSINCRONO)
+    finally:
+        salvar_perfil(caminho_perfil)
 
     logger.info("ETL COMPLETO! Todas as abas formatadas como tabelas.")
+    return DESTINO
+
+
+# -------------------------------------------------------------------
+# EXECUÇÃO EM LOTE – VÁRIAS ONDAS/CÓPIAS DO FORMULÁRIO
+# -------------------------------------------------------------------
+# O manifesto é uma lista JSON de jobs; cada job usa as mesmas opções da linha
+# de comando, com '_' no lugar de '-' e um "nome" opcional:
+#   [{"nome": "onda1", "sheet_id": "...", "aba_origem": "BaseBruta", "aba_destino": "DadosEtl"},
+#    {"nome": "onda2", "fonte": "csv", "origem": "onda2.csv", "sink": "parquet", "destino": "onda2.parquet"}]
+DIRETORIO_LOTES = os.environ.get("ETL_LOTES_DIR", "lotes")
+
+
+def _argv_do_job(job: dict) -> list[str]:
+    argv = []
+    for opcao, valor in job.items():
+        if opcao == 'nome' or valor is None or valor is False:
+            continue
+        flag = '--' + opcao.replace('_', '-')
+        if valor is True:
+            argv.append(flag)
+        elif isinstance(valor, list):
+            argv += [flag, *map(str, valor)]
+        else:
+            argv += [flag, str(valor)]
+    return argv
+
+
+def _executar_job(nome: str, args: argparse.Namespace, processos: int) -> dict:
+    """
+    Roda um job do lote e devolve sua linha do resumo; falhas viram status
+    'falha' em vez de derrubar o lote.
+    """
+    global LIMITADOR_SHEETS
+    # A cota do Sheets é por usuário: os processos do lote dividem a taxa
+    LIMITADOR_SHEETS = LimitadorTaxa(max(1, REQUISICOES_POR_MINUTO // processos))
+    _registros_perfil.clear()
+
+    inicio = time.perf_counter()
+    linha = {'nome': nome, 'pid': os.getpid()}
+    try:
+        caminho_perfil = os.path.join(DIRETORIO_PERFIL, f"perfil_{_inicio_execucao}_{nome}.json")
+        linha.update(status='ok', destino=executar_pipeline(args, caminho_perfil))
+    except Exception as e:
+        logger.exception(f"Job '{nome}' falhou.")
+        linha.update(status='falha', erro=f"{type(e).__name__}: {e}")
+    linha['tempo_s'] = round(time.perf_counter() - inicio, 2)
+    return linha
+
+
+def _rodar_isolado(nome: str, args: argparse.Namespace, processos: int) -> dict:
+    """
+    Roda um job num processo só dele; se esse processo morrer, só este job
+    vira 'falha'.
+    """
+    from concurrent.futures import ProcessPoolExecutor
+
+    try:
+        with ProcessPoolExecutor(max_workers=1) as pool:
+            return pool.submit(_executar_job, nome, args, processos).result()
+    except Exception as e:
+        logger.error(f"Job '{nome}' perdido: {type(e).__name__}: {e}")
+        return {'nome': nome, 'status': 'falha', 'erro': f"{type(e).__name__}: {e}", 'tempo_s': 0.0}
+
+
+def _rodar_jobs(validos: list[tuple], workers: int) -> list[dict]:
+    """
+    Linhas do resumo dos jobs, na ordem. Ao contrário de executar_em_pool, um
+    worker que morre (BrokenProcessPool) não manda o lote para o processo pai:
+    os jobs que estavam no pool quebrado rodam de novo, cada um isolado, e só
+    o que derrubou o processo fica com 'falha'.
+    """
+    from concurrent.futures import BrokenExecutor, ProcessPoolExecutor
+
+    if workers <= 1:
+        return [_executar_job(nome, args, workers) for _, nome, args in validos]
+    try:
+        pool = ProcessPoolExecutor(max_workers=workers)
+    except (OSError, NotImplementedError) as e:
+        logger.warning(f"Execução em processos indisponível ({e}) – seguindo em modo sequencial.")
+        return [_executar_job(nome, args, workers) for _, nome, args in validos]
+
+    linhas, perdidos = [None] * len(validos), []
+    with pool:
+        futuros = [pool.submit(_executar_job, nome, args, workers) for _, nome, args in validos]
+        for k, ((_, nome, _), futuro) in enumerate(zip(validos, futuros)):
+            try:
+                linhas[k] = futuro.result()
+            except BrokenExecutor:
+                perdidos.append(k)
+            except Exception as e:
+                logger.error(f"Job '{nome}' perdido: {type(e).__name__}: {e}")
+                linhas[k] = {'nome': nome, 'status': 'falha', 'erro': f"{type(e).__name__}: {e}", 'tempo_s': 0.0}
+    if perdidos:
+        logger.warning(f"Um processo do lote morreu; repetindo {len(perdidos)} jobs, cada um isolado.")
+        for k in perdidos:
+            _, nome, args = validos[k]
+            linhas[k] = _rodar_isolado(nome, args, workers)
+    return linhas
+
+
+def executar_lote(caminho_manifesto: str, workers: int | None = None, caminho_resumo: str | None = None) -> dict:
+    """
+    Roda os jobs do manifesto num pool de processos (_rodar_jobs) e grava
+    um resumo com tempo, status e erro de cada job.
+    """
+    with open(caminho_manifesto, encoding="utf-8") as f:
+        jobs = json.load(f)
+
+    resumo_jobs, validos = [None] * len(jobs), []
+    for i, job in enumerate(jobs):
+        nome = job.get('nome') or f"job{i + 1:02d}"
+        try:
+            validos.append((i, nome, ler_argumentos(_argv_do_job(job))))
+        except SystemExit:
+            resumo_jobs[i] = {'nome': nome, 'status': 'falha', 'erro': 'opções inválidas no manifesto', 'tempo_s': 0.0}
+
+    workers = max(1, min(workers or os.cpu_count() or 1, len(validos) or 1))
+    logger.info(f"Lote: {len(jobs)} jobs ({len(validos)} válidos) em {workers} processos")
+
+    inicio = time.perf_counter()
+    for (i, _, _), linha in zip(validos, _rodar_jobs(validos, workers)):
+        resumo_jobs[i] = linha
+
+    resumo = {
+        'execucao': _inicio_execucao,
+        'manifesto': caminho_manifesto,
+        'workers': workers,
+        'tempo_total_s': round(time.perf_counter() - inicio, 2),
+        'tempo_somado_s': round(sum(linha['tempo_s'] for linha in resumo_jobs), 2),
+        'falhas': sum(linha['status'] != 'ok' for linha in resumo_jobs),
+        'jobs': resumo_jobs,
+    }
+    caminho = caminho_resumo or os.path.join(DIRETORIO_LOTES, f"lote_{_inicio_execucao}.json")
+    os.makedirs(os.path.dirname(caminho) or '.', exist_ok=True)
+    with open(caminho, "w", encoding="utf-8") as f:
+        json.dump(resumo, f, ensure_ascii=False, indent=2)
+
+    for linha in resumo_jobs:
+        logger.info(f"  {linha['nome']:<24} {linha['status']:<6} {linha['tempo_s']:>8.2f}s  "
+                    f"{linha.get('destino') or linha.get('erro', '')}")
+    logger.info(f"Lote concluído em {resumo['tempo_total_s']}s (soma dos jobs: {resumo['tempo_somado_s']}s), "
+                f"{resumo['falhas']} falhas. Resumo em {caminho}")
+    return resumo
+
+
+def main(argv: list[str] | None = None):
+    args = ler_argumentos(argv)
+    if args.manifesto:
+        resumo = executar_lote(args.manifesto, args.workers, args.resumo)
+        if resumo['falhas']:
+            raise SystemExit(1)
+    else:
+        executar_pipeline(args)
 
 
 if __name__ == "__main__":
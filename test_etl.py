@@ -0,0 +1,1272 @@
+import atexit
+import json
+import os
+import pickle
+import re
+import shutil
+import tempfile
+from functools import partial
+from itertools import combinations
+
+import numpy as np
+import pandas as pd
+import pytest
+
+# Caches e modelo de área dos testes numa pasta própria, nunca os da execução
+# real; precisa vir antes do import do etl, que lê as variáveis ao carregar
+DIRETORIO_TESTES = tempfile.mkdtemp(prefix="etl_testes_")
+atexit.register(shutil.rmtree, DIRETORIO_TESTES, ignore_errors=True)
+os.environ["ETL_CACHE_DIR"] = DIRETORIO_TESTES
+os.environ.pop("ETL_MODELO_AREA", None)
+
+import etl  # noqa: E402
+
+
+@pytest.fixture(scope="session")
+def respostas() -> pd.DataFrame:
+    """Respostas sintéticas no layout da planilha (ver benchmark.gerar_respostas)."""
+    import benchmark
+
+    return benchmark.gerar_respostas(400, seed=7)
+
+
+@pytest.fixture
+def csv_respostas(respostas, tmp_path) -> str:
+    caminho = str(tmp_path / "respostas.csv")
+    respostas.to_csv(caminho, index=False)
+    return caminho
+
+
+# -------------------------------------------------------------------
+# DIFF DE CÉLULAS – _faixas_alteradas / _lotes_de_atualizacao
+# -------------------------------------------------------------------
+def _aplicar_lotes(antigos: list[list], lotes) -> list[list]:
+    """Aplica os batch_update na matriz como o Sheets faria."""
+    import gspread
+
+    grade = [list(linha) for linha in antigos]
+    for lote in lotes:
+        for atualizacao in lote:
+            inicio, _ = atualizacao['range'].split(':')
+            linha0, col0 = gspread.utils.a1_to_rowcol(inicio)
+            for i, valores in enumerate(atualizacao['values']):
+                while len(grade) < linha0 + i:
+                    grade.append([])
+                linha = grade[linha0 + i - 1]
+                for j, valor in enumerate(valores):
+                    while len(linha) < col0 + j:
+                        linha.append('')
+                    linha[col0 + j - 1] = valor
+    return grade
+
+
+def _sem_vazios_no_fim(matriz: list[list]) -> list[list]:
+    linhas = []
+    for linha in matriz:
+        linha = list(linha)
+        while linha and linha[-1] == '':
+            linha.pop()
+        linhas.append(linha)
+    while linhas and not linhas[-1]:
+        linhas.pop()
+    return linhas
+
+
+def test_faixas_alteradas_sem_mudanca():
+    matriz = [['a', 'b'], ['1', '2']]
+    assert etl._faixas_alteradas(matriz, [list(l) for l in matriz]) == []
+
+
+def test_faixas_alteradas_uma_celula():
+    antigos = [['a', 'b', 'c'], ['1', '2', '3']]
+    novos = [['a', 'b', 'c'], ['1', 'X', '3']]
+    assert etl._faixas_alteradas(antigos, novos) == [(1, 1, 1, 1)]
+
+
+def test_faixas_alteradas_junta_linhas_consecutivas():
+    antigos = [['h1', 'h2', 'h3']] + [[str(i), 'x', 'y'] for i in range(4)]
+    novos = [['h1', 'h2', 'h3']] + [[str(i), 'X', 'Y'] for i in range(4)]
+    assert etl._faixas_alteradas(antigos, novos) == [(1, 1, 4, 2)]
+
+
+def test_faixas_alteradas_limpa_celulas_que_sumiram():
+    antigos = [['a', 'b', 'c'], ['1', '2', '3'], ['4', '5', '6']]
+    novos = [['a', 'b'], ['1', '2']]
+    faixas = etl._faixas_alteradas(antigos, novos)
+    assert faixas == [(0, 2, 1, 2), (2, 0, 2, 2)]
+    resultado = _aplicar_lotes(antigos, etl._lotes_de_atualizacao(faixas, novos))
+    assert _sem_vazios_no_fim(resultado) == novos
+
+
+def test_lotes_de_atualizacao_respeitam_limite_de_celulas():
+    antigos = [['h'] * 5] + [['0'] * 5 for _ in range(30)]
+    novos = [['h'] * 5] + [[str(i)] * 5 for i in range(1, 31)]
+    faixas = etl._faixas_alteradas(antigos, novos)
+    lotes = list(etl._lotes_de_atualizacao(faixas, novos, max_celulas=20))
+
+    assert len(lotes) > 1
+    for lote in lotes:
+        assert sum(len(a['values']) * len(a['values'][0]) for a in lote) <= 20
+    assert lotes[0][0]['range'] == 'A2:E5'
+    assert _aplicar_lotes(antigos, lotes) == novos
+
+
+def test_lotes_de_atualizacao_preenchem_linhas_curtas():
+    antigos = [['a', 'b', 'c']]
+    novos = [['a']]
+    lotes = list(etl._lotes_de_atualizacao(etl._faixas_alteradas(antigos, novos), novos))
+    assert lotes == [[{'range': 'B1:C1', 'values': [['', '']]}]]
+
+
+# -------------------------------------------------------------------
+# EXTRACT INCREMENTAL – MARCA D'ÁGUA (sem acesso ao Sheets)
+# -------------------------------------------------------------------
+class AbaFalsa:
+    def __init__(self, valores: list[list]):
+        self.valores = valores
+        self.leituras = []
+
+    def get_all_values(self):
+        self.leituras.append('completa')
+        return [list(linha) for linha in self.valores]
+
+    def batch_get(self, ranges, **_):
+        self.leituras.append(tuple(ranges))
+        resultado = []
+        for a1 in ranges:
+            if a1 == '1:1':
+                resultado.append([list(self.valores[0])] if self.valores else [])
+                continue
+            linha0 = int(re.match(r'[A-Z]+(\d+):', a1).group(1))
+            resultado.append([list(linha) for linha in self.valores[linha0 - 1:]])
+        return resultado
+
+
+class SessaoFalsa:
+    def __init__(self, aba: AbaFalsa):
+        self._aba = aba
+
+    def aba(self, sheet_id, tab_name):
+        return self._aba
+
+
+CABECALHO = [etl.COLUNA_TIMESTAMP, 'Pergunta']
+
+
+def _respostas(n: int, inicio: int = 0) -> list[list]:
+    return [[f"01/01/2024 10:{i:02d}:00", f"resposta {i}"] for i in range(inicio, inicio + n)]
+
+
+def _primeira_leitura(aba: AbaFalsa) -> dict:
+    _, _, marca, _ = etl.extract_incremental('SID', 'BaseBruta', None, SessaoFalsa(aba))
+    return marca
+
+
+def test_incremental_sem_marca_faz_leitura_completa():
+    aba = AbaFalsa([CABECALHO] + _respostas(3))
+    df, _, marca, completo = etl.extract_incremental('SID', 'BaseBruta', None, SessaoFalsa(aba))
+
+    assert completo
+    assert len(df) == 3
+    assert marca['linhas'] == 3
+    assert marca['ultimo_timestamp'] == '01/01/2024 10:02:00'
+    assert marca['colunas'] == CABECALHO
+
+
+def test_incremental_le_so_as_linhas_novas():
+    aba = AbaFalsa([CABECALHO] + _respostas(3))
+    marca = _primeira_leitura(aba)
+    aba.valores += _respostas(2, inicio=3)
+    aba.leituras.clear()
+
+    df, _, marca_nova, completo = etl.extract_incremental('SID', 'BaseBruta', marca, SessaoFalsa(aba))
+
+    assert not completo
+    assert df['Pergunta'].tolist() == ['resposta 3', 'resposta 4']
+    assert marca_nova['linhas'] == 5
+    assert marca_nova['ultimo_timestamp'] == '01/01/2024 10:04:00'
+    # Cabeçalho e linhas novas numa única chamada, a partir da última processada
+    assert aba.leituras == [('1:1', 'A4:B')]
+
+
+def test_incremental_sem_linhas_novas_mantem_marca():
+    aba = AbaFalsa([CABECALHO] + _respostas(3))
+    marca = _primeira_leitura(aba)
+
+    df, _, marca_nova, completo = etl.extract_incremental('SID', 'BaseBruta', marca, SessaoFalsa(aba))
+
+    assert not completo and df.empty
+    assert marca_nova['linhas'] == 3
+    assert marca_nova['ultimo_timestamp'] == marca['ultimo_timestamp']
+
+
+def test_incremental_cabecalho_alterado_refaz_leitura_completa():
+    aba = AbaFalsa([CABECALHO] + _respostas(3))
+    marca = _primeira_leitura(aba)
+    aba.valores = [CABECALHO + ['Pergunta nova']] + [linha + [''] for linha in _respostas(4)]
+
+    df, _, marca_nova, completo = etl.extract_incremental('SID', 'BaseBruta', marca, SessaoFalsa(aba))
+
+    assert completo
+    assert len(df) == 4
+    assert marca_nova['linhas'] == 4
+    assert marca_nova['colunas'] == CABECALHO + ['Pergunta nova']
+
+
+def test_incremental_linhas_apagadas_refaz_leitura_completa():
+    aba = AbaFalsa([CABECALHO] + _respostas(3))
+    marca = _primeira_leitura(aba)
+    # Primeira resposta apagada: a linha da marca agora tem outro timestamp
+    aba.valores = [CABECALHO] + _respostas(3, inicio=1)
+
+    df, _, marca_nova, completo = etl.extract_incremental('SID', 'BaseBruta', marca, SessaoFalsa(aba))
+
+    assert completo
+    assert len(df) == 3
+    assert marca_nova['ultimo_timestamp'] == '01/01/2024 10:03:00'
+
+
+def test_incremental_mantem_colunas_categoricas(respostas, tmp_path):
+    novos = respostas.iloc[300:].copy()
+    novos.loc[:, _coluna_bruta(novos, 'internet_estavel')] = 'Às vezes'
+    etl.transform_incremental(respostas.iloc[:300], 'SID', 'BaseBruta', True, str(tmp_path))
+    df = etl.transform_incremental(novos, 'SID', 'BaseBruta', False, str(tmp_path))
+
+    completo = etl.transform(pd.concat([respostas.iloc[:300], novos]))
+    categoricas = [c for c in completo.columns if isinstance(completo[c].dtype, pd.CategoricalDtype)]
+    assert [c for c in df.columns if isinstance(df[c].dtype, pd.CategoricalDtype)] == categoricas
+    assert df['internet_estavel'].astype(object).tolist() == completo['internet_estavel'].astype(object).tolist()
+
+
+# -------------------------------------------------------------------
+# MODELO DE ÁREA DE ATUAÇÃO – DRIFT E REAJUSTE
+# -------------------------------------------------------------------
+AREAS = {
+    'Atenção Básica': 120, 'Atencao basica': 40, 'Atenção primária em saúde': 30,
+    'Saúde da família': 80, 'Estratégia saúde da família': 25,
+    'Vigilância epidemiológica': 60, 'Vigilancia em saude': 20,
+    'Saúde mental': 70, 'CAPS saúde mental': 15,
+    'Urgência e emergência': 50, 'SAMU urgencia': 10,
+    'Gestão hospitalar': 35, 'Gestão em saúde': 30,
+}
+N_GRUPOS = 5
+
+
+def _agrupar(textos: dict, caminho, reajustar: bool = False) -> dict:
+    originais = np.array(list(textos), dtype=object)
+    contagens = np.array(list(textos.values()))
+    nomes = etl.agrupar_areas(originais, contagens, N_GRUPOS, str(caminho), reajustar)
+    return dict(zip(textos, nomes))
+
+
+def _limpo(texto: str) -> str:
+    return etl.limpar_textos(pd.Series([texto], dtype=object)).iloc[0]
+
+
+def _carregar_modelo(caminho) -> dict:
+    with open(caminho, 'rb') as f:
+        return pickle.load(f)
+
+
+@pytest.fixture
+def modelo_ajustado(tmp_path):
+    caminho = tmp_path / 'modelo_area.pkl'
+    grupos = _agrupar(AREAS, caminho)
+    return caminho, grupos, _carregar_modelo(caminho)
+
+
+def test_lote_pequeno_nao_substitui_o_modelo(modelo_ajustado):
+    caminho, grupos, modelo = modelo_ajustado
+
+    lote = {'Atenção Básica': 2, 'Regulação de leitos hospitalares': 1}
+    grupos_lote = _agrupar(lote, caminho)
+    depois = _carregar_modelo(caminho)
+
+    assert depois['ajustado_em'] == modelo['ajustado_em']
+    assert np.array_equal(depois['kmeans'].cluster_centers_, modelo['kmeans'].cluster_centers_)
+    assert grupos_lote['Atenção Básica'] == grupos['Atenção Básica']
+    # Texto novo entra no modelo e as contagens se acumulam
+    assert _limpo('Regulação de leitos hospitalares') in depois['grupos_por_texto']
+    basica = _limpo('Atenção Básica')
+    assert depois['contagens_por_texto'][basica] == modelo['contagens_por_texto'][basica] + 2
+    # Textos já vistos seguem com o mesmo grupo
+    assert _agrupar(AREAS, caminho) == grupos
+
+
+def test_lotes_pequenos_seguidos_nao_disparam_drift(modelo_ajustado):
+    caminho, _, modelo = modelo_ajustado
+    for i in range(5):
+        _agrupar({f'Texto estranho número {"x" * (i + 1)}': 1}, caminho)
+    assert _carregar_modelo(caminho)['ajustado_em'] == modelo['ajustado_em']
+
+
+def test_drift_reajusta_com_o_corpus_acumulado(modelo_ajustado):
+    caminho, _, modelo = modelo_ajustado
+    total = sum(AREAS.values())
+    novos = {'Assistência farmacêutica': total // 2, 'Farmácia hospitalar': total // 2}
+
+    _agrupar(novos, caminho)
+    depois = _carregar_modelo(caminho)
+
+    assert depois['distancias_novos'] == {}
+    assert set(modelo['grupos_por_texto']) < set(depois['grupos_por_texto'])
+    assert len(depois['kmeans'].cluster_centers_) == N_GRUPOS
+    assert depois['contagens_por_texto'][_limpo('Assistência farmacêutica')] == total // 2
+
+
+def test_reajustar_usa_textos_acumulados(modelo_ajustado):
+    caminho, _, modelo = modelo_ajustado
+
+    _agrupar({'Atenção Básica': 1}, caminho, reajustar=True)
+    depois = _carregar_modelo(caminho)
+
+    assert set(depois['grupos_por_texto']) == set(modelo['grupos_por_texto'])
+    assert len(depois['kmeans'].cluster_centers_) == N_GRUPOS
+
+
+# -------------------------------------------------------------------
+# LINHA DE COMANDO – RECORTE DE ETAPAS
+# -------------------------------------------------------------------
+def _nomes(etapas: list) -> list[str]:
+    return [nome for nome, _ in etapas]
+
+
+def test_selecionar_etapas_nao_altera_a_lista_do_modulo():
+    antes = list(etl.ETAPAS_TRANSFORM)
+    etapas = etl.selecionar_etapas(['rename_columns', 'tipar_colunas'])
+
+    assert _nomes(etapas) == ['rename_columns', 'tipar_colunas']
+    assert etl.ETAPAS_TRANSFORM == antes
+
+
+def test_selecionar_etapas_inclui_dependencias():
+    nomes = _nomes(etl.selecionar_etapas(['adicionar_ip_sala_situacao']))
+
+    assert nomes[:2] == ['rename_columns', 'tipar_colunas']
+    assert nomes[-1] == 'adicionar_ip_sala_situacao'
+    assert 'transformar_categoricos_pequenos' in nomes
+    assert _nomes(etl.selecionar_etapas(['normalizar_area_atuacao'])) == ['rename_columns', 'normalizar_area_atuacao']
+
+
+def test_selecionar_etapas_desconhecidas():
+    with pytest.raises(ValueError, match='nao_existe'):
+        etl.selecionar_etapas(['nao_existe'])
+
+
+@pytest.mark.parametrize('argv', [
+    ['--incremental', '--fonte', 'csv', '--origem', 'respostas.csv', '--sink', 'csv'],
+    ['--incremental', '--particionar', '--sheet-id', 'SID'],
+])
+def test_incremental_com_opcoes_incompativeis(argv, capsys):
+    with pytest.raises(SystemExit):
+        etl.ler_argumentos(argv)
+    assert '--incremental' in capsys.readouterr().err
+
+
+def test_ip_sozinho_igual_ao_transform_completo(respostas):
+    completo = etl.transform(respostas)
+    so_ip = etl.transform(respostas, etapas=etl.selecionar_etapas(['adicionar_ip_sala_situacao']))
+
+    assert so_ip['ip_sala_situacao'].notna().any()
+    pd.testing.assert_series_equal(so_ip['ip_sala_situacao'], completo['ip_sala_situacao'])
+
+
+def test_etapas_de_uma_execucao_nao_afetam_a_seguinte(csv_respostas, tmp_path):
+    base = ['--fonte', 'csv', '--origem', csv_respostas, '--sink', 'parquet']
+    etl.main(base + ['--destino', str(tmp_path / 'recorte.parquet'), '--etapas', 'rename_columns', 'tipar_colunas'])
+    etl.main(base + ['--destino', str(tmp_path / 'completo.parquet')])
+
+    recorte = pd.read_parquet(tmp_path / 'recorte.parquet')
+    completo = pd.read_parquet(tmp_path / 'completo.parquet')
+    assert 'ip_sala_situacao' not in recorte.columns
+    assert 'ip_sala_situacao' in completo.columns
+    assert etl.ler_argumentos(base + ['--etapas', 'adicionar_ip_sala_situacao']).etapas == ['adicionar_ip_sala_situacao']
+
+
+# -------------------------------------------------------------------
+# EXECUÇÃO EM LOTE
+# -------------------------------------------------------------------
+def _job_falso(nome, args, processos):
+    if nome == 'derruba':
+        os._exit(3)
+    return {'nome': nome, 'status': 'ok', 'pid': os.getpid(), 'tempo_s': 0.0}
+
+
+def test_worker_que_morre_so_falha_o_proprio_job(monkeypatch):
+    monkeypatch.setattr(etl, '_executar_job', _job_falso)
+    linhas = etl._rodar_jobs([(0, 'a', None), (1, 'derruba', None), (2, 'b', None)], 2)
+
+    assert [(linha['nome'], linha['status']) for linha in linhas] == [('a', 'ok'), ('derruba', 'falha'), ('b', 'ok')]
+    assert 'BrokenProcessPool' in linhas[1]['erro']
+    # Nada roda no processo pai
+    assert all(linha.get('pid') != os.getpid() for linha in linhas)
+
+
+def test_lote_registra_falhas_por_job(csv_respostas, tmp_path):
+    import json
+
+    manifesto = tmp_path / 'manifesto.json'
+    manifesto.write_text(json.dumps([
+        {'nome': 'onda1', 'fonte': 'csv', 'origem': csv_respostas, 'sink': 'parquet',
+         'destino': str(tmp_path / 'onda1.parquet'), 'etapas': ['rename_columns', 'tipar_colunas']},
+        {'nome': 'sem_arquivo', 'fonte': 'csv', 'origem': str(tmp_path / 'nao_existe.csv'), 'sink': 'parquet',
+         'destino': str(tmp_path / 'x.parquet')},
+        {'nome': 'invalida', 'fonte': 'nao_existe'},
+        {'nome': 'onda2', 'fonte': 'csv', 'origem': csv_respostas, 'sink': 'csv',
+         'destino': str(tmp_path / 'onda2.csv')},
+    ]))
+    resumo = etl.executar_lote(str(manifesto), workers=2, caminho_resumo=str(tmp_path / 'resumo.json'))
+
+    assert [job['status'] for job in resumo['jobs']] == ['ok', 'falha', 'falha', 'ok']
+    assert 'FileNotFoundError' in resumo['jobs'][1]['erro']
+    assert resumo['falhas'] == 2
+    # O recorte de etapas do primeiro job não vaza para o seguinte no mesmo worker
+    assert 'ip_sala_situacao' in pd.read_csv(tmp_path / 'onda2.csv', nrows=1).columns
+    assert 'ip_sala_situacao' not in pd.read_parquet(tmp_path / 'onda1.parquet').columns
+
+
+def _agrupar_em_outro_processo(caminho: str, indice: int):
+    textos = np.array([f'Setor {"abcdefghij"[indice]} da regional', 'Atenção Básica'], dtype=object)
+    etl.agrupar_areas(textos, np.array([1, 1]), N_GRUPOS, caminho)
+
+
+def test_jobs_simultaneos_nao_perdem_contagens_do_modelo(modelo_ajustado):
+    from concurrent.futures import ProcessPoolExecutor
+
+    caminho, _, modelo = modelo_ajustado
+    with ProcessPoolExecutor(max_workers=4) as pool:
+        list(pool.map(_agrupar_em_outro_processo, [str(caminho)] * 8, range(8)))
+
+    depois = _carregar_modelo(caminho)
+    basica = _limpo('Atenção Básica')
+    assert depois['contagens_por_texto'][basica] == modelo['contagens_por_texto'][basica] + 8
+    assert sum(depois['contagens_por_texto'].values()) == sum(modelo['contagens_por_texto'].values()) + 16
+
+
+def test_modelo_mantem_as_permissoes(modelo_ajustado):
+    caminho, _, _ = modelo_ajustado
+    os.chmod(caminho, 0o644)
+    _agrupar({'Atenção Básica': 1}, caminho)
+    assert os.stat(caminho).st_mode & 0o777 == 0o644
+
+
+# -------------------------------------------------------------------
+# RELATÓRIO DE QUALIDADE
+# -------------------------------------------------------------------
+def _coluna_bruta(bruto: pd.DataFrame, nome: str) -> str:
+    renomeadas = etl.rename_columns(bruto).columns
+    return bruto.columns[list(renomeadas).index(nome)]
+
+
+def test_escalas_cobrem_as_opcoes_do_formulario(respostas):
+    df = etl.transform(respostas)
+    for coluna in ['televisores', 'projetores']:
+        assert '3 ou mais' in set(df[coluna].dropna())
+        assert (df[coluna] == '3 ou mais').sum() == (df[f'{coluna}_num'] == 3).sum()
+    assert etl.relatorio_qualidade(df, tipado=etl.respostas_tipadas(respostas))['nao_mapeadas'] == {}
+
+
+def test_nao_mapeadas_contadas_antes_da_codificacao(respostas):
+    bruto = respostas.copy()
+    ordinal, ip, radio = (_coluna_bruta(bruto, nome) for nome in
+                          ['webcams_disponiveis', 'conhecimento_lgpd', 'internet_estavel'])
+    bruto.loc[:2, ordinal] = 'Uns 7'
+    bruto.loc[:4, ip] = 'Talvez'
+    bruto.loc[:1, radio] = 'Às vezes'
+
+    df = etl.transform(bruto)
+    # No transformado as respostas da escala e do IP já viraram NaN
+    assert df['webcams_disponiveis'].iloc[:3].isna().all()
+    assert df['ip_seguranca'].iloc[:5].isna().all()
+
+    relatorio = etl.relatorio_qualidade(df, tipado=etl.respostas_tipadas(bruto))
+    assert relatorio['nao_mapeadas'] == {
+        'webcams_disponiveis': {'Uns 7': 3},
+        'conhecimento_lgpd': {'Talvez': 5},
+        'internet_estavel': {'Às vezes': 2},
+    }
+
+
+def test_relatorio_salvo_com_o_bruto(respostas, tmp_path):
+    bruto = respostas.copy()
+    bruto.loc[:2, _coluna_bruta(bruto, 'televisores')] = 'Muitos'
+    caminho = etl.salvar_relatorio_qualidade(etl.transform(bruto), str(tmp_path / "q.json"), bruto=bruto)
+    with open(caminho, encoding="utf-8") as f:
+        relatorio = json.load(f)
+    assert relatorio['linhas'] == len(bruto)
+    assert relatorio['nao_mapeadas'] == {'televisores': {'Muitos': 3}}
+
+
+# -------------------------------------------------------------------
+# CACHE DE ESTÁGIOS
+# -------------------------------------------------------------------
+def _transform_contando(monkeypatch, df, diretorio) -> tuple[pd.DataFrame, list[str]]:
+    """transform_com_cache registrando as etapas que de fato rodaram."""
+    rodadas = []
+    original = etl.aplicar_etapa
+
+    def aplicar(etapa, frame):
+        rodadas.append(etapa.__name__)
+        return original(etapa, frame)
+
+    monkeypatch.setattr(etl, "aplicar_etapa", aplicar)
+    resultado = etl.transform_com_cache(df, "planilha", "aba", diretorio=diretorio)
+    monkeypatch.setattr(etl, "aplicar_etapa", original)
+    return resultado, rodadas
+
+
+def test_cache_reaproveita_estagios(respostas, tmp_path, monkeypatch):
+    primeira, rodadas = _transform_contando(monkeypatch, respostas, str(tmp_path))
+    assert len(rodadas) == len(etl.ETAPAS_TRANSFORM)
+
+    segunda, rodadas = _transform_contando(monkeypatch, respostas, str(tmp_path))
+    assert rodadas == []
+    pd.testing.assert_frame_equal(segunda, primeira, check_dtype=False, check_categorical=False)
+
+
+def test_cache_invalida_com_bruto_alterado(respostas, tmp_path, monkeypatch):
+    _transform_contando(monkeypatch, respostas, str(tmp_path))
+    alterado = respostas.copy()
+    alterado.iloc[0, -1] = "resposta editada"
+    _, rodadas = _transform_contando(monkeypatch, alterado, str(tmp_path))
+    assert len(rodadas) == len(etl.ETAPAS_TRANSFORM)
+
+
+def test_cache_invalida_com_codigo_alterado(respostas, tmp_path, monkeypatch):
+    _transform_contando(monkeypatch, respostas, str(tmp_path))
+    monkeypatch.setattr(etl, "_ASSINATURA_CODIGO", "etl-editado")
+    _, rodadas = _transform_contando(monkeypatch, respostas, str(tmp_path))
+    assert len(rodadas) == len(etl.ETAPAS_TRANSFORM)
+
+
+def test_poda_remove_os_estagios_mais_antigos(tmp_path):
+    pasta = tmp_path / "estagios"
+    pasta.mkdir()
+    for i, chave in enumerate(["antiga", "media", "atual"]):
+        caminho = pasta / f"{chave}.arrow"
+        caminho.write_bytes(b"x" * 1024 * 1024)
+        os.utime(caminho, (1_000_000 + i, 1_000_000 + i))
+
+    # "antiga" é da execução atual e fica; sai a menos usada entre as demais
+    assert etl.podar_estagios(["antiga"], str(tmp_path), limite_mb=2) == ["media"]
+    assert sorted(p.name for p in pasta.iterdir()) == ["antiga.arrow", "atual.arrow"]
+    assert etl.podar_estagios([], str(tmp_path), limite_mb=2) == []
+
+    # ler_estagio renova a data do arquivo, que volta para o fim da fila
+    os.utime(pasta / "antiga.arrow")
+    assert etl.podar_estagios([], str(tmp_path), limite_mb=1) == ["atual"]
+
+
+# -------------------------------------------------------------------
+# LOAD NO SHEETS – LIMITADOR, RETENTATIVAS E STAGING (sem acesso ao Sheets)
+# -------------------------------------------------------------------
+class RespostaFalsa:
+    def __init__(self, codigo: int):
+        self.codigo = codigo
+        self.text = f"erro {codigo}"
+
+    def json(self):
+        return {"error": {"code": self.codigo, "message": self.text}}
+
+
+def _erro_api(codigo: int):
+    import gspread
+
+    return gspread.exceptions.APIError(RespostaFalsa(codigo))
+
+
+class RelogioFalso:
+    def __init__(self):
+        self.agora = 0.0
+        self.esperas = []
+
+    def monotonic(self):
+        return self.agora
+
+    def sleep(self, segundos):
+        self.esperas.append(segundos)
+        self.agora += segundos
+
+
+@pytest.fixture
+def relogio(monkeypatch) -> RelogioFalso:
+    relogio = RelogioFalso()
+    monkeypatch.setattr(etl.time, "monotonic", relogio.monotonic)
+    monkeypatch.setattr(etl.time, "sleep", relogio.sleep)
+    return relogio
+
+
+class AbaSheetsFalsa:
+    def __init__(self, id_: int, title: str, rows: int):
+        self.id, self.title, self.rows = id_, title, rows
+        self.valores = []
+
+    def batch_update(self, lote, **_):
+        self.valores = _aplicar_lotes(self.valores, [lote])
+
+
+class PlanilhaFalsa:
+    """
+    Planilha em memória. `falhas` ({método: [(erro, aplicar_antes)]}) faz a
+    próxima chamada do método levantar o erro, depois de aplicá-la ou não.
+    """
+
+    def __init__(self):
+        self.abas = {}
+        self.chamadas = []
+        self.falhas = {}
+        self._proximo_id = 0
+
+    def _falhar(self, metodo, aplicar):
+        self.chamadas.append(metodo)
+        if self.falhas.get(metodo):
+            erro, aplicar_antes = self.falhas[metodo].pop(0)
+            if aplicar_antes:
+                aplicar()
+            raise erro
+        return aplicar()
+
+    def worksheets(self):
+        return list(self.abas.values())
+
+    def add_worksheet(self, title, rows, cols):
+        def aplicar():
+            if title in self.abas:
+                raise _erro_api(400)
+            self._proximo_id += 1
+            self.abas[title] = AbaSheetsFalsa(self._proximo_id, title, int(rows))
+            return self.abas[title]
+        return self._falhar('add_worksheet', aplicar)
+
+    def del_worksheet(self, ws):
+        def aplicar():
+            if ws.title not in self.abas:
+                raise _erro_api(400)
+            del self.abas[ws.title]
+        return self._falhar('del_worksheet', aplicar)
+
+    def batch_update(self, corpo):
+        por_id = {ws.id: ws for ws in self.abas.values()}
+
+        def aplicar():
+            if any(r.get('deleteSheet', {}).get('sheetId', 0) not in por_id for r in corpo['requests']
+                   if 'deleteSheet' in r):
+                raise _erro_api(400)
+            for requisicao in corpo['requests']:
+                if 'updateSheetProperties' in requisicao:
+                    propriedades = requisicao['updateSheetProperties']['properties']
+                    ws = por_id[propriedades['sheetId']]
+                    grade = propriedades.get('gridProperties', {})
+                    rows = grade.get('rowCount', ws.rows)
+                    if grade.get('frozenRowCount', 0) >= rows:
+                        raise _erro_api(400)
+                    ws.rows = rows
+                    if 'title' in propriedades:
+                        del self.abas[ws.title]
+                        ws.title = propriedades['title']
+                        self.abas[ws.title] = ws
+                elif 'updateCells' in requisicao:
+                    por_id[requisicao['updateCells']['range']['sheetId']].valores = []
+                elif 'copyPaste' in requisicao:
+                    copia = requisicao['copyPaste']
+                    origem = por_id[copia['source']['sheetId']].valores
+                    por_id[copia['destination']['sheetId']].valores = [list(linha) for linha in origem]
+                elif 'deleteSheet' in requisicao:
+                    del self.abas[por_id[requisicao['deleteSheet']['sheetId']].title]
+        return self._falhar('batch_update', aplicar)
+
+
+class SessaoSheetsFalsa:
+    def __init__(self, planilha: PlanilhaFalsa):
+        self._planilha = planilha
+
+    def planilha(self, sheet_id):
+        return self._planilha
+
+    def abas(self, sheet_id):
+        return dict(self._planilha.abas)
+
+    def esquecer_aba(self, sheet_id, *tab_names):
+        pass
+
+
+def _carregar(planilha: PlanilhaFalsa, df: pd.DataFrame):
+    etl.load_to_sheet(SessaoSheetsFalsa(planilha), 'SID', df, 'DadosEtl')
+
+
+def test_limitador_libera_rajada_e_depois_espera(relogio):
+    limitador = etl.LimitadorTaxa(60, capacidade=3)
+    for _ in range(3):
+        limitador.aguardar()
+    assert relogio.esperas == []
+
+    limitador.aguardar()
+    assert relogio.esperas == [pytest.approx(1.0)]
+
+
+def test_chamar_sheets_repete_erros_temporarios(relogio):
+    erros = [_erro_api(503), OSError("conexão caiu"), _erro_api(429)]
+
+    def funcao():
+        if erros:
+            raise erros.pop(0)
+        return "ok"
+
+    assert etl.chamar_sheets(funcao, limitador=etl.LimitadorTaxa(6000)) == "ok"
+    assert len(relogio.esperas) == 3
+
+
+def test_chamar_sheets_nao_repete_erro_do_pedido(relogio):
+    import gspread
+
+    chamadas = []
+
+    def funcao():
+        chamadas.append(1)
+        raise _erro_api(400)
+
+    with pytest.raises(gspread.exceptions.APIError):
+        etl.chamar_sheets(funcao, limitador=etl.LimitadorTaxa(6000))
+    assert len(chamadas) == 1
+
+
+def test_load_cria_destino_so_com_cabecalho(relogio):
+    planilha = PlanilhaFalsa()
+    _carregar(planilha, pd.DataFrame(columns=['a', 'b']))
+    assert list(planilha.abas) == ['DadosEtl']
+    assert planilha.abas['DadosEtl'].valores == [['a', 'b']]
+
+
+def test_load_mantem_id_da_aba_e_remove_staging_antigo(relogio):
+    planilha = PlanilhaFalsa()
+    _carregar(planilha, pd.DataFrame({'a': [1, 2]}))
+    id_destino = planilha.abas['DadosEtl'].id
+    planilha.add_worksheet(f"DadosEtl{etl.SUFIXO_STAGING}", 10, 1)
+
+    _carregar(planilha, pd.DataFrame({'a': [3]}))
+    assert list(planilha.abas) == ['DadosEtl']
+    assert planilha.abas['DadosEtl'].id == id_destino
+    assert planilha.abas['DadosEtl'].valores == [['a'], [3]]
+
+
+def test_load_nao_repete_chamadas_ja_aplicadas(relogio):
+    planilha = PlanilhaFalsa()
+    _carregar(planilha, pd.DataFrame({'a': [1]}))
+    planilha.add_worksheet(f"DadosEtl{etl.SUFIXO_STAGING}", 10, 1)
+    # Cada chamada não idempotente é aplicada e mesmo assim responde 503
+    planilha.falhas = {metodo: [(_erro_api(503), True)]
+                       for metodo in ['add_worksheet', 'del_worksheet', 'batch_update']}
+    planilha.chamadas = []
+
+    _carregar(planilha, pd.DataFrame({'a': [2]}))
+    assert list(planilha.abas) == ['DadosEtl']
+    assert planilha.abas['DadosEtl'].valores == [['a'], [2]]
+    assert planilha.chamadas == ['del_worksheet', 'add_worksheet', 'batch_update']
+
+
+def test_load_repete_chamada_nao_aplicada(relogio):
+    planilha = PlanilhaFalsa()
+    planilha.falhas = {'add_worksheet': [(OSError("timeout"), False)]}
+    _carregar(planilha, pd.DataFrame({'a': [1]}))
+    assert planilha.chamadas == ['add_worksheet', 'add_worksheet', 'batch_update']
+    assert planilha.abas['DadosEtl'].valores == [['a'], [1]]
+
+
+# -------------------------------------------------------------------
+# FERRAMENTAS DE ANÁLISE – CATEGORIZADOR EM UMA PASSADA
+# -------------------------------------------------------------------
+def _categorizar_padrao_a_padrao(texto) -> set:
+    """Classificação original: testa cada padrão e palavra-chave em sequência."""
+    if pd.isna(texto) or texto == '':
+        return {'Outras Ferramentas'}
+    texto = str(texto).strip().lower()
+    if any(frase in texto for frase in etl.FRASES_SEM_FERRAMENTA):
+        return {'Outras Ferramentas'}
+
+    categorias = {categoria for padrao, categoria in etl.MAPEAMENTO_FERRAMENTAS.items() if padrao.lower() in texto}
+    for categoria, palavras in etl.PALAVRAS_CHAVE_FERRAMENTAS.items():
+        if any(palavra in texto for palavra in palavras):
+            categorias.add(categoria)
+    return categorias or {'Outras Ferramentas'}
+
+
+FERRAMENTAS_DIFICEIS = [
+    None, '', '   ', 'Power BI', 'power bi e Excel', 'Simulação no calc', 'Sistema e-SUS e SINASC',
+    'Não faz análise, só Excel', 'NENHUMA FERRAMENTA', 'Painéis e slides', 'bibliografia', 'caderno',
+    'Planilhas (Excel, Google Sheets, etc.), Apresentações (PowerPoint, Google Slides, etc.)',
+    'Painéis de BI (Qlik Sense, Power BI, Looker Studio, Oracle, Sistema de Monitoramento da APS, etc.)',
+]
+
+
+def test_categorizador_igual_ao_original(respostas):
+    textos = pd.Series(list(etl.rename_columns(respostas)['ferramentas_analise']) + FERRAMENTAS_DIFICEIS)
+    novas = etl.transformar_ferramentas_analise(pd.DataFrame({'ferramentas_analise': textos}))
+
+    for categoria in etl.CATEGORIAS_FERRAMENTAS:
+        esperado = [int(categoria in _categorizar_padrao_a_padrao(texto)) for texto in textos]
+        assert novas[etl._nome_coluna_ferramenta(categoria)].tolist() == esperado, categoria
+    principais = [etl._nome_coluna_ferramenta(c) for c in etl.CATEGORIAS_FERRAMENTAS[:-1]]
+    assert novas['qtd_ferramentas'].tolist() == [sum(novas[c][i] for c in principais) for i in range(len(textos))]
+
+
+# -------------------------------------------------------------------
+# DESTINOS (SINKS) LOCAIS
+# -------------------------------------------------------------------
+@pytest.fixture(scope="module")
+def transformado(respostas) -> pd.DataFrame:
+    return etl.transform(respostas)
+
+
+def _ler_destino(sink: str, caminho: str, tabela: str = "DadosEtl") -> pd.DataFrame:
+    if sink == 'parquet':
+        return pd.read_parquet(caminho)
+    if sink == 'csv':
+        return etl.extract_csv(caminho)
+    if sink == 'sqlite':
+        import sqlite3
+
+        with sqlite3.connect(caminho) as conn:
+            lido = pd.read_sql(f'SELECT * FROM "{tabela}"', conn)
+        conn.close()
+        return lido
+    import duckdb
+
+    with duckdb.connect(caminho) as conn:
+        return conn.execute(f'SELECT * FROM "{tabela}"').df()
+
+
+def _esperado_no_destino(sink: str, df: pd.DataFrame) -> pd.DataFrame:
+    if sink == 'parquet':
+        return df
+    if sink == 'csv':
+        # CSV guarda o mesmo texto enviado ao Sheets
+        valores = etl.preparar_valores(df)
+        return pd.DataFrame(valores[1:], columns=valores[0]).astype(str)
+    return etl._categorias_para_texto(df)
+
+
+@pytest.mark.parametrize('sink', ['parquet', 'csv', 'sqlite', 'duckdb'])
+def test_destino_local_ida_e_volta(sink, transformado, tmp_path):
+    caminho = str(tmp_path / "saida" / f"dados.{etl.EXTENSOES_SINK[sink]}")
+    etl.load(transformado, sink, caminho)
+    # Uma segunda carga substitui a anterior em vez de acrescentar
+    etl.load(transformado, sink, caminho)
+
+    pd.testing.assert_frame_equal(_ler_destino(sink, caminho), _esperado_no_destino(sink, transformado),
+                                  check_dtype=False, check_categorical=False)
+    assert not os.path.exists(caminho + ".tmp")
+
+
+def test_destino_desconhecido(transformado):
+    with pytest.raises(ValueError, match='xml'):
+        etl.load(transformado, 'xml', 'dados.xml')
+
+
+# -------------------------------------------------------------------
+# FONTES (SOURCES) LOCAIS
+# -------------------------------------------------------------------
+def _gravar_xlsx(df: pd.DataFrame, caminho: str):
+    from openpyxl import Workbook
+
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet("Respostas")
+    ws.append(df.columns.tolist())
+    for linha in df.itertuples(index=False):
+        ws.append(list(linha))
+    wb.save(caminho)
+
+
+def _gravar_forms_json(n: int, caminho: str) -> pd.DataFrame:
+    """Export da Forms API com n respostas e o DataFrame que a planilha teria."""
+    colunas = etl.colunas_do_formulario()
+    respostas, linhas = [], []
+    for i in range(n):
+        # 13:00 UTC é 10:00 no fuso do formulário
+        resposta = {"lastSubmittedTime": f"2024-03-{i % 28 + 1:02d}T13:00:00.000Z", "answers": {}}
+        linha = [f"{i % 28 + 1:02d}/03/2024 10:00:00"]
+        for j, (question_id, _) in enumerate(colunas):
+            valores = [f"resposta {i}.{j}"] + ([f"outra {i}"] if j % 5 == 0 else [])
+            if (i + j) % 7 == 0:
+                valores = []
+            if valores:
+                resposta["answers"][question_id] = {"textAnswers": {"answers": [{"value": v} for v in valores]}}
+            linha.append(", ".join(valores))
+        respostas.append(resposta)
+        linhas.append(linha)
+    with open(caminho, "w", encoding="utf-8") as f:
+        json.dump({"responses": respostas}, f, ensure_ascii=False)
+    return pd.DataFrame(linhas, columns=[etl.COLUNA_TIMESTAMP] + [titulo for _, titulo in colunas])
+
+
+def test_fonte_csv_igual_ao_original(respostas, csv_respostas):
+    pd.testing.assert_frame_equal(etl.extract_source('csv', csv_respostas), respostas.astype(str),
+                                  check_dtype=False)
+
+
+def test_fonte_xlsx_igual_ao_original(respostas, tmp_path):
+    caminho = str(tmp_path / "respostas.xlsx")
+    _gravar_xlsx(respostas, caminho)
+    pd.testing.assert_frame_equal(etl.extract_source('xlsx', caminho), respostas.astype(str),
+                                  check_dtype=False)
+
+
+def test_fonte_forms_json_no_layout_da_planilha(tmp_path):
+    caminho = str(tmp_path / "respostas.json")
+    esperado = _gravar_forms_json(12, caminho)
+    pd.testing.assert_frame_equal(etl.extract_source('forms_json', caminho), esperado, check_dtype=False)
+
+
+@pytest.mark.parametrize('fonte', ['xlsx', 'forms_json'])
+@pytest.mark.parametrize('linhas, blocos', [(0, [0]), (8, [4, 4]), (9, [4, 4, 1])])
+def test_fonte_em_blocos_sem_bloco_vazio_no_fim(fonte, linhas, blocos, respostas, tmp_path):
+    if fonte == 'xlsx':
+        caminho = str(tmp_path / "respostas.xlsx")
+        _gravar_xlsx(respostas.iloc[:linhas], caminho)
+        colunas = respostas.columns.tolist()
+    else:
+        caminho = str(tmp_path / "respostas.json")
+        colunas = _gravar_forms_json(linhas, caminho).columns.tolist()
+
+    lidos = list(etl.iterar_fonte(fonte, caminho, chunksize=4))
+    assert [len(bloco) for bloco in lidos] == blocos
+    assert all(bloco.columns.tolist() == colunas for bloco in lidos)
+
+
+# -------------------------------------------------------------------
+# IP-SALASIT – MOTOR DECLARATIVO x CÁLCULO ORIGINAL
+# -------------------------------------------------------------------
+def _ip_original(df: pd.DataFrame) -> pd.DataFrame:
+    """Os _pontuar_* originais (sem os logs), uma expressão por dimensão."""
+    df = df.astype(object)
+    sim_parcial = etl.RESPOSTA_SIM_PARCIAL
+
+    def numero(coluna, padrao):
+        return pd.to_numeric(df[coluna], errors='coerce').fillna(padrao)
+
+    def igual(coluna, valor):
+        return (df[coluna] == valor).astype(int)
+
+    pessoas = (
+        numero('competencia_tecnica_equipe_num', 1) / 5 * 40
+        + df['participa_qualificacoes'].map({'Sim, regularmente (ao menos uma vez por ano)': 1,
+                                             'Sim, mas esporadicamente': 0.5, 'Não': 0}).fillna(0) * 25
+        + df['cultura_uso_dados'].map(etl.DIMENSOES_IP['ip_pessoas']['itens'][2]['mapa']).fillna(0) * 25
+        + np.minimum(numero('qtd_ferramentas', 0), 4) / 4 * 10
+    ).clip(0, 100)
+    infra = (
+        numero('estacoes_trabalho_boas_num', 0) / 25 * 30
+        + numero('notebooks_boas_num', 0) / 6 * 15
+        + igual('internet_estavel', 'Sim') * 20 + numero('qualidade_internet_num', 0) / 10 * 10
+        + igual('sala_situacao', 'Sim, possui uma sala adequada') * 20
+        + igual('cabos_adaptadores', 'Sim, para todos os equipamentos') * 5
+    ).clip(0, 100)
+    processos = (
+        igual('indicadores_definidos', 'Sim') * 20
+        + df['dados_subsidiam_metas'].map(sim_parcial) * 15
+        + df['metas_base_dados'].map(sim_parcial) * 15
+        + igual('fluxos_formalizados', 'Sim') * 15
+        + igual('rotina_validacao', 'Sim') * 20
+        + df['paineis_tomada_decisao'].map(sim_parcial) * 15
+    ).clip(0, 100)
+    seguranca = (
+        df['conhecimento_lgpd'].map({'Sim': 1, 'Tenho uma noção, mas não conheço em detalhes': 0.5, 'Não': 0}) * 30
+        + df['treinamento_lgpd'].map({'Sim': 1, 'Apenas orientações informais': 0.5, 'Não': 0}) * 25
+        + df['acesso_individualizado'].map({'Sim': 1, 'Em parte (alguns sistemas sim, outros não)': 0.5,
+                                            'Não, os acessos são compartilhados': 0}) * 25
+        + igual('protocolos_backup', 'Sim') * 20
+    ).clip(0, 100)
+
+    resultado = pd.DataFrame({'ip_pessoas': pessoas, 'ip_infra': infra,
+                              'ip_processos': processos, 'ip_seguranca': seguranca}).astype(float)
+    resultado['ip_sala_situacao'] = (0.30 * pessoas + 0.30 * infra + 0.25 * processos
+                                     + 0.15 * seguranca).astype(float).round(2)
+    return resultado
+
+
+def test_ip_igual_ao_calculo_original(transformado):
+    df = transformado.copy()
+    # Respostas em branco e fora dos mapas nas primeiras linhas
+    for coluna in ['participa_qualificacoes', 'dados_subsidiam_metas', 'conhecimento_lgpd', 'internet_estavel']:
+        df[coluna] = df[coluna].astype(object)
+        df.loc[:3, coluna] = [None, '', 'Talvez', 'Não sei informar']
+    df.loc[:1, 'competencia_tecnica_equipe_num'] = np.nan
+
+    pd.testing.assert_frame_equal(etl.pontuar_dimensoes(df), _ip_original(df), check_exact=True)
+
+
+# -------------------------------------------------------------------
+# TRANSFORM E LOAD EM BLOCOS
+# -------------------------------------------------------------------
+@pytest.mark.parametrize('chunksize, tamanhos', [(100, [100] * 4), (150, [150, 150, 100])])
+def test_blocos_iguais_ao_transform_completo(chunksize, tamanhos, csv_respostas):
+    completo = etl.transform(etl.extract_csv(csv_respostas))
+    blocos = list(etl.transform_em_blocos(partial(etl.iterar_fonte, 'csv', csv_respostas, chunksize=chunksize)))
+
+    assert [len(bloco) for bloco in blocos] == tamanhos
+    pd.testing.assert_frame_equal(pd.concat(blocos, ignore_index=True), completo)
+
+
+@pytest.mark.parametrize('sink', ['parquet', 'csv', 'sqlite', 'duckdb'])
+def test_load_em_blocos_igual_ao_load(sink, csv_respostas, tmp_path):
+    extensao = etl.EXTENSOES_SINK[sink]
+    etl.load(etl.transform(etl.extract_csv(csv_respostas)), sink, str(tmp_path / f"completo.{extensao}"))
+    blocos = etl.transform_em_blocos(partial(etl.iterar_fonte, 'csv', csv_respostas, chunksize=100))
+    linhas = etl.load_em_blocos(blocos, sink, str(tmp_path / f"blocos.{extensao}"))
+
+    completo = _ler_destino(sink, str(tmp_path / f"completo.{extensao}"))
+    assert linhas == len(completo)
+    pd.testing.assert_frame_equal(_ler_destino(sink, str(tmp_path / f"blocos.{extensao}")), completo)
+
+
+# -------------------------------------------------------------------
+# SISTEMAS DE INFORMAÇÃO – MATRIZ DE USO E AVALIAÇÃO
+# -------------------------------------------------------------------
+def _sistemas_coluna_a_coluna(df: pd.DataFrame) -> pd.DataFrame:
+    """tratar_sistemas_e_qualidade original: uma passada de str.contains por sistema."""
+    utilizados = df['sistemas_informacao_utilizados'].astype(object).fillna('').str.strip()
+    resultado = {'sistemas_informacao_utilizados': utilizados}
+    for sistema in etl.SISTEMAS_INFORMACAO:
+        col_uso, col_qualidade = etl.COLUNAS_SISTEMAS[sistema]
+        resultado[col_uso] = utilizados.str.contains(sistema, case=False, regex=False).astype(int)
+        qualidade = df[col_qualidade].astype(object)
+        resultado[col_uso.replace('usou_', 'avaliou_', 1)] = (
+            qualidade.notna() & ~qualidade.isin(['', 'Não se aplica'])).astype(int)
+    resultado = pd.DataFrame(resultado)
+    uso = resultado[[etl.COLUNAS_SISTEMAS[s][0] for s in etl.SISTEMAS_INFORMACAO]].to_numpy()
+    avaliou = resultado[[etl.COLUNAS_SISTEMAS[s][0].replace('usou_', 'avaliou_', 1)
+                         for s in etl.SISTEMAS_INFORMACAO]].to_numpy()
+    resultado['sistemas_inconsistentes'] = ((avaliou == 1) & (uso == 0)).sum(axis=1)
+    resultado['total_sistemas_usados'] = uso.sum(axis=1)
+    resultado['total_sistemas_avaliados'] = avaliou.sum(axis=1)
+    return resultado
+
+
+def test_sistemas_iguais_ao_calculo_original(respostas):
+    # Só respostas com opções do formulário: em texto livre ("SIM e SINASC")
+    # o original contava qualquer trecho e a matriz só conta opções inteiras
+    tipado = etl.respostas_tipadas(respostas)
+    opcoes = set(etl.compilar_schema()['plano']['sistemas_informacao_utilizados']['opcoes'])
+    so_opcoes = tipado['sistemas_informacao_utilizados'].astype(object).fillna('').map(
+        lambda texto: all(parte in opcoes for parte in texto.split(', ') if parte))
+    assert so_opcoes.mean() > 0.5
+    tipado = tipado[so_opcoes.to_numpy()]
+
+    novas = pd.DataFrame(etl.tratar_sistemas_e_qualidade(tipado), index=tipado.index)
+    esperado = _sistemas_coluna_a_coluna(tipado)
+    pd.testing.assert_frame_equal(novas[esperado.columns], esperado, check_dtype=False)
+    # Texto livre como as demais colunas, não object
+    assert novas['sistemas_informacao_utilizados'].dtype == etl.rename_columns(respostas)[
+        'sistemas_informacao_utilizados'].dtype
+
+
+def test_sistemas_so_contam_opcoes_inteiras():
+    df = pd.DataFrame({'sistemas_informacao_utilizados': ['SIMULADOR, Sisvan', 'sim, SINASC', None]})
+    for _, col_qualidade in etl.COLUNAS_SISTEMAS.values():
+        df[col_qualidade] = ['Bom', '', 'Não se aplica']
+    novas = etl.tratar_sistemas_e_qualidade(df)
+
+    assert list(novas['usou_sim']) == [0, 1, 0]
+    assert list(novas['usou_sisvan']) == [1, 0, 0]
+    assert list(novas['usou_sinasc']) == [0, 1, 0]
+    assert list(novas['total_sistemas_avaliados']) == [len(etl.SISTEMAS_INFORMACAO), 0, 0]
+    assert list(novas['sistemas_inconsistentes']) == [len(etl.SISTEMAS_INFORMACAO) - 1, 0, 0]
+
+
+# -------------------------------------------------------------------
+# ETAPAS EM PARALELO (ONDAS)
+# -------------------------------------------------------------------
+@pytest.mark.parametrize('modo', ['threads', 'processos'])
+def test_ondas_iguais_ao_sequencial(modo, respostas, transformado):
+    pd.testing.assert_frame_equal(etl.transform(respostas, modo=modo, workers=2), transformado)
+
+
+def test_ondas_respeitam_a_ordem_das_etapas():
+    ondas = etl.ondas_de_execucao()
+    nomes = [nome for nome, _ in etl.ETAPAS_TRANSFORM]
+    assert sorted(nome for onda in ondas for nome, _ in onda) == sorted(nomes)
+    posicao = {nome: i for i, onda in enumerate(ondas) for nome, _ in onda}
+    declaradas = etl.colunas_das_etapas()
+    for i, nome in enumerate(nomes):
+        for anterior in nomes[:i]:
+            if etl._conflitam(declaradas[nome], declaradas[anterior]):
+                assert posicao[anterior] < posicao[nome], (anterior, nome)
+    assert any(len(onda) > 1 for onda in ondas)
+
+
+def test_etapas_so_escrevem_colunas_declaradas(respostas):
+    declaradas = etl.colunas_das_etapas()
+    df = respostas
+    for nome, etapa in etl.ETAPAS_TRANSFORM:
+        resultado = etapa(df)
+        _, escreve = declaradas[nome]
+        if escreve is not None:
+            assert set(resultado) <= escreve, nome
+        df = etl.juntar_colunas(df, resultado)
+
+
+# -------------------------------------------------------------------
+# PROCESSAMENTO POR DISTRITO
+# -------------------------------------------------------------------
+@pytest.mark.parametrize('modo', ['sequencial', 'threads'])
+def test_particoes_consolidadas_iguais_ao_transform(modo, respostas, transformado, tmp_path):
+    particoes = etl.transform_particionado(respostas, modo=modo, diretorio=str(tmp_path))
+    assert len(particoes) > 1
+    pd.testing.assert_frame_equal(etl.consolidar_particoes(particoes), transformado)
+
+    # Segunda execução toda do cache, com o mesmo resultado
+    particoes = etl.transform_particionado(respostas, modo=modo, diretorio=str(tmp_path))
+    pd.testing.assert_frame_equal(etl.consolidar_particoes(particoes), transformado)
+
+
+def test_particoes_so_recalculam_distritos_alterados(respostas, tmp_path, monkeypatch):
+    transformadas = []
+    original = etl.executar_em_pool
+
+    def executar(funcao, argumentos, *args, **kwargs):
+        transformadas.append(len(argumentos))
+        return original(funcao, argumentos, *args, **kwargs)
+
+    monkeypatch.setattr(etl, "executar_em_pool", executar)
+    particoes = etl.transform_particionado(respostas, diretorio=str(tmp_path))
+
+    # Troca uma resposta por outra já existente: as estatísticas globais não mudam
+    alterado = respostas.copy()
+    coluna = _coluna_bruta(alterado, 'ferramentas_analise')
+    alterado.loc[0, coluna] = next(valor for valor in alterado[coluna] if valor != alterado.loc[0, coluna])
+    etl.transform_particionado(alterado, diretorio=str(tmp_path))
+
+    assert transformadas == [len(particoes), 1]
+
+
+def test_destinos_das_particoes():
+    assert etl.destino_derivado("DadosEtl", "Brotas", "sheets") == "DadosEtl - Brotas"
+    assert etl.destino_derivado("saida/dados.parquet", "Barra/Rio Vermelho", "parquet") == \
+        "saida/dados_barra_rio_vermelho.parquet"
+    assert etl.destino_derivado("dados.csv", "São Caetano/Valéria", "csv") == "dados_sao_caetano_valeria.csv"
+
+
+# -------------------------------------------------------------------
+# CUBO DE AGREGADOS
+# -------------------------------------------------------------------
+def test_cubo_igual_a_filtrar_linha_a_linha(transformado):
+    cubo = etl.criar_cubo(transformado)
+    medidas = etl.medidas_cubo(transformado)
+    dimensoes = [d for d in etl.DIMENSOES_CUBO if d in transformado.columns]
+    chaves = transformado[dimensoes].astype(object).fillna('')
+
+    # Uma linha por combinação observada em cada subconjunto das dimensões + total geral
+    esperadas = sum(len(chaves[[d for d in dimensoes if d in grupo]].drop_duplicates())
+                    for k in range(1, len(dimensoes) + 1) for grupo in combinations(dimensoes, k)) + 1
+    assert len(cubo) == esperadas
+
+    for _, linha in cubo.sample(40, random_state=1).iterrows():
+        filtro = np.ones(len(transformado), dtype=bool)
+        for d in dimensoes:
+            if linha[d] != etl.TOTAL_CUBO:
+                filtro &= (chaves[d] == linha[d]).to_numpy()
+        assert linha['n_respostas'] == filtro.sum()
+        esperado = medidas[filtro].mean().round(4)
+        pd.testing.assert_series_equal(linha[esperado.index].astype(float), esperado,
+                                       check_names=False, atol=1e-4)
+
+
+def test_cubo_total_geral(transformado):
+    cubo = etl.criar_cubo(transformado)
+    total = cubo[(cubo[etl.DIMENSOES_CUBO] == etl.TOTAL_CUBO).all(axis=1)]
+    assert len(total) == 1
+    assert total['n_respostas'].iloc[0] == len(transformado)
+    assert total['media_ip_sala_situacao'].iloc[0] == pytest.approx(transformado['ip_sala_situacao'].mean(), abs=1e-4)
+
+
+# -------------------------------------------------------------------
+# CODIFICAÇÃO ORDINAL (CATEGÓRICOS E ESCALAS)
+# -------------------------------------------------------------------
+# Mapeamentos originais de transformar_categoricos_grandes/_pequenos
+NUMEROS_ORIGINAIS = {
+    'categoricos_grandes': {'1 a 10': 5, '11 a 15': 13, '16 a 20': 18, '21 ou mais': 25, 'Nenhum': 0},
+    'categoricos_pequenos': {'Nenhum': 0, '1': 1, '2': 2, '3 a 5': 4, '6 ou mais': 6},
+}
+FAIXAS_ORIGINAIS = {
+    'categoricos_grandes': {'Nenhum': 'Baixa', '1 a 10': 'Baixa', '11 a 15': 'Média', '16 a 20': 'Alta',
+                            '21 ou mais': 'Muito Alta'},
+    'categoricos_pequenos': {'Nenhum': 'Baixa', '1': 'Baixa', '2': 'Média', '3 a 5': 'Alta', '6 ou mais': 'Muito Alta'},
+}
+
+
+def _respostas_da_escala(escala: dict) -> list:
+    return [nivel for nivel, _, _ in escala['niveis']] + ['', 'fora da tabela', None]
+
+
+@pytest.mark.parametrize('nome', list(etl.ESCALAS_ORDINAIS))
+@pytest.mark.parametrize('categorica', [False, True])
+def test_codificacao_segue_a_tabela_de_niveis(nome, categorica):
+    escala = etl.ESCALAS_ORDINAIS[nome]
+    valores = _respostas_da_escala(escala) * 2
+    serie = pd.Series(valores, dtype='category' if categorica else object)
+    ordenada, numeros, faixas = etl.codificar_ordinal(serie, escala['niveis'])
+
+    tabela = {nivel: (numero, faixa) for nivel, numero, faixa in escala['niveis']}
+    assert ordenada.cat.ordered and ordenada.cat.categories.tolist() == list(tabela)
+    for valor, codificado, numero, faixa in zip(valores, ordenada, numeros, faixas):
+        if valor in tabela:
+            assert codificado == valor
+            esperado = tabela[valor][0]
+            assert (np.isnan(numero) if esperado is None else numero == esperado), valor
+            assert faixa == tabela[valor][1]
+        else:
+            assert pd.isna(codificado) and np.isnan(numero) and faixa == etl.FAIXA_NAO_INFORMADO
+
+
+@pytest.mark.parametrize('nome', list(NUMEROS_ORIGINAIS))
+def test_codificacao_igual_a_original(nome, respostas):
+    escala = etl.ESCALAS_ORDINAIS[nome]
+    tipado = etl.respostas_tipadas(respostas)
+    novas = etl.codificar_escalas(tipado, escala)
+    for coluna in escala['colunas']:
+        originais = tipado[coluna].astype(object)
+        esperado = originais.map(NUMEROS_ORIGINAIS[nome]).astype(float)
+        conhecidas = originais.isin(list(NUMEROS_ORIGINAIS[nome])).to_numpy()
+        # '3 ou mais' (televisores, projetores) não estava nos mapas originais
+        np.testing.assert_array_equal(novas[f'{coluna}_num'].to_numpy()[conhecidas], esperado[conhecidas])
+        faixas = originais.map(FAIXAS_ORIGINAIS[nome]).fillna(etl.FAIXA_NAO_INFORMADO)
+        assert list(novas[f'{coluna}_cat_simples'][conhecidas]) == list(faixas[conhecidas])
+        fora = ~conhecidas & (originais != '3 ou mais').to_numpy()
+        assert set(novas[f'{coluna}_cat_simples'][fora]) <= {etl.FAIXA_NAO_INFORMADO}
+
+
+# -------------------------------------------------------------------
+# MODO ASSÍNCRONO – LEITURA ADIANTADA E GRAVAÇÕES SIMULTÂNEAS
+# -------------------------------------------------------------------
+@pytest.mark.parametrize('sink', ['csv', 'parquet'])
+def test_blocos_assincrono_igual_ao_sincrono(sink, csv_respostas, tmp_path):
+    abrir = partial(etl.iterar_fonte, 'csv', csv_respostas, chunksize=100)
+    sincrono, assincrono = (str(tmp_path / f"{nome}.{sink}") for nome in ['sincrono', 'assincrono'])
+    etl.load_em_blocos(etl.transform_em_blocos(abrir), sink, sincrono)
+    etl.load_em_blocos_assincrono(abrir, sink, assincrono)
+
+    pd.testing.assert_frame_equal(_ler_destino(sink, assincrono), _ler_destino(sink, sincrono))
+
+
+def test_blocos_assincrono_propaga_erro_de_leitura(csv_respostas, tmp_path):
+    def abrir():
+        blocos = etl.iterar_fonte('csv', csv_respostas, chunksize=100)
+        yield next(blocos)
+        raise OSError("conexão perdida")
+
+    destino = tmp_path / "saida.csv"
+    with pytest.raises(OSError, match="conexão perdida"):
+        etl.load_em_blocos_assincrono(abrir, 'csv', str(destino))
+    assert not destino.exists()
+
+
+def test_pipeline_assincrono_igual_ao_sincrono(csv_respostas, tmp_path):
+    base = ['--fonte', 'csv', '--origem', csv_respostas, '--sink', 'parquet', '--particionar', '--cubo']
+    etl.main(base + ['--destino', str(tmp_path / 'sincrono' / 'dados.parquet')])
+    etl.main(base + ['--destino', str(tmp_path / 'assincrono' / 'dados.parquet'), '--assincrono'])
+
+    sincronos = sorted(p.name for p in (tmp_path / 'sincrono').iterdir())
+    assert sincronos == sorted(p.name for p in (tmp_path / 'assincrono').iterdir())
+    assert len(sincronos) > 3
+    for nome in sincronos:
+        pd.testing.assert_frame_equal(pd.read_parquet(tmp_path / 'assincrono' / nome),
+                                      pd.read_parquet(tmp_path / 'sincrono' / nome))